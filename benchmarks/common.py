@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 22:50
+"""
+Setup shared by the benchmarks which run myvc in process against the fake docker client.
+myvc keeps its data under $HOME/.myvc, so HOME must be set before myvc_app is imported.
+"""
+import atexit
+import json
+import os
+import pathlib
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+SRC_DIR = BENCHMARKS_DIR.parent.joinpath('src')
+
+
+def prepare(home: str = None) -> str:
+    """
+    Use a fresh (or the given) HOME and the fake docker client, then set up the metadata db.
+    The fresh HOME and the files of the fake client are removed at exit.
+    """
+    is_temp_home = not home
+    home = home or tempfile.mkdtemp(prefix='myvc_benchmark_')
+    os.environ['HOME'] = home
+    # registered before myvc_app is imported, so it runs after the exit handlers of myvc_app
+    atexit.register(_cleanup, home if is_temp_home else None)
+    sys.path.insert(0, str(SRC_DIR))
+    import fake_docker
+    fake_docker.install()
+    from myvc_app import init
+    init.setup()
+    # the reclaimer process would connect to the real docker, volumes are reclaimed in process instead
+    from myvc_app import reclaim
+    reclaim.start_background = lambda: None
+    # and so would the compactor, the benchmarks measure the switches without the compaction
+    from myvc_app import compaction
+    compaction.start_background = lambda versions: None
+    return home
+
+
+def _cleanup(home: str = None):
+    myvc_methods = sys.modules.get('myvc_app.methods')
+    if myvc_methods and myvc_methods._client:
+        myvc_methods._client.close()
+    if home:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def timer(results: dict, key: str):
+    start = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - start
+    print('{:<40} {:.3f}s'.format(key, results[key]), flush=True)
+
+
+def get_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).stdout.strip()
+    except OSError:
+        return ''
+
+
+def write_results(output: str, benchmark: str, results: dict):
+    """Append the results as a json line, see compare.py."""
+    if not output:
+        return
+    with open(output, 'a') as f:
+        f.write(json.dumps({
+            'benchmark': benchmark, 'time': time.time(), 'revision': get_revision(),
+            'python': sys.version.split()[0], 'results': results
+        }) + '\n')
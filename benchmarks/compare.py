@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 23:20
+"""
+Compare two runs of the benchmarks recorded by --output.
+
+    python benchmarks/compare.py results.jsonl             # the last two runs of every benchmark
+    python benchmarks/compare.py old.jsonl new.jsonl       # the last run in each file
+
+A ratio above 1 means the new run took longer, except for the throughputs (MB/s) where higher is better.
+"""
+import argparse
+import json
+from typing import Dict, List
+
+
+def load_runs(path: str) -> Dict[str, List[dict]]:
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                run = json.loads(line)
+                runs.setdefault(run['benchmark'], []).append(run)
+    return runs
+
+
+def flatten(results: dict) -> Dict[str, float]:
+    """The startup benchmark records min / median / max per command, the median is compared."""
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            value = value.get('median')
+        if isinstance(value, (int, float)):
+            values[key] = value
+    return values
+
+
+def compare(benchmark: str, old: dict, new: dict):
+    print('{} {} -> {}'.format(benchmark, old.get('revision', '?'), new.get('revision', '?')))
+    old_values, new_values = flatten(old['results']), flatten(new['results'])
+    for key in sorted(set(old_values) & set(new_values)):
+        ratio = new_values[key] / old_values[key] if old_values[key] else float('inf')
+        print('  {:<40} {:>10.3f} {:>10.3f} {:>8.2f}x'.format(key, old_values[key], new_values[key], ratio))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+    if len(args.files) == 1:
+        for benchmark, runs in load_runs(args.files[0]).items():
+            if len(runs) >= 2:
+                compare(benchmark, runs[-2], runs[-1])
+    else:
+        old_runs, new_runs = load_runs(args.files[0]), load_runs(args.files[1])
+        for benchmark in sorted(set(old_runs) & set(new_runs)):
+            compare(benchmark, old_runs[benchmark][-1], new_runs[benchmark][-1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 22:40
+"""
+An in-process stand-in for the part of `docker.DockerClient` used by myvc, for the benchmarks.
+
+Volumes are directories under a temp root, a container is a set of mounts:
+`exec_run` runs the command on the host with the container paths replaced by the host paths,
+`get_archive` / `put_archive` read and write tars of the mapped paths.
+A mysqld container (one without a command) listens on its published port and answers with a handshake,
+so `wait_until_ready` works unchanged. Nothing is isolated, only run trusted commands.
+
+    import fake_docker
+    fake_docker.install()  # before myvc_app.methods connects
+"""
+import datetime
+import io
+import itertools
+import os
+import re
+import shutil
+import socket
+import subprocess
+import tarfile
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+import docker
+from docker.errors import NotFound
+
+_ids = itertools.count(1)
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _match_filters(labels: Dict[str, str], name: str, filters: Optional[dict]) -> bool:
+    filters = filters or {}
+    label = filters.get('label')
+    if label:
+        key, _, value = label.partition('=')
+        if key not in labels or (value and labels[key] != value):
+            return False
+    return filters.get('name', '') in name
+
+
+class FakeVolume:
+
+    def __init__(self, client: "FakeClient", name: str, labels: dict = None):
+        self.client = client
+        self.name = name
+        self.path = os.path.join(client.root, 'volumes', name, '_data')
+        os.makedirs(self.path)
+        self.attrs = {'Name': name, 'Driver': 'local', 'Mountpoint': self.path, 'Labels': labels, 'CreatedAt': _now()}
+
+    def remove(self, force: bool = False):
+        shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+        self.client.volume_dict.pop(self.name, None)
+
+
+class FakeVolumes:
+
+    def __init__(self, client: "FakeClient"):
+        self.client = client
+
+    def create(self, name: str = None, labels: dict = None, **kwargs) -> FakeVolume:
+        volume = FakeVolume(self.client, name or 'volume{}'.format(next(_ids)), labels)
+        self.client.volume_dict[volume.name] = volume
+        return volume
+
+    def get(self, name: str) -> FakeVolume:
+        if name not in self.client.volume_dict:
+            raise NotFound('volume {} not found'.format(name))
+        return self.client.volume_dict[name]
+
+    def list(self, filters: dict = None) -> List[FakeVolume]:
+        return [
+            v for v in self.client.volume_dict.values() if _match_filters(v.attrs['Labels'] or {}, v.name, filters)
+        ]
+
+
+class FakeMysqld:
+    """Accept connections on a port and send the first bytes of a mysql handshake."""
+
+    def __init__(self, port: int = None):
+        self.socket = socket.socket()
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('127.0.0.1', port or 0))
+        self.socket.listen(64)
+        self.port = self.socket.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            with connection:
+                # packet length, sequence id and protocol version 10
+                connection.sendall(b'\x01\x00\x00\x00\x0a')
+
+    def close(self):
+        # closing alone doesn't wake up the blocked accept, the port would keep accepting connections
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+
+class FakeContainer:
+
+    def __init__(self, client: "FakeClient", name: str, volumes: dict, labels: dict, ports: dict, auto_remove: bool,
+                 command=None):
+        self.client = client
+        self.id = '{:064x}'.format(next(_ids))
+        self.name = name or self.id[-12:]
+        self.labels = labels or {}
+        self.status = 'running'
+        self.auto_remove = auto_remove
+        self.attrs = {'Created': _now()}
+        self.root = os.path.join(client.root, 'containers', self.id)
+        os.makedirs(os.path.join(self.root, 'tmp'))
+        self.mounts = {'/tmp': os.path.join(self.root, 'tmp')}
+        for source, bind in (volumes or {}).items():
+            host_path = source if source.startswith('/') else client.volumes.get(source).path
+            self.mounts[bind['bind'].rstrip('/')] = host_path
+        self.mysqld = None  # type: Optional[FakeMysqld]
+        self.ports = {}
+        if command is None:
+            port = (ports or {}).get('3306/tcp')
+            self.mysqld = FakeMysqld(port)
+            self.ports = {'3306/tcp': [{'HostIp': '0.0.0.0', 'HostPort': str(self.mysqld.port)}]}
+
+    def _host_path(self, path: str) -> str:
+        for mount in sorted(self.mounts, key=len, reverse=True):
+            if path == mount or path.startswith(mount + '/'):
+                return self.mounts[mount] + path[len(mount):]
+        return self.root + path
+
+    def _map_command(self, text: str) -> str:
+        pattern = '|'.join(re.escape(m) + r'(?![\w.-])' for m in sorted(self.mounts, key=len, reverse=True))
+        return re.sub(pattern, lambda match: self.mounts[match.group(0)], text)
+
+    def exec_run(self, cmd, **kwargs):
+        if isinstance(cmd, str):
+            cmd = ['bash', '-c', cmd]
+        result = subprocess.run(
+            [self._map_command(c) for c in cmd], stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        return docker.models.containers.ExecResult(result.returncode, result.stdout)
+
+    def get_archive(self, path: str, chunk_size: int = 2 * 1024 * 1024):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            tar.add(self._host_path(path), arcname=os.path.basename(path.rstrip('/')))
+        data = buffer.getvalue()
+        return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size)), {}
+
+    def put_archive(self, path: str, data) -> bool:
+        if not isinstance(data, bytes):
+            data = data.read() if hasattr(data, 'read') else b''.join(data)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            tar.extractall(self._host_path(path))
+        return True
+
+    def reload(self):
+        if self.id not in self.client.container_dict:
+            raise NotFound('container {} not found'.format(self.id))
+
+    def stats(self, stream: bool = False) -> dict:
+        return {'memory_stats': {'usage': 0}}
+
+    def logs(self, **kwargs) -> bytes:
+        return b''
+
+    def stop(self, **kwargs):
+        self.status = 'exited'
+        if self.mysqld:
+            self.mysqld.close()
+        if self.auto_remove:
+            self.remove()
+
+    def kill(self, **kwargs):
+        self.stop()
+
+    def wait(self, **kwargs) -> dict:
+        return {'StatusCode': 0}
+
+    def remove(self, **kwargs):
+        if self.mysqld:
+            self.mysqld.close()
+        self.status = 'removing'
+        self.client.container_dict.pop(self.id, None)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class FakeContainers:
+
+    def __init__(self, client: "FakeClient"):
+        self.client = client
+
+    def run(self, image, command=None, name: str = None, volumes: dict = None, labels: dict = None,
+            ports: dict = None, remove: bool = False, **kwargs) -> FakeContainer:
+        if name and any(c.name == name for c in self.client.container_dict.values()):
+            raise docker.errors.APIError('container name {} is already in use'.format(name))
+        container = FakeContainer(self.client, name, volumes, labels, ports, remove, command)
+        self.client.container_dict[container.id] = container
+        return container
+
+    def get(self, id_or_name: str) -> FakeContainer:
+        for container in self.client.container_dict.values():
+            if id_or_name in (container.id, container.name):
+                return container
+        raise NotFound('container {} not found'.format(id_or_name))
+
+    def list(self, all: bool = False, filters: dict = None, **kwargs) -> List[FakeContainer]:
+        return [
+            c for c in self.client.container_dict.values()
+            if (all or c.status == 'running') and _match_filters(c.labels, c.name, filters)
+        ]
+
+
+class FakeImage:
+
+    def __init__(self, name: str):
+        self.id = 'sha256:{:064x}'.format(abs(hash(name)))
+        self.tags = [name]
+
+
+class FakeImages:
+
+    def list(self, name: str = None) -> List[FakeImage]:
+        return [FakeImage(name)] if name else []
+
+    def get(self, name: str) -> FakeImage:
+        return FakeImage(name)
+
+    def pull(self, repository: str, tag: str = None, **kwargs) -> FakeImage:
+        return FakeImage('{}:{}'.format(repository, tag))
+
+    def load(self, data) -> List[FakeImage]:
+        return []
+
+
+class FakeAPI:
+    """Only there so the client can be traced, myvc's low level calls (exec with stdin) aren't supported."""
+
+    def request(self, method, url, *args, **kwargs):
+        raise NotImplementedError('{} {}'.format(method, url))
+
+
+class FakeClient:
+
+    def __init__(self, *args, **kwargs):
+        self.root = tempfile.mkdtemp(prefix='myvc_fake_docker_')
+        self.volume_dict = {}  # type: Dict[str, FakeVolume]
+        self.container_dict = {}  # type: Dict[str, FakeContainer]
+        self.volumes = FakeVolumes(self)
+        self.containers = FakeContainers(self)
+        self.images = FakeImages()
+        self.api = FakeAPI()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "FakeClient":
+        return cls()
+
+    def df(self) -> dict:
+        return {'Volumes': [
+            {'Name': v.name, 'UsageData': {'Size': _du(v.path)}} for v in self.volume_dict.values()
+        ]}
+
+    def close(self):
+        for container in list(self.container_dict.values()):
+            container.remove()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _du(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+
+def install():
+    """Make `docker.DockerClient` the fake one, call it before myvc connects."""
+    docker.DockerClient = FakeClient
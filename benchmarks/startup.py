@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/18 21:05
+"""
+Cold start time of myvc commands, every run is a new interpreter.
+
+    python benchmarks/startup.py -n 20 ls "show db" --output startup.jsonl
+
+Interactive commands exit at their first prompt because stdin is closed, which is enough to time the startup.
+Use --home to run against an isolated data directory instead of ~/.myvc.
+"""
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = pathlib.Path(__file__).resolve().parent.parent.joinpath('src')
+
+
+def run_once(command: str, env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-m', 'myvc_app.myvc'] + command.split(),
+        env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('commands', nargs='*', default=['ls'])
+    parser.add_argument('-n', '--number', type=int, default=10)
+    parser.add_argument('--home', help='HOME used by myvc, the data is created on the first run')
+    parser.add_argument('--output', help='append the results as a json line to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(SRC_DIR), env.get('PYTHONPATH')]))
+    if args.home:
+        env['HOME'] = args.home
+
+    results = {}
+    for command in args.commands:
+        # the first run may apply migrations
+        run_once(command, env)
+        timings = [run_once(command, env) for _ in range(args.number)]
+        results[command] = {
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'max': max(timings),
+        }
+        print('{:<20} min {:.3f}s  median {:.3f}s  max {:.3f}s'.format(
+            command, results[command]['min'], results[command]['median'], results[command]['max']
+        ))
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps({
+                'benchmark': 'startup', 'time': time.time(), 'python': sys.version.split()[0], 'results': results
+            }) + '\n')
+
+
+if __name__ == '__main__':
+    main()
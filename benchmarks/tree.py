@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 23:00
+"""
+Metadata hot paths on synthetic version trees: inserting, walking and deleting branches.
+
+    python benchmarks/tree.py --sizes 10 1000 100000 --output results.jsonl
+
+Every size gets a new db whose random tree (each version's parent is a random earlier version) has that many versions.
+The versions have no volumes, deleting them only costs the metadata and the tombstones.
+"""
+import argparse
+import random
+
+from common import get_free_port, prepare, timer, write_results
+
+
+def build_tree(db_info, root, size: int, seed: int) -> list:
+    from myvc_app.models.models import DataVersion
+    rng = random.Random(seed)
+    versions = [root]
+    for i in range(size - 1):
+        versions.append(DataVersion(
+            name='branch {}'.format(i), volume='benchmark.{}.{}'.format(db_info.id, i),
+            parent=versions[rng.randrange(len(versions))], db=db_info,
+        ))
+    DataVersion.insert_tree(versions[1:])
+    return versions
+
+
+def run(size: int, seed: int) -> dict:
+    import myvc_app.methods as myvc_methods
+    from myvc_app import reclaim
+    from myvc_app.models.base import DB
+    from myvc_app.models.models import DBInfo, DataVersion
+
+    results = {}
+    db_id = myvc_methods.new_db('tree{}'.format(size), get_free_port(), 'benchmark')
+    myvc_methods.stop_db(db_id)
+    db_info = DBInfo.get(id=db_id)  # type: DBInfo
+    root = db_info.root_version
+    with timer(results, 'insert_tree[{}]'.format(size)):
+        versions = build_tree(db_info, root, size, seed)
+    root = DataVersion.get(id=root.id)
+    with timer(results, 'children_tree_objects[{}]'.format(size)):
+        root.children_tree_objects
+    with timer(results, 'children_tree[{}]'.format(size)):
+        root.children_tree
+    # the subtree of a child of the root, a large part of a random tree
+    subtree_root = DataVersion.get(id=versions[1].id) if size > 1 else root
+    with timer(results, 'child_versions[{}]'.format(size)):
+        subtree_size = subtree_root.self_and_child_versions.count()
+    if subtree_root != root:
+        print('removing a subtree of {} versions'.format(subtree_size))
+        with timer(results, 'rm_versions[{}]'.format(size)):
+            with DB.atomic():
+                myvc_methods.rm_versions(subtree_root.self_and_child_versions)
+    with timer(results, 'rm_db[{}]'.format(size)):
+        myvc_methods.rm_db(db_id)
+    with timer(results, 'reclaim[{}]'.format(size)):
+        reclaim.reclaim()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='*', type=int, default=[10, 1000, 10000, 100000])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--home', help='HOME used by myvc, a temp directory by default')
+    parser.add_argument('--output', help='append the results as a json line to this file')
+    args = parser.parse_args()
+
+    prepare(args.home)
+    results = {}
+    for size in args.sizes:
+        results.update(run(size, args.seed))
+    write_results(args.output, 'tree', results)
+
+
+if __name__ == '__main__':
+    main()
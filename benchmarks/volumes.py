@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 23:10
+"""
+Volume operations against the fake docker client: copying real files and creating, starting and stopping many dbs.
+
+    python benchmarks/volumes.py --size-mb 256 --files 64 --dbs 20 --output results.jsonl
+
+The fake containers run the commands of myvc on the host, so the copy throughput is the one of `cp` on
+the local disk (plus the copy-on-write clone when the filesystem has it), and the db operations
+measure the overhead of myvc itself: metadata, container bookkeeping and the readiness wait.
+"""
+import argparse
+import os
+
+from common import get_free_port, prepare, timer, write_results
+
+
+def fill_volume(volume, size_mb: int, files: int):
+    """Write `files` files of random data, `size_mb` in total, like the table files of a datadir."""
+    file_size = size_mb * 1024 * 1024 // files
+    directory = os.path.join(volume.attrs['Mountpoint'], 'benchmark')
+    os.makedirs(directory)
+    for i in range(files):
+        with open(os.path.join(directory, 't{}.ibd'.format(i)), 'wb') as f:
+            f.write(os.urandom(file_size))
+
+
+def run_copy(size_mb: int, files: int, backend: str) -> dict:
+    import myvc_app.methods as myvc_methods
+    from myvc_app.models.models import Config
+
+    Config.update(value=backend).where(Config.key == 'SNAPSHOT_BACKEND').execute()
+    results = {}
+    from_volume = myvc_methods.create_volume()
+    fill_volume(from_volume, size_mb, files)
+    to_volume = myvc_methods.create_volume()
+    with timer(results, 'copy_volume[{}]'.format(backend)):
+        myvc_methods.copy_volume(from_volume, to_volume)
+    results['copy_volume[{}] MB/s'.format(backend)] = size_mb / results['copy_volume[{}]'.format(backend)]
+    with timer(results, 'clean_volume[{}]'.format(backend)):
+        myvc_methods.clean_volume(to_volume)
+    myvc_methods.remove_volume(from_volume)
+    myvc_methods.remove_volume(to_volume)
+    return results
+
+
+def run_dbs(count: int, jobs: int) -> dict:
+    import myvc_app.methods as myvc_methods
+
+    results = {}
+    with timer(results, 'new_db x{}'.format(count)):
+        db_ids = [myvc_methods.new_db('bench{}'.format(i), get_free_port(), 'benchmark') for i in range(count)]
+    with timer(results, 'stop all x{}'.format(count)):
+        myvc_methods.run_on_dbs(lambda db_id: myvc_methods.stop_db(db_id, keep_up=True), db_ids, jobs)
+    with timer(results, 'up x{}'.format(count)):
+        myvc_methods.run_on_dbs(myvc_methods.start_db, myvc_methods.get_up_db_ids(), jobs)
+    with timer(results, 'get_db_statuses x{}'.format(count)):
+        myvc_methods.get_db_statuses()
+    with timer(results, 'new_branch x{}'.format(count)):
+        for db_id in db_ids:
+            myvc_methods.backup_version(db_id, 'benchmark')
+    with timer(results, 'rm_db x{}'.format(count)):
+        for db_id in db_ids:
+            myvc_methods.rm_db(db_id)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=256, help='the size of the copied files')
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--backends', nargs='*', default=['copy', 'auto'])
+    parser.add_argument('--dbs', type=int, default=20)
+    parser.add_argument('--jobs', type=int, default=4, help='BULK_JOBS of stop all and up')
+    parser.add_argument('--home', help='HOME used by myvc, a temp directory by default')
+    parser.add_argument('--output', help='append the results as a json line to this file')
+    args = parser.parse_args()
+
+    prepare(args.home)
+    results = {}
+    for backend in args.backends:
+        results.update(run_copy(args.size_mb, args.files, backend))
+    results.update(run_dbs(args.dbs, args.jobs))
+    write_results(args.output, 'volumes', results)
+
+
+if __name__ == '__main__':
+    main()
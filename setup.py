@@ -34,10 +34,10 @@ setuptools.setup(
     ],
     package_dir={"": "src"},
     packages=setuptools.find_packages(where="src"),
-    python_requires=">=3.6",
+    python_requires=">=3.8",
     install_requires=install_requires,
     entry_points={
-        'console_scripts': ['myvc=myvc_app.myvc:main'],
+        'console_scripts': ['myvc=myvc_app.myvc:main', 'myvcd=myvc_app.daemon:main'],
     },
     include_package_data=True,
 )
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 13:10
+"""
+Version archives.
+
+An archive is a tar stream compressed by zstd (.tar.zst) or gzip (.tar.gz / .tgz):
+    myvc.json: the metadata of the version, always the first member
+    data/...: the datadir of the version
+The datadir is streamed from `Container.get_archive` into the compressor and back into `Container.put_archive`,
+nothing is staged on disk. Both compressors use all cpus when possible:
+zstd by the zstandard package or the zstd command, gzip by the pigz command or the gzip module.
+"""
+import gzip
+import io
+import json
+import queue
+import shutil
+import subprocess
+import tarfile
+import threading
+from typing import BinaryIO, Callable, Iterable, Iterator, Tuple
+
+from myvc_app.sql_files import SQLFile
+from myvc_app.utils import IterStream
+
+FORMAT_VERSION = 1
+METADATA_NAME = 'myvc.json'
+DATA_DIR = 'data'
+ZSTD_SUFFIXES = ('.tar.zst', '.tar.zstd')
+SUFFIXES = ZSTD_SUFFIXES + ('.tar.gz', '.tgz')
+
+
+def check_path(path: str):
+    if not path.endswith(SUFFIXES):
+        raise Exception('archive path should end with one of {}'.format(', '.join(SUFFIXES)))
+
+
+class CompressedWriter:
+    """Write a .zst or .gz file by all cpus if the zstandard package, the zstd or pigz command is there."""
+
+    def __init__(self, path: str):
+        check_path(path)
+        self._raw = open(path, 'wb')
+        self._process = None
+        is_zstd = path.endswith(ZSTD_SUFFIXES)
+        try:
+            if is_zstd:
+                import zstandard
+                self._writer = zstandard.ZstdCompressor(threads=-1).stream_writer(self._raw)  # type: BinaryIO
+            elif shutil.which('pigz'):
+                self._start_process(['pigz', '-c'])
+            else:
+                self._writer = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        except ImportError:
+            if not shutil.which('zstd'):
+                self._raw.close()
+                raise Exception('writing .zst files requires the zstandard package or the zstd command')
+            self._start_process(['zstd', '-T0', '-cq'])
+
+    def _start_process(self, cmd):
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=self._raw)
+        self._writer = self._process.stdin
+
+    def write(self, data: bytes) -> int:
+        self._writer.write(data)
+        return len(data)
+
+    def close(self):
+        self._writer.close()
+        if self._process:
+            self._process.wait()
+            if self._process.returncode:
+                raise Exception('{} exit with code {}'.format(self._process.args[0], self._process.returncode))
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _add_json(tar: tarfile.TarFile, name: str, data: dict):
+    content = json.dumps(data, ensure_ascii=False, indent=2).encode('utf8')
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    tar.addfile(info, io.BytesIO(content))
+
+
+def _relative_name(name: str) -> str:
+    return name[2:] if name.startswith('./') else name
+
+
+def iter_members(tar: tarfile.TarFile, strip: str) -> Iterator[Tuple[tarfile.TarInfo, BinaryIO]]:
+    """The members of a streamed tar under `strip`, renamed relative to it."""
+    for member in tar:
+        name = _relative_name(member.name)
+        if name != strip and not name.startswith(strip + '/'):
+            continue
+        name = name[len(strip) + 1:]
+        if not name:
+            continue
+        member.name = name
+        if member.islnk():
+            member.linkname = _relative_name(member.linkname)[len(strip) + 1:]
+        yield member, tar.extractfile(member) if member.isfile() else None
+
+
+def write_archive(
+        path: str, metadata: dict, volume_chunks: Iterable[bytes], volume_dir: str,
+        on_read: Callable[[int], None] = None
+):
+    """
+    Write the archive of a version.
+    `volume_chunks` is the tar stream of `Container.get_archive(volume_dir)`, its members are under the base name.
+    """
+    def _chunks():
+        for chunk in volume_chunks:
+            if on_read:
+                on_read(len(chunk))
+            yield chunk
+
+    root = volume_dir.rstrip('/').rsplit('/', 1)[-1]
+    with CompressedWriter(path) as writer, \
+            tarfile.open(fileobj=writer, mode='w|', format=tarfile.PAX_FORMAT) as out_tar, \
+            tarfile.open(fileobj=io.BufferedReader(IterStream(_chunks())), mode='r|') as in_tar:
+        _add_json(out_tar, METADATA_NAME, dict(metadata, format=FORMAT_VERSION))
+        for member, f in iter_members(in_tar, root):
+            member.name = '{}/{}'.format(DATA_DIR, member.name)
+            if member.islnk():
+                member.linkname = '{}/{}'.format(DATA_DIR, member.linkname)
+            out_tar.addfile(member, f)
+
+
+class _QueueWriter:
+    """A file object for tarfile whose written bytes are taken by another thread."""
+
+    def __init__(self, q: queue.Queue):
+        self._queue = q
+
+    def write(self, data: bytes) -> int:
+        self._queue.put(bytes(data))
+        return len(data)
+
+
+def iter_tar(add_members: Callable[[tarfile.TarFile], None]) -> Iterator[bytes]:
+    """The tar stream written by `add_members`, built by a thread on the fly, e.g. for `Container.put_archive`."""
+    q = queue.Queue(maxsize=16)
+    errors = []
+
+    def _write():
+        try:
+            with tarfile.open(fileobj=_QueueWriter(q), mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                add_members(tar)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            q.put(None)
+
+    writer = threading.Thread(target=_write, daemon=True)
+    writer.start()
+    while True:
+        chunk = q.get()
+        if chunk is None:
+            break
+        yield chunk
+    writer.join()
+    if errors:
+        raise errors[0]
+
+
+class ArchiveReader:
+    """Read the metadata of an archive, then stream its datadir as a tar for `Container.put_archive`."""
+
+    def __init__(self, path: str):
+        check_path(path)
+        self._file = SQLFile(path)
+        self._tar = tarfile.open(fileobj=io.BufferedReader(IterStream(self._file.iter_chunks())), mode='r|')
+        member = self._tar.next()
+        if not member or member.name != METADATA_NAME:
+            self.close()
+            raise Exception('{} is not a myvc archive'.format(path))
+        self.metadata = json.load(self._tar.extractfile(member))
+        if self.metadata.get('format', 0) > FORMAT_VERSION:
+            self.close()
+            raise Exception('{} is written by a newer myvc'.format(path))
+
+    @property
+    def position(self) -> int:
+        return self._file.position
+
+    def iter_data_tar(self) -> Iterator[bytes]:
+        """The datadir as a tar stream with the members relative to the datadir."""
+        def _add_members(tar: tarfile.TarFile):
+            for member, f in iter_members(self._tar, DATA_DIR):
+                tar.addfile(member, f)
+
+        return iter_tar(_add_members)
+
+    def close(self):
+        self._tar.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
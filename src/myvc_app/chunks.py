@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 14:40
+"""
+Shared chunk store.
+
+In the chunked snapshot mode, the datadir of a version which is not in use is split into the same fixed-size
+blocks as the delta mode, and every distinct block is kept once for all the dbs:
+    <APP_DATA_DIR>/chunks/<first 2 chars of sha1>/<sha1>
+The file list of a version, with the hashes of its blocks, is its VersionFile rows,
+a chunked version has no volume until it is used, then the volume is rebuilt from the chunks.
+New branches of a chunked version only copy the file list, so the disk use grows with the unique data only.
+"""
+import hashlib
+import io
+import os
+import tarfile
+from typing import Dict, Iterator
+
+from docker.models.containers import Container
+from docker.models.volumes import Volume
+
+import myvc_app.methods as myvc_methods
+from myvc_app import archives
+from myvc_app import config
+from myvc_app import deltas
+from myvc_app import tracing
+from myvc_app.models.base import DB
+from myvc_app.models.models import Chunk, DataVersion, DBInfo, StandbyContainer, VersionFile
+from myvc_app.utils import get_id, IterStream
+
+CHUNKED = 'chunked'
+STORE_DIR = config.APP_DATA_DIR.joinpath('chunks')
+
+
+def is_chunk_mode() -> bool:
+    return myvc_methods.get_config_value('SNAPSHOT_MODE', deltas.FULL) == CHUNKED
+
+
+def get_chunk_path(chunk_hash: str):
+    return STORE_DIR.joinpath(chunk_hash[:2], chunk_hash)
+
+
+def put_chunk(data: bytes) -> str:
+    chunk_hash = hashlib.sha1(data).hexdigest()
+    path = get_chunk_path(chunk_hash)
+    if not path.exists():
+        os.makedirs(path.parent, exist_ok=True)
+        temp_path = path.with_suffix('.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        Chunk.insert(hash=chunk_hash, size=len(data)).on_conflict_ignore().execute()
+    return chunk_hash
+
+
+def iter_chunks(f: VersionFile) -> Iterator[bytes]:
+    for chunk_hash in f.hashes:
+        with open(get_chunk_path(chunk_hash), 'rb') as chunk_file:
+            yield chunk_file.read()
+
+
+@tracing.step
+def store_volume(container: Container, root: str) -> Dict[str, VersionFile]:
+    """Put the blocks of every file under `root` into the store, return the file list."""
+    chunks, _ = container.get_archive(root)
+    manifest = {}
+    with tarfile.open(fileobj=io.BufferedReader(IterStream(chunks)), mode='r|') as tar:
+        for member, f in archives.iter_members(tar, root.rstrip('/').rsplit('/', 1)[-1]):
+            if not member.isfile() and not member.isdir():
+                continue
+            version_file = VersionFile(
+                path=member.name, is_dir=member.isdir(), size=member.size, mtime=member.mtime,
+                mode=member.mode, uid=member.uid, gid=member.gid,
+            )
+            if f:
+                version_file.block_hashes = ','.join(
+                    put_chunk(block) for block in iter(lambda: f.read(deltas.BLOCK_SIZE), b'')
+                )
+            manifest[member.name] = version_file
+    return manifest
+
+
+def store_version_data(version: DataVersion) -> Dict[str, VersionFile]:
+    volume = myvc_methods.get_volume_by_name(version.volume)
+    assert volume, "Can't find volume: {}".format(version.volume)
+    with myvc_methods.volume_container(volume) as (container, (path,)):
+        return store_volume(container, path)
+
+
+@tracing.step
+def restore_into(version: DataVersion, to_volume: Volume):
+    """Rebuild the datadir of a chunked version in `to_volume`."""
+    manifest = deltas.load_manifest(version)
+
+    def _add_members(tar: tarfile.TarFile):
+        for path, f in sorted(manifest.items()):
+            info = tarfile.TarInfo(path)
+            info.mtime = f.mtime
+            info.mode = f.mode if f.mode is not None else (0o750 if f.is_dir else 0o640)
+            info.uid, info.gid = f.uid or 0, f.gid or 0
+            if f.is_dir:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            else:
+                info.size = f.size
+                tar.addfile(info, io.BufferedReader(IterStream(iter_chunks(f))))
+
+    myvc_methods.clean_volume(to_volume)
+    with myvc_methods.volume_container(to_volume) as (container, (path,)):
+        container.put_archive(path, archives.iter_tar(_add_members))
+
+
+def check_storable(version: DataVersion):
+    db_info = DBInfo.get(id=version.db_id)  # type: DBInfo
+    if version.snapshot_type != deltas.FULL:
+        raise Exception('version {}({}) is already a {}'.format(version.volume, version.name, version.snapshot_type))
+    if db_info.current_version_id == version.id:
+        raise Exception("using version can't be moved to the chunk store")
+    if StandbyContainer.select().where(StandbyContainer.version == version).exists():
+        raise Exception("version running as a standby can't be moved to the chunk store")
+
+
+def can_store(version: DataVersion) -> bool:
+    try:
+        check_storable(version)
+    except Exception:
+        return False
+    return True
+
+
+@tracing.step
+def store_version(version: DataVersion):
+    """Move the data of `version` into the chunk store and remove its volume."""
+    check_storable(version)
+    manifest = store_version_data(version)
+    deltas.save_manifest(version, manifest)
+    old_volume_name = version.volume
+    version.snapshot_type = CHUNKED
+    version.save()
+    myvc_methods.rm_volume_by_name(old_volume_name)
+
+
+def new_chunked_children(version: DataVersion, names) -> list:
+    """
+    New children of `version` in the chunk store, only the file list is copied.
+    The data of a full `version` is put into the store first, it must not be in use.
+    """
+    if version.snapshot_type == CHUNKED:
+        manifest = deltas.load_manifest(version)
+    else:
+        manifest = store_version_data(version)
+    new_versions = [
+        DataVersion(volume=get_id(), name=name, parent=version, db=version.db_id, snapshot_type=CHUNKED)
+        for name in names
+    ]
+    with DB.atomic():
+        DataVersion.insert_tree(new_versions)
+        for new_version in new_versions:
+            deltas.save_manifest(new_version, manifest)
+    return new_versions
+
+
+@tracing.step
+def collect_garbage() -> int:
+    """Remove the chunks which no chunked version uses, return the freed bytes."""
+    if not Chunk.select().exists():
+        return 0
+    used = set()
+    query = VersionFile.select(VersionFile.block_hashes).join(DataVersion).where(
+        DataVersion.snapshot_type == CHUNKED, VersionFile.is_dir == False  # noqa: E712
+    )
+    for f in query.iterator():
+        used.update(f.hashes)
+    freed = 0
+    unused = [c for c in Chunk.select().iterator() if c.hash not in used]
+    for chunk in unused:
+        path = get_chunk_path(chunk.hash)
+        if path.exists():
+            os.remove(path)
+        freed += chunk.size
+    with DB.atomic():
+        for chunk in unused:
+            chunk.delete_instance()
+    return freed
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/20 21:10
+"""
+Background compaction.
+
+In the delta or chunked snapshot mode a version is stored compactly once it's not used, which reads its whole datadir.
+A switch doesn't wait for it: the previous version and its full children, which couldn't be deltas while it was used,
+are handed to a compactor process (`python -m myvc_app.compaction <version id>...`) started in the background,
+which writes its progress to APP_DATA_DIR/compaction.log.
+The compactor holds the lock file of the db (APP_DATA_DIR/locks/<db id>.lock) while it works, and so does every
+operation on the db reading or writing its versions, see `db_locked`, so a version isn't replaced under them.
+"""
+import fcntl
+import functools
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, List
+
+import myvc_app.methods as myvc_methods
+from myvc_app import chunks
+from myvc_app import config
+from myvc_app import deltas
+from myvc_app.models.base import DB
+from myvc_app.models.models import DataVersion
+
+LOCK_DIR = config.APP_DATA_DIR.joinpath('locks')
+LOG_PATH = config.APP_DATA_DIR.joinpath('compaction.log')
+
+# the locks held by every thread: db id -> (lock file, depth), the operations call each other
+_held = threading.local()
+
+
+@contextmanager
+def db_lock(db_id: int):
+    """Hold the lock file of a db, reentrant in one thread."""
+    held = _held.__dict__.setdefault('locks', {})
+    if db_id in held:
+        lock, depth = held[db_id]
+        held[db_id] = (lock, depth + 1)
+    else:
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        lock = open(LOCK_DIR.joinpath('{}.lock'.format(db_id)), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print('waiting for the background compaction of db {}'.format(db_id), flush=True)
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        held[db_id] = (lock, 1)
+    try:
+        yield
+    finally:
+        lock, depth = held[db_id]
+        if depth > 1:
+            held[db_id] = (lock, depth - 1)
+        else:
+            del held[db_id]
+            lock.close()
+
+
+def db_locked(func):
+    """Run an operation taking the db id first with the lock of the db held."""
+    @functools.wraps(func)
+    def _wrapper(db_id: int, *args, **kwargs):
+        with db_lock(db_id):
+            return func(db_id, *args, **kwargs)
+    return _wrapper
+
+
+def get_candidates(version: DataVersion) -> List[DataVersion]:
+    """`version` and its full children, the children are deltas of it only once it's not used."""
+    return [version] + list(version.children.where(DataVersion.snapshot_type == deltas.FULL))
+
+
+def compact(version_ids: Iterable[int]):
+    """Compact the versions which can be, after the running operations on their db."""
+    for version_id in version_ids:
+        version = DataVersion.get_or_none(id=version_id)  # type: DataVersion
+        if not version:
+            continue
+        with db_lock(version.db_id):
+            # changed or removed while waiting
+            version = DataVersion.get_or_none(id=version_id)
+            if version:
+                print(time.strftime('%Y-%m-%d %H:%M:%S'), 'compacting', version.volume, version.name, flush=True)
+                myvc_methods.compact_if_unused(version)
+        DB.close()
+
+
+def start_background(versions: Iterable[DataVersion]):
+    """Start a compactor for `versions` if the snapshot mode stores the unused versions compactly."""
+    if not (deltas.is_delta_mode() or chunks.is_chunk_mode()):
+        return
+    version_ids = [str(v.id) for v in versions]
+    if not version_ids:
+        return
+    os.makedirs(LOG_PATH.parent, exist_ok=True)
+    with open(LOG_PATH, 'ab') as log:
+        subprocess.Popen(
+            [sys.executable, '-m', 'myvc_app.compaction'] + version_ids,
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True,
+        )
+
+
+if __name__ == '__main__':
+    compact(int(v) for v in sys.argv[1:])
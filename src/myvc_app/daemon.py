@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 18:00
+"""
+myvcd, an optional long-running process which runs the operations of `myvc_app.methods`.
+
+The daemon keeps the docker client and the metadata db open and listens on a unix socket (APP_DATA_DIR/myvcd.sock),
+`myvc` sends the operations to it when it's running, otherwise they run in the myvc process as before.
+The operations on different dbs run at the same time, the operations on the same db run one by one.
+
+The protocol is one json message per line. The client sends
+    {"method": "apply_version", "args": [1, 3], "kwargs": {}}
+the daemon answers with any number of {"output": "..."} messages, the text printed by the operation,
+then {"result": ...} or {"error": "..."}. Models in the result are sent as {"__model__": "DataVersion", "id": 3}.
+"""
+import argparse
+import importlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from typing import Callable, Optional
+
+from myvc_app import config
+
+SOCKET_PATH = config.APP_DATA_DIR.joinpath('myvcd.sock')
+# the operations which run in the daemon, the interactive ones (rm_version asks for confirmation, db_shell) don't
+REMOTE_METHODS = {
+    'new_db', 'rm_db', 'start_db', 'stop_db', 'apply_version', 'copy_from', 'clean_data',
+    'backup_version', 'backup_versions', 'backup_logical_version', 'restore_logical_version',
+    'compact_version', 'apply_sql', 'apply_sql_parallel', 'export_version', 'import_version',
+}
+# the position of the file path argument of the operations, it's made absolute by the client
+PATH_ARGUMENTS = {'apply_sql': 1, 'apply_sql_parallel': 1, 'export_version': 2, 'import_version': 1}
+
+
+def encode_result(result):
+    from myvc_app.models.base import BaseModel
+    if isinstance(result, BaseModel):
+        return {'__model__': result.__class__.__name__, 'id': result.id}
+    if isinstance(result, (list, tuple)):
+        return [encode_result(r) for r in result]
+    return result
+
+
+def decode_result(result):
+    if isinstance(result, dict) and '__model__' in result:
+        from myvc_app.models import models
+        return getattr(models, result['__model__']).get_by_id(result['id'])
+    if isinstance(result, list):
+        return [decode_result(r) for r in result]
+    return result
+
+
+class _ThreadOutput:
+    """sys.stdout of the daemon, what an operation prints is sent to the client of its thread."""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def write(self, text: str) -> int:
+        send = getattr(self.local, 'send', None)
+        if send:
+            send({'output': text})
+        else:
+            self.default.write(text)
+        return len(text)
+
+    def flush(self):
+        if not getattr(self.local, 'send', None):
+            self.default.flush()
+
+    def inherit(self) -> Callable[[], None]:
+        """An initializer for the worker threads of the current thread, they print to its client too."""
+        send = getattr(self.local, 'send', None)
+
+        def _initializer():
+            self.local.send = send
+        return _initializer
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        # the worker threads of an operation send its output too
+        self._send_lock = threading.Lock()
+
+    def send(self, message: dict):
+        with self._send_lock:
+            self.wfile.write(json.dumps(message).encode('utf8') + b'\n')
+            self.wfile.flush()
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        server = self.server  # type: Server
+        try:
+            request = json.loads(line)
+            method, args, kwargs = request['method'], request.get('args', []), request.get('kwargs', {})
+            if method not in REMOTE_METHODS:
+                raise Exception('{} is not supported by myvcd'.format(method))
+            # every operation but new_db takes the db id first
+            lock = server.get_lock(args[0] if method != 'new_db' else None)
+            server.output.local.send = self.send
+            try:
+                with lock:
+                    result = getattr(server.methods, method)(*args, **kwargs)
+            finally:
+                server.output.local.send = None
+            self.send({'result': encode_result(result)})
+        except Exception as e:
+            try:
+                self.send({'error': str(e) or e.__class__.__name__})
+            except OSError:
+                pass
+        finally:
+            # give the connection of this thread back to the pool
+            server.db.close()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str):
+        super().__init__(path, _Handler)
+        self._locks_lock = threading.Lock()
+        self._locks = {}
+        self.output = _ThreadOutput(sys.stdout)
+        self.methods = importlib.import_module('myvc_app.methods')
+        self.db = importlib.import_module('myvc_app.models.base').DB
+
+    def get_lock(self, db_id: Optional[int]) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(db_id, threading.Lock())
+
+
+def is_running() -> bool:
+    if not SOCKET_PATH.exists():
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        return s.connect_ex(str(SOCKET_PATH)) == 0
+
+
+def call(method: str, *args, **kwargs):
+    """Run an operation in the daemon, print its output and return its result."""
+    args = list(args)
+    if method in PATH_ARGUMENTS and len(args) > PATH_ARGUMENTS[method]:
+        i = PATH_ARGUMENTS[method]
+        args[i] = os.path.abspath(os.path.expanduser(args[i]))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(str(SOCKET_PATH))
+        s.sendall(json.dumps({'method': method, 'args': args, 'kwargs': kwargs}).encode('utf8') + b'\n')
+        with s.makefile('rb') as f:
+            for line in f:
+                message = json.loads(line)
+                if 'output' in message:
+                    print(message['output'], end='', flush=True)
+                elif 'error' in message:
+                    raise Exception(message['error'])
+                else:
+                    return decode_result(message['result'])
+    raise Exception('myvcd closed the connection, see its log')
+
+
+class Methods:
+    """`myvc_app.methods` for the cli, the operations run by myvcd if it's running, otherwise in this process."""
+
+    def __init__(self):
+        self._use_daemon = None
+
+    def __getattr__(self, name):
+        if self._use_daemon is None:
+            self._use_daemon = is_running()
+        if self._use_daemon and name in REMOTE_METHODS:
+            return lambda *args, **kwargs: call(name, *args, **kwargs)
+        return getattr(importlib.import_module('myvc_app.methods'), name)
+
+
+def serve():
+    from myvc_app import init
+    init.setup()
+    if is_running():
+        raise Exception('myvcd is already running on {}'.format(SOCKET_PATH))
+    if SOCKET_PATH.exists():
+        os.remove(SOCKET_PATH)
+    # the socket is created with the umask, so no other user can connect before it's restricted
+    umask = os.umask(0o077)
+    try:
+        server = Server(str(SOCKET_PATH))
+    finally:
+        os.umask(umask)
+    os.chmod(SOCKET_PATH, 0o600)
+    sys.stdout = server.output
+    # connect and find the image now, so the first operation doesn't wait for them
+    server.methods.get_client()
+    server.methods.get_mysql_image()
+    print('myvcd is listening on {}'.format(SOCKET_PATH), flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(SOCKET_PATH)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run the operations of myvc in a long-running process')
+    parser.parse_args()
+    try:
+        serve()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/18 14:20
+"""
+Incremental snapshots.
+
+A delta version's volume only keeps the blocks of its datadir which differ from its parent:
+    blocks/<file path>/<block index>
+The whole file list (size, mtime and the sha1 of every BLOCK_SIZE block) of every scanned version
+is kept in the VersionFile table, it is used to find the changed blocks and to rebuild the datadir.
+
+A delta version is rebuilt by copying the nearest full ancestor (or rebuilding the nearest chunked or logical one)
+and replaying the blocks of every delta layer between them, so the ancestors of a delta version must not change.
+Since only the current version of a db is written by mysqld, `prepare_for_write` turns a version and its
+delta children into full versions before it is used, cleaned or overwritten.
+"""
+import hashlib
+import io
+import shlex
+import tarfile
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from typing import Dict, Iterator, List
+
+from docker.models.containers import Container
+from docker.models.volumes import Volume
+from peewee import chunked
+
+import myvc_app.methods as myvc_methods
+from myvc_app import tracing
+from myvc_app.models.base import DB
+from myvc_app.models.models import DataVersion, DBInfo, StandbyContainer, VersionFile
+from myvc_app.utils import get_id, IterStream
+
+FULL = 'full'
+DELTA = 'delta'
+LOGICAL = 'logical'
+BLOCK_SIZE = 1024 * 1024
+
+Manifest = Dict[str, VersionFile]
+
+
+def is_delta_mode() -> bool:
+    return myvc_methods.get_config_value('SNAPSHOT_MODE', FULL) == DELTA
+
+
+def iter_file_blocks(container: Container, path: str) -> Iterator[bytes]:
+    chunks, _ = container.get_archive(path)
+    with tarfile.open(fileobj=io.BufferedReader(IterStream(chunks)), mode='r|') as tar:
+        f = tar.extractfile(tar.next())
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def load_manifest(version: DataVersion) -> Manifest:
+    return {f.path: f for f in VersionFile.select().where(VersionFile.version == version)}
+
+
+def save_manifest(version: DataVersion, manifest: Manifest):
+    with DB.atomic():
+        VersionFile.delete().where(VersionFile.version == version).execute()
+        rows = [
+            {
+                'version': version.id, 'path': f.path, 'is_dir': f.is_dir,
+                'size': f.size, 'mtime': f.mtime, 'block_hashes': f.block_hashes,
+                'mode': f.mode, 'uid': f.uid, 'gid': f.gid,
+                'create_at': datetime.now(),
+            }
+            for f in manifest.values()
+        ]
+        for batch in chunked(rows, 100):
+            VersionFile.insert_many(batch).execute()
+
+
+def scan_volume(container: Container, root: str, cached: Manifest = None) -> Manifest:
+    """
+    List the files under `root` and hash their blocks.
+    Files whose size and mtime are the same as in `cached` are not read again.
+    """
+    cached = cached or {}
+    exit_code, output = container.exec_run(
+        ['find', root, '-mindepth', '1', '(', '-type', 'f', '-o', '-type', 'd', ')',
+         '-printf', r'%y\t%s\t%T@\t%P\0']
+    )
+    if exit_code != 0:
+        raise Exception('scan {} failed: {}'.format(root, output.decode(errors='replace')))
+    manifest = {}
+    for line in output.split(b'\0'):
+        if not line:
+            continue
+        file_type, size, mtime, path = line.decode('utf8', 'surrogateescape').split('\t', 3)
+        f = VersionFile(path=path, is_dir=file_type == 'd', size=int(size), mtime=float(mtime))
+        if not f.is_dir:
+            old = cached.get(path)
+            if old and not old.is_dir and old.size == f.size and old.mtime == f.mtime:
+                f.block_hashes = old.block_hashes
+            else:
+                f.block_hashes = ','.join(
+                    hashlib.sha1(block).hexdigest()
+                    for block in iter_file_blocks(container, '{}/{}'.format(root, path))
+                )
+        manifest[path] = f
+    return manifest
+
+
+def get_changed_blocks(manifest: Manifest, parent_manifest: Manifest) -> Dict[str, List[int]]:
+    changed = {}
+    for path, f in manifest.items():
+        if f.is_dir:
+            continue
+        parent_file = parent_manifest.get(path)
+        parent_hashes = parent_file.hashes if parent_file and not parent_file.is_dir else []
+        indexes = [
+            i for i, h in enumerate(f.hashes)
+            if i >= len(parent_hashes) or parent_hashes[i] != h
+        ]
+        if indexes:
+            changed[path] = indexes
+    return changed
+
+
+def write_blocks(container: Container, from_root: str, to_root: str, changed: Dict[str, List[int]]):
+    for path, indexes in changed.items():
+        wanted = set(indexes)
+        with SpooledTemporaryFile(max_size=64 * 1024 * 1024) as archive:
+            with tarfile.open(fileobj=archive, mode='w') as tar:
+                for i, block in enumerate(iter_file_blocks(container, '{}/{}'.format(from_root, path))):
+                    if i not in wanted:
+                        continue
+                    info = tarfile.TarInfo('blocks/{}/{}'.format(path, i))
+                    info.size = len(block)
+                    tar.addfile(info, io.BytesIO(block))
+            archive.seek(0)
+            container.put_archive(to_root, archive)
+
+
+def get_manifest(version: DataVersion) -> Manifest:
+    """The manifest of a delta or chunked version never changes, the manifest of a full version is refreshed."""
+    manifest = load_manifest(version)
+    if version.snapshot_type != FULL:
+        return manifest
+    volume = myvc_methods.get_volume_by_name(version.volume)
+    assert volume, "Can't find volume: {}".format(version.volume)
+    with myvc_methods.volume_container(volume) as (container, (path,)):
+        manifest = scan_volume(container, path, manifest)
+    save_manifest(version, manifest)
+    return manifest
+
+
+def get_chain(version: DataVersion) -> List[DataVersion]:
+    """The nearest full ancestor followed by every delta layer down to `version`."""
+    chain = [version]
+    while chain[0].snapshot_type == DELTA:
+        chain.insert(0, chain[0].parent)
+    return chain
+
+
+@tracing.step
+def materialize_into(version: DataVersion, to_volume: Volume):
+    chain = get_chain(version)
+    if chain[0].snapshot_type == FULL:
+        base_volume = myvc_methods.get_volume_by_name(chain[0].volume)
+        assert base_volume, "Can't find volume: {}".format(chain[0].volume)
+        myvc_methods.copy_volume(base_volume, to_volume)
+    elif chain[0].snapshot_type == LOGICAL:
+        from myvc_app import logical
+        logical.materialize_into(chain[0], to_volume)
+    else:
+        from myvc_app import chunks
+        chunks.restore_into(chain[0], to_volume)
+    if len(chain) == 1:
+        return
+
+    manifests = [load_manifest(v) for v in chain]
+    final_manifest = manifests[-1]
+    layer_volumes = []
+    for layer in chain[1:]:
+        layer_volume = myvc_methods.get_volume_by_name(layer.volume)
+        assert layer_volume, "Can't find volume: {}".format(layer.volume)
+        layer_volumes.append(layer_volume)
+
+    with myvc_methods.volume_container(to_volume, *layer_volumes) as (container, paths):
+        to_dir, layer_dirs = paths[0], paths[1:]
+        lines = ['set -e']
+        for layer_dir in layer_dirs:
+            lines.append(
+                'if [ -d {0}/blocks ]; then cd {0}/blocks && find . -type f -print0 | '
+                'while IFS= read -r -d "" f; do '
+                'p="${{f%/*}}"; p="{1}/${{p#./}}"; mkdir -p "${{p%/*}}"; '
+                'dd if="$f" of="$p" bs={2} seek="${{f##*/}}" conv=notrunc status=none || exit 1; '
+                'done; fi'.format(layer_dir, to_dir, BLOCK_SIZE)
+            )
+        for path, f in sorted(final_manifest.items()):
+            target = shlex.quote('{}/{}'.format(to_dir, path))
+            if f.is_dir:
+                lines.append('mkdir -p {}'.format(target))
+            else:
+                lines.append('truncate -s {} {}'.format(f.size, target))
+        removed = set().union(*manifests[:-1]) - set(final_manifest)
+        for path in sorted(removed, reverse=True):
+            lines.append('rm -rf {}'.format(shlex.quote('{}/{}'.format(to_dir, path))))
+        lines.append('chown -R --reference={0} {0}'.format(to_dir))
+
+        script_name = 'myvc_materialize_{}.sh'.format(get_id())
+        script = '\n'.join(lines).encode('utf8')
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            info = tarfile.TarInfo(script_name)
+            info.size = len(script)
+            tar.addfile(info, io.BytesIO(script))
+        container.put_archive('/tmp', archive.getvalue())
+        exit_code, output = container.exec_run(
+            ['bash', '-c', 'bash /tmp/{0}; rc=$?; rm -f /tmp/{0}; exit $rc'.format(script_name)]
+        )
+        if exit_code != 0:
+            raise Exception('materialize version {}({}) failed: {}'.format(
+                version.volume, version.name, output.decode(errors='replace')
+            ))
+
+
+def replace_volume(version: DataVersion, volume: Volume, snapshot_type: str):
+    old_volume_name = version.volume
+    version.volume = volume.name
+    version.snapshot_type = snapshot_type
+    version.save()
+    myvc_methods.rm_volume_by_name(old_volume_name)
+
+
+@tracing.step
+def materialize_version(version: DataVersion):
+    if version.snapshot_type == FULL:
+        return
+    snapshot_type = version.snapshot_type
+    volume = myvc_methods.create_volume()
+    try:
+        materialize_into(version, volume)
+    except Exception:
+        myvc_methods.remove_volume(volume)
+        raise
+    replace_volume(version, volume, FULL)
+    if snapshot_type not in (DELTA, LOGICAL):
+        from myvc_app import chunks
+        chunks.collect_garbage()
+
+
+def prepare_for_write(version: DataVersion):
+    """Must be called before the volume of `version` is modified."""
+    materialize_version(version)
+    for child in version.children.where(DataVersion.snapshot_type == DELTA):
+        materialize_version(child)
+
+
+def check_compactable(version: DataVersion):
+    db_info = DBInfo.get(id=version.db_id)  # type: DBInfo
+    if version.snapshot_type != FULL:
+        raise Exception('version {}({}) is already a {}'.format(version.volume, version.name, version.snapshot_type))
+    if not version.parent:
+        raise Exception("root version can't be a delta")
+    if version.parent.snapshot_type == LOGICAL:
+        raise Exception("children of a logical version can't be a delta")
+    if db_info.current_version_id in (version.id, version.parent_id):
+        raise Exception("using version and its children can't be a delta")
+    if StandbyContainer.select().where(StandbyContainer.version.in_([version.id, version.parent_id])).exists():
+        raise Exception("version running as a standby and its children can't be a delta")
+
+
+def can_compact(version: DataVersion) -> bool:
+    try:
+        check_compactable(version)
+    except Exception:
+        return False
+    return True
+
+
+@tracing.step
+def compact_version(version: DataVersion):
+    """Store `version` as the blocks which differ from its parent."""
+    check_compactable(version)
+    parent_manifest = get_manifest(version.parent)
+    manifest = get_manifest(version)
+    changed = get_changed_blocks(manifest, parent_manifest)
+
+    volume = myvc_methods.get_volume_by_name(version.volume)
+    assert volume, "Can't find volume: {}".format(version.volume)
+    delta_volume = myvc_methods.create_volume()
+    try:
+        with myvc_methods.volume_container(volume, delta_volume) as (container, (from_dir, to_dir)):
+            write_blocks(container, from_dir, to_dir, changed)
+    except Exception:
+        myvc_methods.remove_volume(delta_volume)
+        raise
+    replace_volume(version, delta_volume, DELTA)
+
+
+@tracing.step
+def new_delta_child(version: DataVersion, name: str) -> DataVersion:
+    """A new child of a version which is not in use, no data is copied."""
+    manifest = get_manifest(version)
+    volume = myvc_methods.create_volume()
+    with DB.atomic():
+        new_version = DataVersion(
+            volume=volume.name,
+            name=name,
+            parent=version,
+            db=version.db_id,
+            snapshot_type=DELTA,
+        )
+        DataVersion.insert_tree([new_version])
+        save_manifest(new_version, manifest)
+    return new_version
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/20 14:10
+"""
+Table level diff of two versions of a db.
+
+Both versions are served by mysqld: the running db or standby of a version is reused,
+otherwise a temporary container is started on it, on a temp volume restored from it for a logical version,
+which stays logical. The create statements of the tables are compared first,
+then every table with the same schema is compared by checksums, `jobs` sessions on each side:
+    SELECT COUNT(*), BIT_XOR(CRC32(<the columns of a row>)) FROM <table> WHERE <primary key range>
+A whole table first, then only the ranges whose checksums differ are split again, by value for an integer
+primary key, by the keys of the larger side otherwise, until a range has at most LEAF_ROWS rows,
+whose rows are compared one by one. So the unchanged parts of a table are read once by each side.
+Tables without a primary key are only told changed or not. Views, triggers and routines are not compared.
+The reused running db is not locked, a table written during the diff may show changes which aren't in the version.
+"""
+import math
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from docker.models.containers import Container
+from docker.models.volumes import Volume
+
+import myvc_app.methods as myvc_methods
+from myvc_app import deltas
+from myvc_app import logical
+from myvc_app import standby
+from myvc_app import tracing
+from myvc_app.models.base import DB
+from myvc_app.models.models import DataVersion, DBInfo, StandbyContainer
+
+Table = Tuple[str, str]
+Key = Optional[tuple]
+# (table, lower key exclusive, upper key inclusive), None is unbounded
+Chunk = Tuple[Table, Key, Key]
+
+SPLIT = 16
+LEAF_ROWS = 1000
+INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+AUTO_INCREMENT_RE = re.compile(r' AUTO_INCREMENT=\d+')
+
+quote_name = logical.quote_name
+
+
+def start(db_info: DBInfo, version: DataVersion, volume: Volume = None) -> Tuple[int, Container, bool]:
+    """
+    A mysqld on `version`, or on `volume` rebuilt from it: its published port, its container
+    and whether it was started for the diff.
+    """
+    try:
+        if version == db_info.current_version and myvc_methods.is_db_running(db_info):
+            return db_info.port, myvc_methods.get_container_by_id(db_info.container_id), False
+        standby_container = StandbyContainer.get_or_none(version=version)  # type: StandbyContainer
+        container = standby.get_container(standby_container) if standby_container else None
+        if container:
+            return standby_container.port, container, False
+        container = myvc_methods.init_container(db_info, version, internal_port=True, volume=volume)
+        try:
+            port = myvc_methods.get_published_port(container)
+            myvc_methods.wait_until_ready(db_info, container, port=port)
+        except Exception:
+            standby.stop_container(container)
+            raise
+        return port, container, True
+    finally:
+        DB.close()
+
+
+def get_tables(connection: "pymysql.Connection") -> Dict[Table, str]:
+    """The create statements of the tables, without the AUTO_INCREMENT counters."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_SCHEMA, TABLE_NAME FROM information_schema.TABLES "
+            "WHERE TABLE_TYPE = 'BASE TABLE' AND TABLE_SCHEMA NOT IN %s",
+            (logical.SYSTEM_DATABASES,)
+        )
+        tables = {}
+        for database, name in cursor.fetchall():
+            cursor.execute('SHOW CREATE TABLE {}.{}'.format(quote_name(database), quote_name(name)))
+            tables[(database, name)] = AUTO_INCREMENT_RE.sub('', cursor.fetchone()[1])
+    return tables
+
+
+class TableInfo:
+
+    def __init__(self, connection: "pymysql.Connection", table: Table):
+        database, name = table
+        self.full_name = '{}.{}'.format(quote_name(database), quote_name(name))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+                (database, name)
+            )
+            columns = cursor.fetchall()
+            cursor.execute(
+                "SELECT COLUMN_NAME FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND INDEX_NAME = 'PRIMARY' ORDER BY SEQ_IN_INDEX",
+                (database, name)
+            )
+            self.key = [c for c, in cursor.fetchall()]
+        types = dict(columns)
+        self.integer_key = len(self.key) == 1 and types[self.key[0]].lower() in INTEGER_TYPES
+        quoted = [quote_name(c) for c, _ in columns]
+        # as binary, so the collations of the columns don't mix, and with the null flags, CONCAT_WS skips nulls
+        self.row_hash = "CRC32(CONCAT_WS('#', {}, CONCAT({})))".format(
+            ', '.join('CAST({} AS BINARY)'.format(c) for c in quoted),
+            ', '.join('ISNULL({})'.format(c) for c in quoted),
+        )
+        self.key_columns = ', '.join(quote_name(c) for c in self.key)
+
+    def condition(self, lower: Key, upper: Key) -> Tuple[str, list]:
+        conditions, params = [], []
+        placeholders = ', '.join(['%s'] * len(self.key))
+        if lower is not None:
+            conditions.append('({}) > ({})'.format(self.key_columns, placeholders))
+            params += lower
+        if upper is not None:
+            conditions.append('({}) <= ({})'.format(self.key_columns, placeholders))
+            params += upper
+        return ' AND '.join(conditions) or '1 = 1', params
+
+
+class Differ:
+
+    def __init__(self, db_info: DBInfo, ports: Tuple[int, int], jobs: int):
+        self.db_info = db_info
+        self.ports = ports
+        self.jobs = jobs
+        self.tables = {}  # type: Dict[Table, TableInfo]
+        self.results = {}  # type: Dict[Table, dict]
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connections(self) -> Tuple["pymysql.Connection", "pymysql.Connection"]:
+        """The sessions of the current thread on both sides."""
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = tuple(logical.connect(self.db_info, port) for port in self.ports)
+            with self._lock:
+                self._connections.extend(self._local.connections)
+        return self._local.connections
+
+    def query(self, side: int, sql: str, params: list = None) -> list:
+        with self.connections()[side].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def checksum(self, side: int, chunk: Chunk) -> Tuple[int, int]:
+        table, lower, upper = chunk
+        info = self.tables[table]
+        condition, params = info.condition(lower, upper)
+        count, checksum = self.query(side, 'SELECT COUNT(*), BIT_XOR({}) FROM {} WHERE {}'.format(
+            info.row_hash, info.full_name, condition
+        ), params)[0]
+        return count, int(checksum or 0)
+
+    def split(self, chunk: Chunk, counts: Tuple[int, int]) -> List[Chunk]:
+        table, lower, upper = chunk
+        info = self.tables[table]
+        condition, params = info.condition(lower, upper)
+        parts = min(SPLIT, math.ceil(max(counts) / LEAF_ROWS))
+        if info.integer_key:
+            sql = 'SELECT MIN({0}), MAX({0}) FROM {1} WHERE {2}'.format(info.key_columns, info.full_name, condition)
+            bounds = [row for side in (0, 1) for row in self.query(side, sql, params) if row[0] is not None]
+            first, last = min(b[0] for b in bounds), max(b[1] for b in bounds)
+            step = math.ceil((last - first + 1) / parts)
+            keys = [(first - 1 + step * i,) for i in range(1, parts) if first - 1 + step * i < last]
+        else:
+            # every n-th key of the larger side, only the keys are read
+            from pymysql.cursors import SSCursor
+            side = 0 if counts[0] >= counts[1] else 1
+            step = math.ceil(counts[side] / parts)
+            keys = []
+            with self.connections()[side].cursor(SSCursor) as cursor:
+                cursor.execute('SELECT {0} FROM {1} WHERE {2} ORDER BY {0}'.format(
+                    info.key_columns, info.full_name, condition
+                ), params)
+                for i, row in enumerate(cursor):
+                    if i % step == step - 1 and len(keys) < parts - 1:
+                        keys.append(row)
+        bounds = [lower] + [tuple(k) for k in keys] + [upper]
+        return [(table, bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+    def compare_rows(self, chunk: Chunk):
+        table, lower, upper = chunk
+        info = self.tables[table]
+        condition, params = info.condition(lower, upper)
+        sql = 'SELECT {}, {} FROM {} WHERE {}'.format(info.key_columns, info.row_hash, info.full_name, condition)
+        rows = [{tuple(row[:-1]): row[-1] for row in self.query(side, sql, params)} for side in (0, 1)]
+        removed = rows[0].keys() - rows[1].keys()
+        added = rows[1].keys() - rows[0].keys()
+        changed = {k for k in rows[0].keys() & rows[1].keys() if rows[0][k] != rows[1][k]}
+        keys = sorted(removed | added | changed)
+        if keys:
+            with self._lock:
+                self.results[table]['ranges'].append({
+                    'first': keys[0], 'last': keys[-1],
+                    'removed': len(removed), 'added': len(added), 'changed': len(changed),
+                })
+
+    def compare(self, chunk: Chunk) -> List[Chunk]:
+        """Compare a range of a table, return the smaller ranges to compare next."""
+        table = chunk[0]
+        (count, checksum), (other_count, other_checksum) = self.checksum(0, chunk), self.checksum(1, chunk)
+        if chunk[1] is None and chunk[2] is None:
+            self.results[table]['rows'] = (count, other_count)
+        if (count, checksum) == (other_count, other_checksum):
+            return []
+        self.results[table]['change'] = 'data'
+        if not self.tables[table].key:
+            return []
+        if max(count, other_count) <= LEAF_ROWS:
+            self.compare_rows(chunk)
+            return []
+        chunks = self.split(chunk, (count, other_count))
+        if len(chunks) == 1:
+            self.compare_rows(chunk)
+            return []
+        return chunks
+
+    def diff(self) -> List[dict]:
+        try:
+            return self._diff()
+        finally:
+            for connection in self._connections:
+                connection.close()
+
+    def _diff(self) -> List[dict]:
+        tables = [get_tables(connection) for connection in self.connections()]
+        results = []
+        for table in sorted(tables[0].keys() | tables[1].keys()):
+            result = {'database': table[0], 'table': table[1], 'change': None, 'rows': None, 'ranges': []}
+            if table not in tables[1]:
+                result['change'] = 'removed'
+            elif table not in tables[0]:
+                result['change'] = 'added'
+            elif tables[0][table] != tables[1][table]:
+                result['change'] = 'schema'
+            else:
+                self.results[table] = result
+            results.append(result)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for table in self.results:
+                self.tables[table] = TableInfo(self.connections()[0], table)
+            futures = {executor.submit(self.compare, (table, None, None)) for table in self.results}
+            try:
+                while futures:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for chunk in future.result():
+                            futures.add(executor.submit(self.compare, chunk))
+            finally:
+                for future in futures:
+                    future.cancel()
+        for result in self.results.values():
+            result['ranges'].sort(key=lambda r: r['first'])
+        return results
+
+
+@tracing.step
+def diff(db_info: DBInfo, from_version: DataVersion, to_version: DataVersion, jobs: int = None) -> List[dict]:
+    """
+    The tables which differ between two versions, a row per table:
+        {'database': 'shop', 'table': 'orders', 'change': 'data', 'rows': (1000, 1002), 'ranges': [
+            {'first': (10,), 'last': (12,), 'removed': 0, 'added': 2, 'changed': 1}
+        ]}
+    `change` is None (the same), removed, added, schema or data, `rows` the row counts of both versions,
+    `ranges` the key ranges of the changed rows, empty if the table has no primary key.
+    """
+    versions = (from_version, to_version)
+    # a logical version would stay a full one after the diff, it's restored into a temp volume instead
+    temp_volumes = {}  # type: Dict[int, Volume]
+    try:
+        for version in versions:
+            if version.snapshot_type == deltas.LOGICAL:
+                if version.id not in temp_volumes:
+                    temp_volumes[version.id] = myvc_methods.create_volume()
+                    deltas.materialize_into(version, temp_volumes[version.id])
+            elif not (version == db_info.current_version and myvc_methods.is_db_running(db_info)):
+                deltas.prepare_for_write(version)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(start, db_info, version, temp_volumes.get(version.id)) for version in versions]
+        try:
+            (port, container, _), (other_port, _, _) = [f.result() for f in futures]
+            jobs = jobs or myvc_methods.get_container_cpu_count(container)
+            return Differ(db_info, (port, other_port), jobs).diff()
+        finally:
+            for future, version in zip(futures, versions):
+                if future.exception():
+                    continue
+                _, container, started = future.result()
+                if started:
+                    # shut down cleanly, the datadir is compacted right after
+                    standby.stop_container(container)
+                    if version.id not in temp_volumes:
+                        myvc_methods.compact_if_unused(version)
+    finally:
+        for volume in temp_volumes.values():
+            myvc_methods.remove_volume(volume, force=True)
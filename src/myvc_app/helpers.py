@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/18 19:10
+"""
+A small pool of long-lived helper containers for file operations on volumes.
+
+A helper mounts only the volumes of one file operation, each at /volumes/<name>, and is reused by the next operations
+on the same volumes without starting a new container. Only the volumes labeled as myvc's are mounted by a helper,
+the other ones go to a temp container, so a wrong path in a command can't reach a volume myvc doesn't own.
+At most POOL_SIZE helpers are kept, the least recently used idle one is removed for a new one, and an operation
+gets a temp container when all of them are busy. A volume is only removed once the helpers mounting it are,
+see `release`. The helpers are removed at exit and also exit by themselves after being idle for IDLE_SECONDS,
+so a crashed process doesn't leak them.
+"""
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from typing import FrozenSet, Iterable, Iterator, List, Optional, Sequence
+
+from docker.errors import NotFound, APIError
+from docker.models.containers import Container
+from docker.models.volumes import Volume
+
+import myvc_app.methods as myvc_methods
+from myvc_app.utils import get_id
+
+MOUNT_PATH = '/volumes'
+POOL_SIZE = 4
+IDLE_SECONDS = 60
+# exit when no other process than the loop itself ran for IDLE_SECONDS
+IDLE_LOOP = (
+    'idle=0; while [ $idle -lt {0} ]; do sleep 5; p=(/proc/[0-9]*); '
+    'if [ ${{#p[@]}} -le 1 ]; then idle=$((idle+5)); else idle=0; fi; done'
+).format(IDLE_SECONDS)
+
+
+class Helper:
+
+    def __init__(self, container: Container, names: FrozenSet[str]):
+        self.container = container
+        self.names = names
+        self.users = 0
+        self.last_used_at = time.time()
+
+    def volume_paths(self, volumes: Sequence[Volume]) -> List[str]:
+        return ['{}/{}'.format(MOUNT_PATH, v.name) for v in volumes]
+
+    def is_alive(self) -> bool:
+        try:
+            self.container.reload()
+        except NotFound:
+            return False
+        return self.container.status == 'running'
+
+    def remove(self):
+        try:
+            self.container.remove(force=True)
+        except (NotFound, APIError):
+            pass
+
+
+_lock = threading.Lock()
+_pool = []  # type: List[Helper]
+_disabled = False
+
+
+def is_myvc_volume(volume: Volume) -> bool:
+    return myvc_methods.LABEL in (volume.attrs.get('Labels') or {})
+
+
+def _start_helper(names: FrozenSet[str]) -> Optional[Helper]:
+    try:
+        container = myvc_methods.get_client().containers.run(
+            myvc_methods.get_mysql_image(), name='myvc.helper.{}'.format(get_id()),
+            command=['bash', '-c', IDLE_LOOP],
+            remove=True,
+            volumes={name: {'bind': '{}/{}'.format(MOUNT_PATH, name), 'mode': 'rw'} for name in names},
+            labels={myvc_methods.LABEL: 'helper'},
+            detach=True,
+        )  # type: Container
+    except APIError:
+        return None
+    return Helper(container, names)
+
+
+def _take(volumes: Sequence[Volume]) -> Optional[Helper]:
+    global _disabled
+    if not volumes or not all(is_myvc_volume(v) for v in volumes):
+        return None
+    names = frozenset(v.name for v in volumes)
+    with _lock:
+        if _disabled:
+            return None
+        helper = next((h for h in _pool if h.names == names), None)
+        if helper and not helper.is_alive():
+            _pool.remove(helper)
+            helper = None
+        if not helper:
+            if len(_pool) >= POOL_SIZE:
+                idle = [h for h in _pool if not h.users]
+                if not idle:
+                    return None
+                evicted = min(idle, key=lambda h: h.last_used_at)
+                _pool.remove(evicted)
+                evicted.remove()
+            helper = _start_helper(names)
+            if not helper:
+                _disabled = True
+                return None
+            _pool.append(helper)
+        helper.users += 1
+        return helper
+
+
+@contextmanager
+def use(volumes: Sequence[Volume]) -> Iterator[Optional[Helper]]:
+    """A helper mounting `volumes`, None if one of them isn't myvc's or no helper is free."""
+    helper = _take(volumes)
+    try:
+        yield helper
+    finally:
+        if helper:
+            with _lock:
+                helper.users -= 1
+                helper.last_used_at = time.time()
+
+
+def release(names: Iterable[str]):
+    """Remove the idle helpers mounting any of the volumes `names`, docker doesn't remove a mounted volume."""
+    names = set(names)
+    with _lock:
+        for helper in [h for h in _pool if h.names & names and not h.users]:
+            _pool.remove(helper)
+            helper.remove()
+
+
+@atexit.register
+def close():
+    with _lock:
+        for helper in _pool:
+            helper.remove()
+        _pool.clear()
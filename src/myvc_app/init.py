@@ -6,6 +6,11 @@ import pathlib
 import importlib.util
 from myvc_app import config
 
+MIGRATIONS_DIR = pathlib.Path(__file__).parent.joinpath('migrations')
+SCHEMA_STAMP_PATH = config.APP_DATA_DIR.joinpath('schema_stamp')
+
+_is_setup = False
+
 
 def init():
     if not config.APP_DATA_DIR.exists():
@@ -20,7 +25,6 @@ def init():
 def migrate():
     from myvc_app.models.base import DB
     from myvc_app.models.models import Migration
-    migrations_dir = pathlib.Path(__file__).parent.joinpath('migrations')
     migrated_filenames = {m.filename for m in Migration.select()}
     migrations = list(sorted(
         filter(
@@ -30,7 +34,7 @@ def migrate():
                     and path.name != '__init__.py'
                     and path.name not in migrated_filenames
             ),
-            migrations_dir.iterdir()
+            MIGRATIONS_DIR.iterdir()
         ),
         key=lambda path: path.stem
     ))
@@ -47,5 +51,32 @@ def migrate():
             print('\rapply {} succeed'.format(migration.name))
 
 
-init()
-migrate()
+def get_schema_stamp() -> str:
+    """Changes when migrations are added (the directory is rewritten on install) or the db file is replaced."""
+    return '{}:{}'.format(MIGRATIONS_DIR.stat().st_mtime_ns, config.DB_PATH.stat().st_ino)
+
+
+def is_schema_up_to_date() -> bool:
+    try:
+        with open(SCHEMA_STAMP_PATH) as f:
+            return f.read() == get_schema_stamp()
+    except OSError:
+        return False
+
+
+def setup():
+    """
+    Prepare the metadata db, called once before the first command.
+    The migrations are only checked when the schema stamp differs from the last successful check.
+    """
+    global _is_setup
+    if _is_setup:
+        return
+    if is_schema_up_to_date():
+        import myvc_app.signals
+    else:
+        init()
+        migrate()
+        with open(SCHEMA_STAMP_PATH, 'w') as f:
+            f.write(get_schema_stamp())
+    _is_setup = True
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 16:00
+"""
+Logical snapshots.
+
+A logical version's volume holds a dump of the databases instead of a datadir:
+    myvc_logical.json: the databases, their create statements and tables
+    <database>/<table>.sql.gz: the create statement and the rows of a table
+    <database>/-objects.sql.gz: the views, triggers and routines of a database
+The dump is taken from the running db by `jobs` sessions which share one consistent snapshot:
+the tables are locked by FLUSH TABLES WITH READ LOCK only until every session started its transaction.
+A dump doesn't depend on the mysql version, and any of its tables can be restored into the running db alone.
+A logical version is turned into a datadir by restoring it into a temporary mysqld when it's used.
+"""
+import gzip
+import io
+import json
+import tarfile
+import threading
+import time
+from tempfile import SpooledTemporaryFile
+from typing import Dict, Iterator, List, Tuple
+
+from docker.models.containers import Container
+from docker.models.volumes import Volume
+
+import myvc_app.methods as myvc_methods
+from myvc_app import deltas
+from myvc_app import standby
+from myvc_app import tracing
+from myvc_app.models.models import DataVersion, DBInfo
+from myvc_app.utils import get_id, IterStream, OutputThreadPoolExecutor, Progress
+
+LOGICAL = deltas.LOGICAL
+MANIFEST_NAME = 'myvc_logical.json'
+OBJECTS_NAME = '-objects'
+SYSTEM_DATABASES = ('mysql', 'sys', 'information_schema', 'performance_schema')
+STATEMENT_SIZE = 1024 * 1024
+SESSION_STATEMENTS = (
+    "SET NAMES utf8mb4;\n"
+    "SET FOREIGN_KEY_CHECKS=0;\n"
+    "SET UNIQUE_CHECKS=0;\n"
+    "SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n"
+)
+
+Table = Tuple[str, str]
+
+
+def quote_name(name: str) -> str:
+    return '`{}`'.format(name.replace('`', '``'))
+
+
+def connect(db_info: DBInfo, port: int = None) -> "pymysql.Connection":
+    # imported on use, it's slow to import and only needed here
+    import pymysql
+    return pymysql.connect(
+        host=myvc_methods.get_docker_host(), port=port or db_info.port,
+        user='root', password=db_info.password, charset='utf8mb4',
+    )
+
+
+def escape(connection: "pymysql.Connection", value) -> str:
+    if isinstance(value, (bytes, bytearray)):
+        # hex keeps the statements valid utf8 whatever the bytes are
+        return "X'{}'".format(value.hex())
+    return connection.escape(value)
+
+
+def get_file_name(database: str, table: str) -> str:
+    return '{}/{}.sql.gz'.format(database, table)
+
+
+class Dumper:
+
+    def __init__(self, db_info: DBInfo, container: Container, path: str, jobs: int):
+        self.db_info = db_info
+        self.container = container
+        self.path = path
+        self.jobs = jobs
+        self.progress = Progress('dump', unit='tables')
+        self._lock = threading.Lock()
+
+    def list_tables(self, connection: "pymysql.Connection") -> Tuple[Dict[str, str], List[Table]]:
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW DATABASES')
+            databases = {}
+            for (database,) in cursor.fetchall():
+                if database.lower() in SYSTEM_DATABASES:
+                    continue
+                cursor.execute('SHOW CREATE DATABASE {}'.format(quote_name(database)))
+                databases[database] = cursor.fetchone()[1]
+            cursor.execute(
+                "SELECT TABLE_SCHEMA, TABLE_NAME FROM information_schema.TABLES "
+                "WHERE TABLE_TYPE = 'BASE TABLE' AND TABLE_SCHEMA NOT IN %s "
+                "ORDER BY DATA_LENGTH + INDEX_LENGTH DESC",
+                (SYSTEM_DATABASES,)
+            )
+            # the largest tables first, so the sessions finish at about the same time
+            tables = [(database, table) for database, table in cursor.fetchall() if database in databases]
+        return databases, tables
+
+    def write_file(self, name: str, f: SpooledTemporaryFile):
+        size = f.tell()
+        f.seek(0)
+        with SpooledTemporaryFile(max_size=64 * 1024 * 1024) as archive:
+            with tarfile.open(fileobj=archive, mode='w') as tar:
+                info = tarfile.TarInfo(name)
+                info.size = size
+                info.mtime = time.time()
+                tar.addfile(info, f)
+            archive.seek(0)
+            self.container.put_archive(self.path, archive)
+
+    def dump_table(self, connection: "pymysql.Connection", table: Table):
+        database, name = table
+        full_name = '{}.{}'.format(quote_name(database), quote_name(name))
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW CREATE TABLE {}'.format(full_name))
+            create_statement = cursor.fetchone()[1]
+            cursor.execute(
+                # only the generated columns can't be inserted, mysql 8 reports DEFAULT_GENERATED for the
+                # columns with a DEFAULT CURRENT_TIMESTAMP or expression, they are dumped
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s "
+                "AND EXTRA NOT IN ('VIRTUAL GENERATED', 'STORED GENERATED') "
+                "ORDER BY ORDINAL_POSITION",
+                (database, name)
+            )
+            columns = ', '.join(quote_name(c) for c, in cursor.fetchall())
+
+        from pymysql.cursors import SSCursor
+        with SpooledTemporaryFile(max_size=64 * 1024 * 1024) as f:
+            with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=3) as gz:
+                gz.write(SESSION_STATEMENTS.encode('utf8'))
+                gz.write('DROP TABLE IF EXISTS {};\n{};\n'.format(quote_name(name), create_statement).encode('utf8'))
+                insert = 'INSERT INTO {} ({}) VALUES '.format(quote_name(name), columns).encode('utf8')
+                with connection.cursor(SSCursor) as cursor:
+                    cursor.execute('SELECT {} FROM {}'.format(columns, full_name))
+                    values, size = [], 0
+                    while True:
+                        rows = cursor.fetchmany(1000)
+                        if not rows:
+                            break
+                        for row in rows:
+                            value = '({})'.format(','.join(escape(connection, v) for v in row)).encode('utf8')
+                            values.append(value)
+                            size += len(value)
+                            if size >= STATEMENT_SIZE:
+                                gz.write(insert + b',\n'.join(values) + b';\n')
+                                values, size = [], 0
+                    if values:
+                        gz.write(insert + b',\n'.join(values) + b';\n')
+            self.write_file(get_file_name(database, name), f)
+            with self._lock:
+                self.progress.update(f.tell(), 1)
+
+    def dump_objects(self, connection: "pymysql.Connection", database: str) -> bool:
+        """Write the views, triggers and routines of a database, return False if there is none."""
+        lines = []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT TABLE_NAME FROM information_schema.VIEWS WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME",
+                (database,)
+            )
+            views = [v for v, in cursor.fetchall()]
+            # a placeholder of every view first, like mysqldump, so a view can select from any other view
+            for view in views:
+                cursor.execute(
+                    "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                    "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+                    (database, view)
+                )
+                lines.append('CREATE OR REPLACE VIEW {} AS SELECT {};'.format(
+                    quote_name(view), ', '.join('1 AS {}'.format(quote_name(c)) for c, in cursor.fetchall())
+                ))
+            for view in views:
+                cursor.execute('SHOW CREATE VIEW {}.{}'.format(quote_name(database), quote_name(view)))
+                lines.append('{};'.format(cursor.fetchone()[1].replace('CREATE ', 'CREATE OR REPLACE ', 1)))
+
+            routines = []
+            cursor.execute('SHOW TRIGGERS FROM {}'.format(quote_name(database)))
+            routines += [('TRIGGER', r[0]) for r in cursor.fetchall()]
+            for routine_type in ('PROCEDURE', 'FUNCTION'):
+                cursor.execute('SHOW {} STATUS WHERE Db = %s'.format(routine_type), (database,))
+                routines += [(routine_type, r[1]) for r in cursor.fetchall()]
+            if routines:
+                lines.append('DELIMITER ;;')
+                for routine_type, name in routines:
+                    cursor.execute('SHOW CREATE {} {}.{}'.format(routine_type, quote_name(database), quote_name(name)))
+                    row = cursor.fetchone()
+                    lines.append('DROP {} IF EXISTS {};;'.format(routine_type, quote_name(name)))
+                    lines.append('{};;'.format(row[2]))
+                lines.append('DELIMITER ;')
+        if not lines:
+            return False
+        with SpooledTemporaryFile(max_size=64 * 1024 * 1024) as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                gz.write(SESSION_STATEMENTS.encode('utf8'))
+                gz.write('\n'.join(lines).encode('utf8') + b'\n')
+            self.write_file(get_file_name(database, OBJECTS_NAME), f)
+        return True
+
+    def dump(self):
+        main_connection = connect(self.db_info)
+        sessions = []
+        try:
+            with main_connection.cursor() as cursor:
+                cursor.execute('FLUSH TABLES WITH READ LOCK')
+                databases, tables = self.list_tables(main_connection)
+                for _ in range(max(min(self.jobs, len(tables)), 1)):
+                    connection = connect(self.db_info)
+                    sessions.append(connection)
+                    with connection.cursor() as session_cursor:
+                        session_cursor.execute('SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                        session_cursor.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+                cursor.execute('UNLOCK TABLES')
+
+            pending = list(tables)
+
+            def _work(connection: "pymysql.Connection"):
+                while True:
+                    with self._lock:
+                        if not pending:
+                            return
+                        table = pending.pop(0)
+                    self.dump_table(connection, table)
+
+            with OutputThreadPoolExecutor(max_workers=len(sessions)) as executor:
+                for future in [executor.submit(_work, s) for s in sessions]:
+                    future.result()
+            objects = [d for d in databases if self.dump_objects(main_connection, d)]
+        finally:
+            for connection in sessions + [main_connection]:
+                connection.close()
+        self.progress.finish()
+
+        manifest = {
+            'format': 1,
+            'databases': {
+                database: {
+                    'create': create_statement,
+                    'tables': [t for d, t in tables if d == database],
+                    'objects': database in objects,
+                }
+                for database, create_statement in databases.items()
+            },
+        }
+        content = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf8')
+        with SpooledTemporaryFile() as f:
+            f.write(content)
+            self.write_file(MANIFEST_NAME, f)
+
+
+@tracing.step
+def dump_into(db_info: DBInfo, volume: Volume, jobs: int):
+    with myvc_methods.volume_container(volume) as (container, (path,)):
+        Dumper(db_info, container, path, jobs).dump()
+
+
+def read_manifest(container: Container, path: str) -> dict:
+    chunks, _ = container.get_archive('{}/{}'.format(path, MANIFEST_NAME))
+    with tarfile.open(fileobj=io.BufferedReader(IterStream(chunks)), mode='r|') as tar:
+        return json.load(tar.extractfile(tar.next()))
+
+
+def iter_file(container: Container, path: str) -> Iterator[bytes]:
+    chunks, _ = container.get_archive(path)
+    with tarfile.open(fileobj=io.BufferedReader(IterStream(chunks)), mode='r|') as tar:
+        with gzip.GzipFile(fileobj=tar.extractfile(tar.next())) as gz:
+            yield from iter(lambda: gz.read(1024 * 1024), b'')
+
+
+@tracing.step
+def restore(version: DataVersion, db_info: DBInfo, db_container: Container, tables: List[str] = None,
+            jobs: int = None):
+    """
+    Restore a logical version into the running mysqld of `db_container`, `jobs` tables at the same time.
+    `tables` selects some tables as ['database.table', ...], their views, triggers and routines are not restored.
+    """
+    volume = myvc_methods.get_volume_by_name(version.volume)
+    assert volume, "Can't find volume: {}".format(version.volume)
+    jobs = jobs or myvc_methods.get_container_cpu_count(db_container)
+    environment = {'MYSQL_PWD': db_info.password}
+
+    with myvc_methods.volume_container(volume) as (container, (path,)):
+        manifest = read_manifest(container, path)
+        selected = [
+            (database, table)
+            for database, info in manifest['databases'].items() for table in info['tables']
+            if not tables or '{}.{}'.format(database, table) in tables
+        ]
+        if tables:
+            missing = set(tables) - {'{}.{}'.format(d, t) for d, t in selected}
+            if missing:
+                raise Exception('{} not in {}'.format(', '.join(sorted(missing)), version.name))
+
+        for database in sorted({d for d, _ in selected} if tables else manifest['databases']):
+            create_statement = manifest['databases'][database]['create']
+            create_statement = create_statement.replace('CREATE DATABASE ', 'CREATE DATABASE IF NOT EXISTS ', 1)
+            exit_code, output = myvc_methods.exec_with_stdin(
+                db_container, ['mysql', '-u', 'root'], [create_statement.encode('utf8') + b';\n'], environment
+            )
+            if exit_code:
+                raise Exception('create database {} failed: {}'.format(database, output.decode(errors='replace')))
+
+        progress = Progress('restore {}'.format(version.name), unit='tables')
+
+        def _restore(database: str, name: str):
+            file_path = '{}/{}'.format(path, get_file_name(database, name))
+            exit_code, output = myvc_methods.exec_with_stdin(
+                db_container, ['mysql', '-u', 'root', '-D', database], iter_file(container, file_path), environment
+            )
+            if exit_code:
+                raise Exception('restore {}.{} failed: {}'.format(database, name, output.decode(errors='replace')))
+            progress.update(0, 1)
+
+        with OutputThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_restore, database, table) for database, table in selected]
+            for future in futures:
+                future.result()
+        if not tables:
+            for database, info in manifest['databases'].items():
+                if info['objects']:
+                    _restore(database, OBJECTS_NAME)
+        progress.finish()
+
+
+@tracing.step
+def materialize_into(version: DataVersion, to_volume: Volume):
+    """Initialize a datadir in `to_volume` by a temporary mysqld and restore the logical version into it."""
+    db_info = DBInfo.get(id=version.db_id)  # type: DBInfo
+    myvc_methods.clean_volume(to_volume)
+    container = myvc_methods.get_client().containers.run(
+        myvc_methods.get_mysql_image(), name='myvc.logical.{}'.format(get_id()),
+        volumes={
+            db_info.conf_volume: {'bind': '/etc/mysql/conf.d', 'mode': 'ro'},
+            to_volume.name: {'bind': '/var/lib/mysql', 'mode': 'rw'},
+        },
+        ports={'3306/tcp': None},
+        environment={'MYSQL_ROOT_PASSWORD': db_info.password},
+        labels={myvc_methods.LABEL: 'temp'},
+        detach=True,
+    )  # type: Container
+    try:
+        myvc_methods.wait_until_ready(db_info, container, port=myvc_methods.get_published_port(container))
+        restore(version, db_info, container)
+    except Exception:
+        container.remove(force=True)
+        raise
+    # mysqld is still flushing the restored tables, the datadir becomes the version
+    standby.stop_container(container)
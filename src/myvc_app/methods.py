@@ -1,72 +1,201 @@
 #!/usr/bin/env python
 # -*- encoding: UTF-8 -*-
 # Created by CaoDa on 2021/6/30 13:55
+import itertools
 import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Union
+from typing import Callable, Dict, Union, Iterable, Tuple, List, Optional, Set
+from urllib.parse import urlparse
 
 import docker
 import tarfile
-import gzip
 import questionary
+from concurrent.futures import Future
 from io import BytesIO
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
 from docker.models.containers import Container
 from docker.errors import NotFound
 from docker.models.images import Image
 from docker.models.volumes import Volume
+from docker.utils.socket import frames_iter
+from peewee import ModelSelect
 
 from myvc_app.models.base import DB
-from myvc_app.models.models import DBInfo, DataVersion, MySQLConf, Config
-from myvc_app.utils import get_id, is_port_in_use
+from myvc_app.models.models import (
+    DBInfo, DataVersion, MySQLConf, Config, VersionFile, ReadyTime, StandbyContainer, VolumeUsage
+)
+from myvc_app.snapshots import get_backend
+from myvc_app import archives
+from myvc_app import chunks
+from myvc_app import compaction
+from myvc_app import deltas
+from myvc_app import diffs
+from myvc_app import helpers
+from myvc_app import logical
+from myvc_app import orphans
+from myvc_app import proxy
+from myvc_app import reclaim
+from myvc_app import standby
+from myvc_app import templates
+from myvc_app import tracing
+from myvc_app import sql_files
+from myvc_app import usage
+from myvc_app.sql_files import SQLFile, StatementCounter
+from myvc_app.utils import get_id, is_port_in_use, is_mysql_ready, Progress, format_size, OutputThreadPoolExecutor
 
-DOCKER_CLIENT_BASE_URL = Config.get_or_none(key='DOCKER_CLIENT_BASE_URL')  # type: Config
-if DOCKER_CLIENT_BASE_URL:
-    client = docker.DockerClient(DOCKER_CLIENT_BASE_URL.value)
-else:
-    client = docker.DockerClient.from_env()
+_client = None  # type: docker.DockerClient
+# the label of the containers and volumes created by myvc, the value is their kind
+LABEL = 'myvc'
+# the label of the mysqld containers, the value is the db id
+DB_LABEL = 'myvc.db'
+# (listed at, containers by id), see get_containers_state
+_containers_state = (0, {})  # type: Tuple[float, Dict[str, Container]]
+STATE_MAX_AGE = 1
+# the mysql images by name:tag, see get_mysql_image
+_images = {}  # type: Dict[str, Image]
+# the files made by `docker save`, compressed or not
+IMAGE_TARBALL_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.xz')
 
+tracing.trace_sqlite(DB)
 
+
+def get_client() -> docker.DockerClient:
+    """The docker client is created on first use, commands which only read the metadata db never connect."""
+    global _client
+    if _client is None:
+        base_url = get_config_value('DOCKER_CLIENT_BASE_URL')
+        if base_url:
+            _client = docker.DockerClient(base_url)
+        else:
+            _client = docker.DockerClient.from_env()
+        tracing.trace_docker(_client)
+    return _client
+
+
+def __getattr__(name):
+    # keep `methods.client` working
+    if name == 'client':
+        return get_client()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def get_config_value(key: str, default: str = None) -> str:
+    cfg = Config.get_or_none(key=key)  # type: Config
+    return cfg.value if cfg and cfg.value else default
+
+
+@tracing.step
 def get_mysql_image() -> Image:
-    mysql_image_name = Config.get(key='MYSQL_IMAGE_NAME')  # type: Config
-    mysql_version = Config.get(key='MYSQL_VERSION')  # type: Config
-    name = '{}:{}'.format(mysql_image_name.value, mysql_version.value)
-    if not client.images.list(name=name):
-        client.images.pull(mysql_image_name.value, platform='linux/x86_64', tag=mysql_version.value)
-    return client.images.get(name=name)
+    """The image of MYSQL_IMAGE_NAME:MYSQL_VERSION, looked up once per process for each value of the configs."""
+    configs = {
+        c.key: c.value for c in Config.select().where(Config.key.in_(['MYSQL_IMAGE_NAME', 'MYSQL_VERSION']))
+    }
+    image_name, version = configs['MYSQL_IMAGE_NAME'], configs['MYSQL_VERSION']
+    name = '{}:{}'.format(image_name, version)
+    image = _images.get(name)
+    if image is None:
+        if not get_client().images.list(name=name):
+            # an air-gapped host loads the images from tarballs instead of pulling them
+            image_dir = get_config_value('MYSQL_IMAGE_DIR')
+            if image_dir:
+                load_images([image_dir])
+            if not get_client().images.list(name=name):
+                get_client().images.pull(image_name, platform='linux/x86_64', tag=version)
+        image = _images[name] = get_client().images.get(name)
+    return image
+
+
+@tracing.operation
+def load_images(paths: List[str]) -> List[str]:
+    """`docker load` the image tarballs, a directory means every tarball in it, return the tags of the images."""
+    files = []
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path) if name.endswith(IMAGE_TARBALL_SUFFIXES)
+            ))
+        else:
+            files.append(path)
+    tags = []
+    for file in files:
+        print('loading {}'.format(file), flush=True)
+        with open(file, 'rb') as f:
+            for image in get_client().images.load(f):
+                tags.extend(image.tags)
+    _images.clear()
+    return tags
+
+
+def create_volume(kind: str = 'volume') -> Volume:
+    """A new volume labeled as myvc's, `gc` finds it by the label if it's leaked."""
+    return get_client().volumes.create(get_id(), labels={LABEL: kind})
 
 
 def get_volume_by_name(name: str) -> Volume:
     v = None
     try:
-        v = client.volumes.get(name)
+        v = get_client().volumes.get(name)
     except docker.errors.NotFound:
         pass
     return v
 
 
+def remove_volume(volume: Volume, force: bool = False):
+    """Remove a volume after the helpers mounting it, see myvc_app.helpers."""
+    helpers.release([volume.name])
+    volume.remove(force=force)
+
+
 def rm_volume_by_name(name: str):
     v = get_volume_by_name(name)
     if v:
-        v.remove()
+        remove_volume(v)
 
 
 def get_container_by_name(name: str) -> Container:
-    containers = list(
-        filter(
-            lambda c: c.name == name,
-            client.containers.list()
-        )
-    )
+    # the name filter of docker matches a part of the name
+    containers = [c for c in get_client().containers.list(filters={'name': name}) if c.name == name]
     return containers[0] if containers else None
 
 
+def get_containers_state(max_age: float = STATE_MAX_AGE) -> Dict[str, Container]:
+    """The containers created by myvc by id, listed by one call and reused for `max_age` seconds."""
+    global _containers_state
+    listed_at, containers = _containers_state
+    if time.time() - listed_at > max_age:
+        containers = {c.id: c for c in get_client().containers.list(all=True, filters={'label': LABEL})}
+        _containers_state = (time.time(), containers)
+    return containers
+
+
+def invalidate_containers_state():
+    """Call it after a container of myvc is started or removed."""
+    global _containers_state
+    _containers_state = (0, {})
+
+
+def get_container_by_id(container_id: str) -> Optional[Container]:
+    """A container of myvc, from the state if it's there, the containers started before labeling aren't."""
+    container = get_containers_state().get(container_id)
+    if container:
+        return container
+    try:
+        return get_client().containers.get(container_id)
+    except NotFound:
+        return None
+
+
 def check_is_running(db_id: int) -> (DBInfo, Container):
     db_info = DBInfo.get(id=db_id)
     if not db_info.container_id:
         raise Exception("{} don't have running container".format(db_info.name))
-    container = client.containers.get(db_info.container_id)  # type: Container
-    if container.status != 'running':
+    container = get_container_by_id(db_info.container_id)
+    if not container or container.status != 'running':
         raise Exception("{}'s container is not running".format(db_info.name))
     return db_info, container
 
@@ -83,9 +212,44 @@ def send_file(
     container.put_archive(container_path, temp_file.read())
 
 
+def exec_with_stdin(
+        container: Container, cmd, chunks: Iterable[bytes], environment: dict = None
+) -> Tuple[int, bytes]:
+    """Run `cmd` in `container` and stream `chunks` to its stdin, nothing is buffered besides one chunk."""
+    exec_id = get_client().api.exec_create(
+        container.id, cmd, stdin=True, stdout=True, stderr=True, environment=environment
+    )['Id']
+    sock = get_client().api.exec_start(exec_id, socket=True)
+    raw_sock = getattr(sock, '_sock', sock)
+    output = []
+
+    def _read_output():
+        for _, data in frames_iter(sock, tty=False):
+            output.append(data)
+
+    reader = threading.Thread(target=_read_output, daemon=True)
+    reader.start()
+    try:
+        for chunk in chunks:
+            raw_sock.sendall(chunk)
+    except (BrokenPipeError, ConnectionResetError):
+        # the command exited early, its output tells why
+        pass
+    finally:
+        raw_sock.shutdown(socket.SHUT_WR)
+    reader.join()
+    sock.close()
+    while True:
+        result = get_client().api.exec_inspect(exec_id)
+        if not result['Running']:
+            return result['ExitCode'], b''.join(output)
+        time.sleep(0.1)
+
+
+@tracing.step
 def init_mysql_conf_volume(volume: Volume = None, conf_name: str = None) -> Volume:
     if not volume:
-        volume = client.volumes.create(get_id())
+        volume = create_volume()
     else:
         clean_volume(volume)
 
@@ -94,123 +258,305 @@ def init_mysql_conf_volume(volume: Volume = None, conf_name: str = None) -> Volu
     else:
         conf = MySQLConf.get(name=conf_name)  # type: MySQLConf
 
-    image = get_mysql_image()
-    temp_name = get_id()
-    client.containers.run(
-        image, name=temp_name,
-        command='bash',
-        remove=True,
-        volumes={
-            volume.name: {'bind': '/etc/mysql/conf.d/', 'mode': 'rw'}
-        },
-        detach=True, stdout=True, stderr=True, tty=True
-    )
-    container = get_container_by_name(temp_name)
     cnf_file_name = '{}.cnf'.format(conf.name)
-    with NamedTemporaryFile(buffering=0, suffix='.cnf') as cnf_file:
-        cnf_file.write(conf.content.encode('utf8'))
-        send_file(container, cnf_file.name, cnf_file_name, '/etc/mysql/conf.d/')
-    container.exec_run(
-        "bash -c '{}'".format(
-            "chmod 644 /etc/mysql/conf.d/{0} && "
-            "chown root:root /etc/mysql/conf.d/{0}".format(cnf_file_name)
+    with volume_container(volume) as (container, (conf_dir,)):
+        with NamedTemporaryFile(buffering=0, suffix='.cnf') as cnf_file:
+            cnf_file.write(conf.content.encode('utf8'))
+            send_file(container, cnf_file.name, cnf_file_name, conf_dir)
+        container.exec_run(
+            ['bash', '-c', 'chmod 644 {0}/{1} && chown root:root {0}/{1}'.format(conf_dir, cnf_file_name)]
         )
-    )
-    container.stop()
     return volume
 
 
-def copy_volume(from_volume: Volume, to_volume: Volume):
+@contextmanager
+def temp_container(volumes: dict) -> Container:
     image = get_mysql_image()
     temp_name = get_id()
-    c = client.containers.run(
+    container = get_client().containers.run(
         image, name=temp_name,
-        command='bash -c "rm -rf /data/to/* && cp -a /data/from/* /data/to/"',
+        command='bash',
         remove=True,
-        volumes={
-            from_volume.name: {'bind': '/data/from', 'mode': 'rw'},
-            to_volume.name: {'bind': '/data/to', 'mode': 'rw'}
-        },
-        detach=True
+        volumes=volumes,
+        labels={LABEL: 'temp'},
+        detach=True, tty=True
     )  # type: Container
-    c.wait(condition='removed')
+    try:
+        yield container
+    finally:
+        container.stop()
+
+
+@contextmanager
+def volume_container(*volumes: Volume) -> Tuple[Container, List[str]]:
+    """
+    Yield a container which can reach `volumes` and the paths of them inside it.
+    A pooled helper container is used if one can mount them, otherwise a temp container mounts them.
+    """
+    with helpers.use(volumes) as helper:
+        if helper:
+            yield helper.container, helper.volume_paths(volumes)
+            return
+    paths = ['/data/{}'.format(i) for i in range(len(volumes))]
+    with temp_container({
+        v.name: {'bind': path, 'mode': 'rw'} for v, path in zip(volumes, paths)
+    }) as container:
+        yield container, paths
+
+
+@tracing.step
+def copy_volume(from_volume: Volume, to_volume: Volume):
+    backend = get_backend(get_config_value('SNAPSHOT_BACKEND'))
+    with volume_container(from_volume, to_volume) as (container, (from_dir, to_dir)):
+        exit_code, output = container.exec_run(['bash', '-c', backend.copy_command(from_dir, to_dir)])
+    if exit_code:
+        raise Exception('copy volume {} to {} failed by {} backend: {}'.format(
+            from_volume.name, to_volume.name, backend.name, output.decode(errors='replace')
+        ))
+    usage.forget([to_volume.name])
 
 
+@tracing.step
 def clean_volume(volume: Volume):
-    image = get_mysql_image()
-    temp_name = get_id()
-    c = client.containers.run(
-        image, name=temp_name,
-        command='bash -c "rm -rf /data/*"',
-        remove=True,
-        volumes={
-            volume.name: {'bind': '/data', 'mode': 'rw'},
-        },
-        detach=True
-    )  # type: Container
-    c.wait(condition='removed')
+    with volume_container(volume) as (container, (path,)):
+        exit_code, output = container.exec_run(['bash', '-c', 'rm -rf {}/*'.format(path)])
+    if exit_code:
+        raise Exception('clean volume {} failed: {}'.format(volume.name, output.decode(errors='replace')))
+    usage.forget([volume.name])
+
 
+def get_internal_container_name(db_info: DBInfo, version: DataVersion) -> str:
+    return 'myvc.{}.{}'.format(db_info.id, version.id)
 
-def init_container(db_info: DBInfo) -> Container:
-    if is_port_in_use(db_info.port, wait_seconds=3):
-        raise Exception('the port {} is in use.'.format(db_info.port))
+
+@tracing.step
+def init_container(
+    db_info: DBInfo, version: DataVersion = None, internal_port: bool = False, volume: Volume = None
+) -> Container:
+    """
+    Run mysqld on `version`, the current version by default, or on `volume` holding a rebuilt copy of it.
+    With `internal_port` the container is published on a random port instead of the db's port, see myvc_app.standby.
+    """
+    version = version or db_info.current_version
+    volume_name = volume.name if volume else version.volume
+    if internal_port:
+        name = get_internal_container_name(db_info, version)
+        port = None
+        # a container left by a crashed process
+        try:
+            get_client().containers.get(name).remove(force=True)
+        except NotFound:
+            pass
+    else:
+        if is_port_in_use(db_info.port, wait_seconds=3):
+            raise Exception('the port {} is in use.'.format(db_info.port))
+        name = f'myvc.{db_info.id}'
+        port = db_info.port
 
     image = get_mysql_image()
 
-    container = client.containers.run(
-        image, name=f'myvc.{db_info.id}',
+    container = get_client().containers.run(
+        image, name=name,
         volumes={
             db_info.conf_volume: {'bind': '/etc/mysql/conf.d', 'mode': 'rw'},
-            db_info.current_version.volume: {'bind': '/var/lib/mysql', 'mode': 'rw'},
+            volume_name: {'bind': '/var/lib/mysql', 'mode': 'rw'},
         },
-        ports={'3306/tcp': db_info.port},
+        ports={'3306/tcp': port},
         environment={'MYSQL_ROOT_PASSWORD': db_info.password},
+        labels={LABEL: 'db', DB_LABEL: str(db_info.id)},
         detach=True,
     )
+    invalidate_containers_state()
+    # written by mysqld from now on
+    usage.forget([volume_name])
     return container
 
 
+def get_published_port(container: Container) -> int:
+    container.reload()
+    return int(container.ports['3306/tcp'][0]['HostPort'])
+
+
+def is_proxied() -> bool:
+    """Whether the db's port is held by the proxy of myvc instead of the container, see myvc_app.proxy."""
+    return get_config_value('PROXY_MODE', 'off') == 'on' or standby.is_enabled()
+
+
+def get_drain_seconds() -> float:
+    return float(get_config_value('PROXY_DRAIN_SECONDS', '10'))
+
+
+@tracing.step
+def start_proxy(db_info: DBInfo, port: int):
+    """Forward the db's port to `port` of the docker host, the proxy is started if it's not running."""
+    proxy.set_target(db_info.id, get_docker_host(), port)
+    proxy.start(
+        db_info.id, db_info.port,
+        hold_seconds=float(get_config_value('READY_TIMEOUT', '180')), drain_seconds=get_drain_seconds()
+    )
+
+
+@tracing.step
+def hold_connections(db_id: int):
+    """Before the container of the db restarts, make the new connections wait and close the current ones."""
+    if not proxy.drain(db_id, get_drain_seconds()):
+        print('some connections of db {} are still busy, they will be closed'.format(db_id))
+
+
+def get_docker_host() -> str:
+    """The host where the published ports of containers are reachable."""
+    base_url = get_config_value('DOCKER_CLIENT_BASE_URL') or os.environ.get('DOCKER_HOST') or ''
+    if base_url.startswith('tcp://') or base_url.startswith('ssh://'):
+        return urlparse(base_url).hostname or '127.0.0.1'
+    return '127.0.0.1'
+
+
+@tracing.step
+def wait_until_ready(db_info: DBInfo, container: Container, timeout: float = None, port: int = None) -> float:
+    """Wait until mysqld of `container` accepts connections on `port`, the db's port by default."""
+    timeout = timeout or float(get_config_value('READY_TIMEOUT', '180'))
+    port = port or db_info.port
+    host = get_docker_host()
+    start_at = time.time()
+    delay = 0.05
+    while True:
+        if is_mysql_ready(port, host):
+            return time.time() - start_at
+        container.reload()
+        if container.status in ('exited', 'dead'):
+            raise Exception('{} exited before ready:\n{}'.format(
+                db_info.name, container.logs(tail=20).decode(errors='replace')
+            ))
+        if time.time() - start_at > timeout:
+            raise Exception('{} is not ready in {} seconds'.format(db_info.name, timeout))
+        time.sleep(delay)
+        delay = min(delay * 1.5, 1)
+
+
+@tracing.step
+def start_container(db_info: DBInfo, operation: str) -> float:
+    """Start the container of the current version, wait until it is ready and record how long it took."""
+    start_at = time.time()
+    proxied = is_proxied()
+    if not proxied:
+        proxy.stop(db_info.id)
+    container = init_container(db_info, internal_port=proxied)
+    db_info.container_id = container.id
+    db_info.is_up = True
+    db_info.save()
+    port = get_published_port(container) if proxied else db_info.port
+    wait_until_ready(db_info, container, port=port)
+    if proxied:
+        start_proxy(db_info, port)
+    seconds = time.time() - start_at
+    ReadyTime.create(db=db_info, version=db_info.current_version, operation=operation, seconds=seconds)
+    return seconds
+
+
+@tracing.operation
 def new_db(name: str, port: int, password: str):
+    db_info = DBInfo(
+        name=name, port=port, password=password
+    )
+    conf_volume = init_mysql_conf_volume()
+    db_info.conf_volume = conf_volume.name
+    data_volume = create_volume()
+    try:
+        templates.fill(db_info, data_volume)
+    except Exception:
+        remove_volume(conf_volume)
+        remove_volume(data_volume)
+        raise
+
     with DB.atomic():
-        db_info = DBInfo(
-            name=name, port=port, password=password
-        )
-        conf_volume = init_mysql_conf_volume()
-        db_info.conf_volume = conf_volume.name
         db_info.save()
-
-        data_volume = client.volumes.create(get_id())
         data_version = DataVersion()
         data_version.db = db_info
         data_version.volume = data_volume.name
         data_version.name = 'Init {}'.format(name)
-        data_version.save()
+        DataVersion.insert_tree([data_version])
         db_info.current_version = data_version
         db_info.save()
 
         try:
-            container = init_container(db_info)
+            start_at = time.time()
+            container = init_container(db_info, internal_port=is_proxied())
             db_info.container_id = container.id
+            db_info.is_up = True
             db_info.save()
-            return db_info.id
         except Exception:
-            conf_volume.remove()
-            data_volume.remove()
+            remove_volume(conf_volume)
+            remove_volume(data_volume)
             raise
 
+    # without a datadir template the first start initializes the datadir, it's much slower than the later starts
+    if is_proxied():
+        port = get_published_port(container)
+        wait_until_ready(db_info, container, port=port)
+        start_proxy(db_info, port)
+        if standby.is_enabled():
+            standby.add(db_info, data_version, container, port)
+    else:
+        wait_until_ready(db_info, container)
+    ReadyTime.create(db=db_info, version=data_version, operation='new_db', seconds=time.time() - start_at)
+    return db_info.id
+
+
+def rm_versions(versions: ModelSelect):
+    """Drop the rows of `versions` by a few statements, their volumes are removed by the reclaimer later."""
+    version_ids = versions.select(DataVersion.id)
+    reclaim.tombstone([v.volume for v in versions.select(DataVersion.volume)])
+    VolumeUsage.delete().where(VolumeUsage.volume.in_(versions.select(DataVersion.volume))).execute()
+    VersionFile.delete().where(VersionFile.version.in_(version_ids)).execute()
+    DataVersion.delete().where(DataVersion.id.in_(version_ids)).execute()
+
 
+@tracing.operation
+@compaction.db_locked
 def rm_db(db_id: int):
+    db_info = DBInfo.get(id=db_id)  # type: DBInfo
+    stop_db(db_id)
     with DB.atomic():
-        db_info = DBInfo.get_or_none(id=db_id)
-        stop_db(db_id)
-        if db_info:
-            for v in db_info.versions:
-                rm_volume_by_name(v.volume)
-                v.delete_instance()
-            rm_volume_by_name(db_info.conf_volume)
+        reclaim.tombstone([db_info.conf_volume])
+        rm_versions(db_info.versions)
         db_info.delete_instance()
+    reclaim.start_background()
+    chunks.collect_garbage()
+
+
+@tracing.operation
+def collect_orphans(dry_run: bool = False) -> List[dict]:
+    """Find the containers and volumes leaked by failed operations and remove them unless `dry_run`."""
+    return orphans.collect(dry_run)
+
+
+@tracing.operation
+def get_version_sizes(db_id: int, full: bool = False, cached: bool = False) -> Dict[int, Optional[int]]:
+    """The size of every version of a db by version id, None if unknown, `cached` scans nothing, see myvc_app.usage."""
+    return usage.get_version_sizes(DBInfo.get(id=db_id).versions, full, cached)
+
+
+def get_in_use_version_ids(db_id: int) -> Set[int]:
+    """The versions of a db written by mysqld, the current one and the standbys, their kept sizes may be stale."""
+    in_use = usage.get_in_use_volumes()
+    return {v.id for v in DBInfo.get(id=db_id).versions if v.volume in in_use}
 
 
+@tracing.operation
+def get_branch_usage(full: bool = False) -> List[dict]:
+    """The disk usage of every version, the largest reclaimable first, `full` scans every volume again."""
+    return usage.get_branch_usage(full)
+
+
+@tracing.operation
+def reclaim_volumes():
+    """Remove the tombstoned volumes in this process, the ones which failed too many times are tried again."""
+    reclaim.retry_failed()
+    reclaim.run_locked()
+
+
+@tracing.operation
+@compaction.db_locked
 def rm_version(db_id: int, version_id: int):
     db_info = DBInfo.get(id=db_id)
     if db_info.current_version and version_id == db_info.current_version.id:
@@ -229,12 +575,18 @@ def rm_version(db_id: int, version_id: int):
         if not answer:
             return
 
+    for standby_container in StandbyContainer.select().where(
+            StandbyContainer.version.in_(version.self_and_child_versions)
+    ):
+        standby.stop_standby(standby_container.version)
     with DB.atomic():
-        for v in version.self_and_child_versions:
-            rm_volume_by_name(v.volume)
-            v.delete_instance()
+        rm_versions(version.self_and_child_versions)
+    reclaim.start_background()
+    chunks.collect_garbage()
 
 
+@tracing.operation
+@compaction.db_locked
 def clean_data(db_id: int, version_id: int = None):
     db_info = DBInfo.get(id=db_id)
     if not version_id and not db_info.current_version:
@@ -244,20 +596,46 @@ def clean_data(db_id: int, version_id: int = None):
     else:
         version = db_info.current_version
     is_clean_current_version = version == db_info.current_version
+    stop_version(db_info, version)
+    deltas.prepare_for_write(version)
     volume = get_volume_by_name(version.volume)
-    assert volume, "version {} not exists".format(volume.name)
-    if is_clean_current_version:
-        stop_db(db_id)
-    clean_volume(volume)
+    assert volume, "version {} not exists".format(version.volume)
+    if not templates.fill(db_info, volume):
+        clean_volume(volume)
     if is_clean_current_version:
         start_db(db_id)
 
 
-def stop_db(db_id: int):
+@tracing.step
+def stop_version(db_info: DBInfo, version: DataVersion):
+    """Stop the container running on `version`, so its volume can be read or written."""
+    is_current = version == db_info.current_version
+    if is_current:
+        hold_connections(db_info.id)
+    if standby.stop_standby(version):
+        return
+    if is_current:
+        stop_db(db_info.id, keep_proxy=True)
+
+
+@tracing.operation
+@compaction.db_locked
+def stop_db(db_id: int, keep_proxy: bool = False, keep_up: bool = False):
+    """
+    Stop the container of the db, and in standby mode all its standbys.
+    The proxy is kept for a restart, the new connections wait in it until the db is started again.
+    The db is no longer started by `up` unless it's kept up or restarted.
+    """
+    standby.stop_all(db_id)
+    if not keep_proxy:
+        proxy.stop(db_id)
     db_info = DBInfo.get_or_none(id=db_id)
+    if db_info and db_info.is_up and not keep_proxy and not keep_up:
+        db_info.is_up = False
+        db_info.save()
     if db_info and db_info.container_id:
         try:
-            container = client.containers.get(db_info.container_id)  # type: Container
+            container = get_client().containers.get(db_info.container_id)  # type: Container
             container.stop()
             container.wait()
             container.remove()
@@ -273,77 +651,291 @@ def stop_db(db_id: int):
         if db_info:
             db_info.container_id = None
             db_info.save()
+    invalidate_containers_state()
 
 
-def start_db(db_id: int):
+def is_db_running(db_info: DBInfo) -> bool:
+    container = get_container_by_id(db_info.container_id) if db_info.container_id else None
+    return bool(container) and container.status == 'running'
+
+
+def get_db_statuses() -> Dict[int, str]:
+    """
+    The status of every db by one docker call, e.g. {1: 'running', 2: 'stopped', 3: 'running, 2 standbys'}.
+    The containers started before labeling, or removed, are looked up by one more call for all of them.
+    Empty if docker can't be reached, the commands reading the metadata db still work.
+    """
+    db_infos = list(DBInfo.select(DBInfo.id, DBInfo.container_id))
+    try:
+        state = get_containers_state(max_age=0)
+        missing = [d.container_id for d in db_infos if d.container_id and d.container_id not in state]
+        unlabeled = {
+            c.id: c for c in get_client().containers.list(all=True, filters={'id': missing})
+        } if missing else {}
+    except docker.errors.DockerException:
+        return {}
+    standby_counts = {}
+    for container in state.values():
+        if container.status == 'running' and DB_LABEL in container.labels:
+            db_id = int(container.labels[DB_LABEL])
+            standby_counts[db_id] = standby_counts.get(db_id, -1) + 1
+    statuses = {}
+    for db_info in db_infos:
+        container = state.get(db_info.container_id) or unlabeled.get(db_info.container_id)
+        status = container.status if container else 'stopped'
+        if standby_counts.get(db_info.id, 0) > 0:
+            status = '{}, {} standbys'.format(status, standby_counts[db_info.id])
+        statuses[db_info.id] = status
+    return statuses
+
+
+def get_up_db_ids() -> List[int]:
+    """The dbs which were running before they were stopped by `stop all` or a reboot."""
+    return [db_info.id for db_info in DBInfo.select().where(DBInfo.is_up == True) if not is_db_running(db_info)]  # noqa: E712
+
+
+def run_on_dbs(operation: Callable[[int], Optional[float]], db_ids: List[int], jobs: int = None) -> List[dict]:
+    """
+    Run `operation` on the dbs, at most `jobs` (the BULK_JOBS config) of them at the same time.
+    Return a result per db in the order of `db_ids`:
+        {'db_id': 1, 'name': 'test', 'seconds': 12.3, 'ready_seconds': 10.1, 'error': None}
+    `ready_seconds` is the value returned by `operation`, e.g. the ready time of `start_db`.
+    """
+    jobs = jobs or int(get_config_value('BULK_JOBS', '4'))
+    names = {db_info.id: db_info.name for db_info in DBInfo.select().where(DBInfo.id.in_(db_ids))}
+    finished = itertools.count(1)
+    print_lock = threading.Lock()
+
+    def _run(db_id: int) -> dict:
+        result = {'db_id': db_id, 'name': names.get(db_id, str(db_id)), 'ready_seconds': None, 'error': None}
+        start_at = time.time()
+        try:
+            result['ready_seconds'] = operation(db_id)
+        except Exception as e:
+            result['error'] = str(e) or e.__class__.__name__
+        finally:
+            # give the connection of this thread back to the pool
+            DB.close()
+        result['seconds'] = time.time() - start_at
+        with print_lock:
+            print('[{}/{}] {} {} in {:.1f}s'.format(
+                next(finished), len(db_ids), result['name'], 'failed' if result['error'] else 'done', result['seconds']
+            ), flush=True)
+        return result
+
+    with OutputThreadPoolExecutor(max_workers=max(1, min(jobs, len(db_ids) or 1))) as executor:
+        return list(executor.map(_run, db_ids))
+
+
+@tracing.operation
+@compaction.db_locked
+def start_db(db_id: int) -> float:
     db_info = DBInfo.get(id=db_id)
+    deltas.prepare_for_write(db_info.current_version)
     current_data_volume = get_volume_by_name(db_info.current_version.volume)
     if not current_data_volume:
         raise Exception("{}'s current data version {} not exists".format(db_info.name, db_info.current_version.name))
     conf_volume = get_volume_by_name(db_info.conf_volume)
     if not conf_volume:
         raise Exception("{}'s conf volume not exists".format(db_info.name))
-    stop_db(db_id)
-    container = init_container(db_info)
-    db_info.container_id = container.id
-    db_info.save()
+    if standby.is_enabled():
+        return standby.switch(db_info, db_info.current_version, 'start_db')
+    hold_connections(db_id)
+    stop_db(db_id, keep_proxy=True)
+    return start_container(db_info, 'start_db')
 
 
-def apply_version(db_id: int, version_id: int):
+@tracing.operation
+@compaction.db_locked
+def apply_version(db_id: int, version_id: int) -> float:
     db_info = DBInfo.get(id=db_id)  # type: DBInfo
     version = DataVersion.get(db=db_info, id=version_id)  # type: DataVersion
-    stop_db(db_id)
+    previous_version = db_info.current_version  # type: DataVersion
+    if standby.is_enabled():
+        # the previous version keeps running as a standby, it's compacted when evicted
+        return standby.switch(db_info, version, 'apply_version')
+    hold_connections(db_id)
+    stop_db(db_id, keep_proxy=True)
+    deltas.prepare_for_write(version)
     db_info.current_version = version
-    container = init_container(db_info)
-    db_info.container_id = container.id
-    db_info.save()
+    seconds = start_container(db_info, 'apply_version')
+    if previous_version:
+        # reading its whole datadir would slow down the switch
+        compaction.start_background(compaction.get_candidates(previous_version))
+    return seconds
 
 
+@tracing.operation
+@compaction.db_locked
 def copy_from(db_id: int, from_version_id: int):
     db_info = DBInfo.get(id=db_id)  # type: DBInfo
     from_version = DataVersion.get(db=db_info, id=from_version_id)  # type: DataVersion
     assert db_info.current_version, "{}'s using version not exists".format(db_info.name)
+    stop_version(db_info, db_info.current_version)
+    stop_version(db_info, from_version)
+    deltas.prepare_for_write(db_info.current_version)
     current_volume = get_volume_by_name(db_info.current_version.volume)
     assert current_volume, "{}'s using version {} not exists".format(db_info.name, db_info.current_version.name)
-    from_volume = get_volume_by_name(from_version.volume)
-    assert from_volume, "volume {} not exists".format(from_volume.name)
-    stop_db(db_id)
-    copy_volume(from_volume, current_volume)
+    if from_version.snapshot_type == deltas.FULL:
+        # the other snapshot types keep their data outside the volume
+        assert get_volume_by_name(from_version.volume), "volume {} not exists".format(from_version.volume)
+    deltas.materialize_into(from_version, current_volume)
     start_db(db_id)
 
 
+@tracing.operation
 def apply_sql(db_id: int, sql_path, database_name: str = None):
     sql_path = os.path.expanduser(sql_path)
     if not os.path.exists(sql_path):
         raise Exception('{} not exists'.format(sql_path))
     sql_path = os.path.abspath(sql_path)
     db_info, container = check_is_running(db_id)
-    if sql_path.endswith('.gz'):
-        try:
-            sql_file_content = gzip.GzipFile(sql_path).read()
-            with NamedTemporaryFile(buffering=0, suffix='.sql') as sql_file:
-                sql_file.write(sql_file_content)
-                sql_file_name = os.path.basename(sql_file.name)
-                send_file(container, sql_file.name, sql_file_name, '/')
-        except Exception as e:
-            questionary.print('parse sql file failed -> {}'.format(e))
-            exit(0)
-    else:
-        sql_file_name = os.path.basename(sql_path)
-        send_file(container, sql_path, sql_file_name, '/')
+    cmd = ['mysql', '-u', 'root']
     if database_name:
-        print(container.exec_run(
-            "bash -c 'exec mysql -u root -p{} -D {} < \"/{}\"'".format(
-                db_info.password, database_name, sql_file_name
-            )
-        ).output.decode())
-    else:
-        print(container.exec_run(
-            "bash -c 'exec mysql -u root -p{} < \"/{}\"'".format(db_info.password, sql_file_name)
-        ).output.decode())
+        cmd += ['-D', database_name]
+
+    counter = StatementCounter()
+    progress = Progress(os.path.basename(sql_path), total=os.path.getsize(sql_path), unit='statements')
+    with SQLFile(sql_path) as sql_file:
+        def _chunks():
+            for chunk in sql_file.iter_chunks():
+                progress.update(len(chunk), counter.feed(chunk), sql_file.position)
+                yield chunk
+
+        exit_code, output = exec_with_stdin(
+            container, cmd, _chunks(), environment={'MYSQL_PWD': db_info.password}
+        )
+    progress.finish()
+    print(output.decode(errors='replace'))
+    if exit_code:
+        raise Exception('run {} failed, exit code: {}'.format(sql_path, exit_code))
+
+
+def get_container_cpu_count(container: Container) -> int:
+    exit_code, output = container.exec_run('nproc')
+    if exit_code != 0:
+        return 1
+    return max(int(output.strip() or 1), 1)
+
+
+@tracing.operation
+def apply_sql_parallel(db_id: int, sql_path, database_name: str = None, jobs: int = None):
+    """
+    Load every table of a mysqldump style dump in its own session, `jobs` sessions at the same time.
+    Views, triggers, routines and other statements are applied in order after all the tables are loaded.
+    """
+    sql_path = os.path.expanduser(sql_path)
+    if not os.path.exists(sql_path):
+        raise Exception('{} not exists'.format(sql_path))
+    sql_path = os.path.abspath(sql_path)
+    db_info, container = check_is_running(db_id)
+    jobs = jobs or get_container_cpu_count(container)
+    cmd = ['mysql', '-u', 'root']
+    if database_name:
+        cmd += ['-D', database_name]
+    environment = {'MYSQL_PWD': db_info.password}
+    session_statements = []
+    table_session_statements = [b'SET FOREIGN_KEY_CHECKS=0;\n', b'SET UNIQUE_CHECKS=0;\n']
+
+    def _run(statements: Iterable[bytes], f=None):
+        chunks = itertools.chain(
+            session_statements, statements,
+            iter(lambda: f.read(sql_files.CHUNK_SIZE), b'') if f else []
+        )
+        return exec_with_stdin(container, cmd, chunks, environment=environment)
+
+    # the tables read but not loaded yet, the reading waits for the sessions instead of holding the whole dump
+    pending_tables = threading.Semaphore(jobs * 2)
+    failed_event = threading.Event()
+
+    def _load_table(key, table_file, previous: Future):
+        try:
+            # the table appears again after other tables in the dump, load it after the former part
+            if previous:
+                previous.result()
+            use_statements = [b'USE ' + key[0] + b';\n'] if key[0] else []
+            with table_file:
+                table_file.seek(0)
+                exit_code, output = _run(table_session_statements + use_statements, table_file)
+            if exit_code:
+                raise Exception(output.decode(errors='replace'))
+        except Exception:
+            failed_event.set()
+            raise
+        finally:
+            pending_tables.release()
+
+    counter = StatementCounter()
+    progress = Progress(os.path.basename(sql_path), total=os.path.getsize(sql_path), unit='statements')
+    futures = {}
+    last_futures = {}
+    with OutputThreadPoolExecutor(max_workers=jobs) as executor, \
+            SpooledTemporaryFile(max_size=sql_files.CHUNK_SIZE) as final_file, \
+            SQLFile(sql_path) as sql_file:
+        def _chunks():
+            for chunk in sql_file.iter_chunks():
+                progress.update(len(chunk), counter.feed(chunk), sql_file.position)
+                yield chunk
+
+        def _submit(key, table_file):
+            future = executor.submit(_load_table, key, table_file, last_futures.get(key))
+            futures[future] = key
+            last_futures[key] = future
+
+        current_key, current_file = None, None
+        for kind, key, statement in sql_files.split_dump(_chunks()):
+            if kind == sql_files.TABLE and key == current_key:
+                current_file.write(statement)
+                continue
+            if current_file:
+                _submit(current_key, current_file)
+                current_key, current_file = None, None
+            if failed_event.is_set():
+                # the load fails anyway, stop reading the dump
+                break
+            if kind == sql_files.SESSION:
+                session_statements.append(statement)
+            elif kind == sql_files.SCHEMA:
+                exit_code, output = _run([statement])
+                if exit_code:
+                    raise Exception('run {} failed: {}'.format(statement.decode(), output.decode(errors='replace')))
+            elif kind == sql_files.TABLE:
+                pending_tables.acquire()
+                current_key, current_file = key, SpooledTemporaryFile(max_size=16 * sql_files.CHUNK_SIZE)
+                current_file.write(statement)
+            else:
+                final_file.write(statement)
+        if current_file:
+            _submit(current_key, current_file)
+        progress.finish()
+
+        failed = []
+        for future, key in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                failed.append('{}: {}'.format(key[1].decode(), e))
+        if failed:
+            raise Exception('load tables failed\n{}'.format('\n'.join(failed)))
+
+        final_file.seek(0)
+        exit_code, output = _run([], final_file)
+    print(output.decode(errors='replace'))
+    if exit_code:
+        raise Exception('run {} failed, exit code: {}'.format(sql_path, exit_code))
+    print('loaded {} tables by {} sessions'.format(len(last_futures), jobs))
+
+
+@tracing.operation
+@compaction.db_locked
+def backup_version(db_id: int, name: str, version_id: int = None) -> DataVersion:
+    return backup_versions(db_id, [name], version_id)[0]
 
 
-def backup_version(db_id: int, name: str, version_id: int = None) -> Volume:
+@tracing.operation
+@compaction.db_locked
+def backup_versions(db_id: int, names: List[str], version_id: int = None) -> List[DataVersion]:
+    """Create a branch for every name from the same version, all of them are inserted in one transaction."""
     db_info = DBInfo.get(id=db_id)
     if version_id:
         version = DataVersion.get(db=db_info, id=version_id)
@@ -351,26 +943,193 @@ def backup_version(db_id: int, name: str, version_id: int = None) -> Volume:
         version = db_info.current_version
         assert version, "Can't find {}'s current version".format(db_info.name)
 
+    if chunks.is_chunk_mode() and version.snapshot_type in (deltas.FULL, chunks.CHUNKED):
+        stop_version(db_info, version)
+        try:
+            return chunks.new_chunked_children(version, names)
+        finally:
+            if version == db_info.current_version:
+                start_db(db_id)
+
     volume = get_volume_by_name(version.volume)
     assert volume, "Can't find volume: {}".format(version.volume)
 
-    if version == db_info.current_version:
-        stop_db(db_id)
+    if version != db_info.current_version and deltas.is_delta_mode():
+        standby.stop_standby(version)
+        return [deltas.new_delta_child(version, name) for name in names]
+
+    stop_version(db_info, version)
+
+    new_versions = []
+    try:
+        for name in names:
+            new_volume = create_volume()
+            new_versions.append(DataVersion(
+                volume=new_volume.name,
+                name=name,
+                parent=version,
+                db=db_info
+            ))
+            deltas.materialize_into(version, new_volume)
+        DataVersion.insert_tree(new_versions)
+    except Exception:
+        for v in new_versions:
+            rm_volume_by_name(v.volume)
+        raise
+    finally:
+        if version == db_info.current_version:
+            start_db(db_id)
+
+    return new_versions
+
+
+def get_volume_size(container: Container, path: str) -> int:
+    exit_code, output = container.exec_run(['du', '-sb', path])
+    return int(output.split()[0]) if exit_code == 0 else None
 
-    new_volume = client.volumes.create(get_id())
-    new_version = DataVersion(
-        volume=new_volume.name,
+
+@tracing.operation
+@compaction.db_locked
+def export_version(db_id: int, version_id: int, archive_path: str):
+    """Stream the datadir of a version and its metadata into a compressed archive, see myvc_app.archives."""
+    archive_path = os.path.abspath(os.path.expanduser(archive_path))
+    archives.check_path(archive_path)
+    db_info = DBInfo.get(id=db_id)
+    version = DataVersion.get(db=db_info, id=version_id)  # type: DataVersion
+    is_current = version == db_info.current_version
+    stop_version(db_info, version)
+    temp_volume = None
+    try:
+        if version.snapshot_type != deltas.FULL:
+            # a delta layer or chunked version is not a datadir, rebuild it first
+            temp_volume = create_volume()
+            deltas.materialize_into(version, temp_volume)
+            volume = temp_volume
+        else:
+            volume = get_volume_by_name(version.volume)
+            assert volume, "Can't find volume: {}".format(version.volume)
+        metadata = {
+            'name': version.name,
+            'db_name': db_info.name,
+            'mysql_image': '{}:{}'.format(get_config_value('MYSQL_IMAGE_NAME'), get_config_value('MYSQL_VERSION')),
+            'create_at': str(version.create_at),
+        }
+        with volume_container(volume) as (container, (path,)):
+            progress = Progress(os.path.basename(archive_path), total=get_volume_size(container, path))
+            chunks, _ = container.get_archive(path)
+            archives.write_archive(archive_path, metadata, chunks, path, on_read=progress.update)
+            progress.finish()
+    finally:
+        if temp_volume:
+            remove_volume(temp_volume)
+        if is_current:
+            start_db(db_id)
+    print('exported to {} ({})'.format(archive_path, format_size(os.path.getsize(archive_path))))
+
+
+@tracing.operation
+@compaction.db_locked
+def import_version(db_id: int, archive_path: str, parent_version_id: int, name: str = None) -> DataVersion:
+    """Create a child of a version from an archive, any db can import an archive of any other db."""
+    archive_path = os.path.abspath(os.path.expanduser(archive_path))
+    if not os.path.exists(archive_path):
+        raise Exception('{} not exists'.format(archive_path))
+    db_info = DBInfo.get(id=db_id)
+    parent = DataVersion.get(db=db_info, id=parent_version_id)  # type: DataVersion
+    volume = create_volume()
+    try:
+        with archives.ArchiveReader(archive_path) as reader:
+            mysql_image = '{}:{}'.format(get_config_value('MYSQL_IMAGE_NAME'), get_config_value('MYSQL_VERSION'))
+            if reader.metadata.get('mysql_image') != mysql_image:
+                print('{} is exported from {}, the current image is {}'.format(
+                    archive_path, reader.metadata.get('mysql_image'), mysql_image
+                ))
+            progress = Progress(os.path.basename(archive_path), total=os.path.getsize(archive_path))
+
+            def _chunks():
+                for chunk in reader.iter_data_tar():
+                    progress.update(len(chunk), position=reader.position)
+                    yield chunk
+
+            with volume_container(volume) as (container, (path,)):
+                container.put_archive(path, _chunks())
+            progress.finish()
+            version = DataVersion(
+                volume=volume.name,
+                name=name or reader.metadata['name'],
+                parent=parent,
+                db=db_info,
+            )
+            DataVersion.insert_tree([version])
+    except Exception:
+        remove_volume(volume)
+        raise
+    return version
+
+
+@tracing.operation
+@compaction.db_locked
+def backup_logical_version(db_id: int, name: str, jobs: int = None) -> DataVersion:
+    """Dump the running db into a new logical child of the current version, the db keeps running."""
+    db_info, container = check_is_running(db_id)
+    jobs = jobs or get_container_cpu_count(container)
+    volume = create_volume()
+    try:
+        logical.dump_into(db_info, volume, jobs)
+    except Exception:
+        remove_volume(volume)
+        raise
+    version = DataVersion(
+        volume=volume.name,
         name=name,
-        parent=version,
-        db=db_info
+        parent=db_info.current_version,
+        db=db_info,
+        snapshot_type=logical.LOGICAL,
     )
-    copy_volume(volume, new_volume)
-    new_version.save()
+    DataVersion.insert_tree([version])
+    return version
+
+
+@tracing.operation
+@compaction.db_locked
+def restore_logical_version(db_id: int, version_id: int, tables: List[str] = None, jobs: int = None):
+    """Restore all or some tables of a logical version into the running db, the other tables are not touched."""
+    db_info, container = check_is_running(db_id)
+    version = DataVersion.get(db=db_id, id=version_id)  # type: DataVersion
+    if version.snapshot_type != logical.LOGICAL:
+        raise Exception('version {}({}) is not a logical version'.format(version.volume, version.name))
+    logical.restore(version, db_info, container, tables, jobs)
+
+
+@tracing.operation
+@compaction.db_locked
+def diff_versions(db_id: int, from_version_id: int, to_version_id: int, jobs: int = None) -> List[dict]:
+    """The tables which differ between two versions of a db and the key ranges of the changed rows."""
+    if from_version_id == to_version_id:
+        raise Exception("Can't diff a version with itself")
+    db_info = DBInfo.get(id=db_id)  # type: DBInfo
+    from_version = DataVersion.get(db=db_id, id=from_version_id)  # type: DataVersion
+    to_version = DataVersion.get(db=db_id, id=to_version_id)  # type: DataVersion
+    return diffs.diff(db_info, from_version, to_version, jobs)
+
+
+@tracing.operation
+@compaction.db_locked
+def compact_version(db_id: int, version_id: int):
+    version = DataVersion.get(db=db_id, id=version_id)  # type: DataVersion
+    if chunks.is_chunk_mode():
+        chunks.store_version(version)
+    else:
+        deltas.compact_version(version)
 
-    if version == db_info.current_version:
-        start_db(db_id)
 
-    return new_version
+@tracing.step
+def compact_if_unused(version: DataVersion):
+    """In the delta or chunked snapshot mode, store a version compactly once it's not used."""
+    if deltas.is_delta_mode() and deltas.can_compact(version):
+        deltas.compact_version(version)
+    elif chunks.is_chunk_mode() and chunks.can_store(version):
+        chunks.store_version(version)
 
 
 def db_shell(db_id):
@@ -21,16 +21,16 @@ def run(db: SqliteDatabase):
             create_at=datetime.strptime(db.create_at, '%Y-%m-%d %H:%M:%S'),
         )
         db_info.save()
+        data_versions = {}
         for version in db.version.get_self_and_all_children_objects():
-            data_version = DataVersion(
+            data_versions[version.volume] = DataVersion(
                 name=version.name,
                 volume=version.volume,
                 db=db_info,
+                parent=data_versions[version.parent.volume] if version.parent else None,
                 create_at=datetime.strptime(version.create_at, '%Y-%m-%d %H:%M:%S'),
             )
-            if version.parent:
-                data_version.parent = DataVersion.get(DataVersion.volume == version.parent.volume)
-            data_version.save()
-            if db.current_version == version.volume:
-                db_info.current_version = data_version
-                db_info.save()
+        DataVersion.insert_tree(list(data_versions.values()))
+        if db.current_version in data_versions:
+            db_info.current_version = data_versions[db.current_version]
+            db_info.save()
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/18 10:40
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+DEFAULT_CONFIGS = {
+    'SNAPSHOT_BACKEND': 'auto',
+}
+
+
+def run(db: SqliteDatabase):
+    for k, v in DEFAULT_CONFIGS.items():
+        if not models.Config.get_or_none(key=k):
+            models.Config(
+                key=k,
+                value=v,
+                create_at=datetime.now(),
+            ).save()
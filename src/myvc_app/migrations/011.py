@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/18 14:05
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from playhouse.migrate import SqliteMigrator, migrate
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    columns = {c.name for c in db.get_columns(models.DataVersion._meta.table_name)}
+    if 'snapshot_type' not in columns:
+        migrator = SqliteMigrator(db)
+        migrate(
+            migrator.add_column(
+                models.DataVersion._meta.table_name, 'snapshot_type', models.DataVersion.snapshot_type
+            )
+        )
+    db.create_tables([models.VersionFile])
+    if not models.Config.get_or_none(key='SNAPSHOT_MODE'):
+        models.Config(
+            key='SNAPSHOT_MODE',
+            value='full',
+            create_at=datetime.now(),
+        ).save()
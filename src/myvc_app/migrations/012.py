@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/18 21:40
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    # recompute the materialized paths, the tree queries now rely on them being exactly /<root id>/.../<id>/
+    parents = {
+        v.id: v.parent_id for v in models.DataVersion.select(models.DataVersion.id, models.DataVersion.parent)
+    }
+    paths = {}
+
+    def _get_path(version_id: int) -> str:
+        if version_id not in paths:
+            parent_id = parents[version_id]
+            paths[version_id] = '{}{}/'.format(_get_path(parent_id) if parent_id else '/', version_id)
+        return paths[version_id]
+
+    for version_id in parents:
+        _get_path(version_id)
+    for v in models.DataVersion.select(models.DataVersion.id, models.DataVersion.path):
+        if v.path != paths[v.id]:
+            models.DataVersion.update(path=paths[v.id]).where(models.DataVersion.id == v.id).execute()
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "dataversion_path" ON "dataversion" ("path")')
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/18 23:10
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    db.create_tables([models.ReadyTime])
+    if not models.Config.get_or_none(key='READY_TIMEOUT'):
+        models.Config(
+            key='READY_TIMEOUT',
+            value='180',
+            create_at=datetime.now(),
+        ).save()
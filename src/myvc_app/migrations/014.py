@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 09:50
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    db.create_tables([models.StandbyContainer])
+    for key, value in (('STANDBY_COUNT', '0'), ('STANDBY_MEMORY_BUDGET_MB', '0')):
+        if not models.Config.get_or_none(key=key):
+            models.Config(
+                key=key,
+                value=value,
+                create_at=datetime.now(),
+            ).save()
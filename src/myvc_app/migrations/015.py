@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 11:20
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    for key, value in (('PROXY_MODE', 'off'), ('PROXY_DRAIN_SECONDS', '10')):
+        if not models.Config.get_or_none(key=key):
+            models.Config(
+                key=key,
+                value=value,
+                create_at=datetime.now(),
+            ).save()
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 14:30
+from peewee import SqliteDatabase
+from playhouse.migrate import SqliteMigrator, migrate
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    table_name = models.VersionFile._meta.table_name
+    columns = {c.name for c in db.get_columns(table_name)}
+    migrator = SqliteMigrator(db)
+    migrate(*[
+        migrator.add_column(table_name, name, getattr(models.VersionFile, name))
+        for name in ('mode', 'uid', 'gid') if name not in columns
+    ])
+    db.create_tables([models.Chunk])
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 19:10
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from playhouse.migrate import SqliteMigrator, migrate
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    table_name = models.DBInfo._meta.table_name
+    if 'is_up' not in {c.name for c in db.get_columns(table_name)}:
+        migrate(SqliteMigrator(db).add_column(table_name, 'is_up', models.DBInfo.is_up))
+        # the dbs started before have a container
+        models.DBInfo.update(is_up=True).where(models.DBInfo.container_id.is_null(False)).execute()
+    if not models.Config.get_or_none(key='BULK_JOBS'):
+        models.Config(
+            key='BULK_JOBS',
+            value='4',
+            create_at=datetime.now(),
+        ).save()
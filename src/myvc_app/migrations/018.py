@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 19:50
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    db.create_tables([models.Tombstone])
+    if not models.Config.get_or_none(key='RECLAIM_JOBS'):
+        models.Config(
+            key='RECLAIM_JOBS',
+            value='8',
+            create_at=datetime.now(),
+        ).save()
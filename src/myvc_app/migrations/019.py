@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 20:40
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    if not models.Config.get_or_none(key='GC_MIN_AGE_SECONDS'):
+        models.Config(
+            key='GC_MIN_AGE_SECONDS',
+            value='3600',
+            create_at=datetime.now(),
+        ).save()
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 21:30
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    if not models.Config.get_or_none(key='MYSQL_IMAGE_DIR'):
+        models.Config(
+            key='MYSQL_IMAGE_DIR',
+            value='',
+            create_at=datetime.now(),
+        ).save()
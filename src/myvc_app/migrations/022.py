@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/20 10:30
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    db.create_tables([models.VolumeUsage])
+    if not models.Config.get_or_none(key='DU_JOBS'):
+        models.Config(
+            key='DU_JOBS',
+            value='8',
+            create_at=datetime.now(),
+        ).save()
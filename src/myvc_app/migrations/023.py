@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/20 16:20
+from datetime import datetime
+
+from peewee import SqliteDatabase
+from myvc_app.models import models
+
+
+def run(db: SqliteDatabase):
+    db.create_tables([models.DatadirTemplate])
+    if not models.Config.get_or_none(key='DATADIR_TEMPLATES'):
+        models.Config(
+            key='DATADIR_TEMPLATES',
+            value='2',
+            create_at=datetime.now(),
+        ).save()
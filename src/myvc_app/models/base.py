@@ -6,7 +6,8 @@ from playhouse.signals import Model
 from peewee import AutoField, TimestampField
 from myvc_app.config import DB_PATH
 
-DB = PooledSqliteDatabase(DB_PATH)
+# the pooled connections are handed from a thread to another, e.g. by the bulk operations and myvcd
+DB = PooledSqliteDatabase(DB_PATH, check_same_thread=False)
 
 
 class BaseModel(Model):
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 # -*- encoding: UTF-8 -*-
 # Created by CaoDa on 2022/4/9 10:42
-from typing import List
-from peewee import CharField, ForeignKeyField, DeferredForeignKey, IntegerField, TextField
+from typing import Dict, List, Optional, Set
+from peewee import (
+    CharField, ForeignKeyField, DeferredForeignKey, IntegerField, TextField, FloatField, BooleanField, fn, chunked
+)
 from myvc_app.models.base import BaseModel
+from myvc_app.utils import format_size
 
 
 class Migration(BaseModel):
@@ -14,44 +17,115 @@ class DataVersion(BaseModel):
     name = CharField()
     volume = CharField()
     parent = ForeignKeyField('self', null=True, backref='children')
-    path = CharField(null=True)
+    # materialized path of ids from the root, e.g. /1/3/7/
+    path = CharField(null=True, index=True)
     db = DeferredForeignKey('DBInfo', backref='versions')
+    # full: the volume holds the whole datadir
+    # delta: the volume only holds the blocks which differ from the parent, see myvc_app.deltas
+    snapshot_type = CharField(default='full')
+
+    @classmethod
+    def insert_tree(cls, versions: List["DataVersion"]) -> List["DataVersion"]:
+        """
+        Insert unsaved versions in one transaction, without the per-save path update.
+        The parent of each version must be saved or come before it in `versions`.
+        Ids are allocated after the current max id, so the paths are computed in memory.
+        """
+        with cls._meta.database.atomic('IMMEDIATE'):
+            next_id = (cls.select(fn.MAX(cls.id)).scalar() or 0) + 1
+            for v in versions:
+                v.id = next_id
+                next_id += 1
+                parent = v.parent
+                if parent:
+                    # sync parent_id, the parent may have got its id in this loop
+                    v.parent = parent
+                    v.path = '{}{}/'.format(parent.path, v.id)
+                else:
+                    v.path = '/{}/'.format(v.id)
+            for batch in chunked(versions, 100):
+                cls.insert_many([v.__data__ for v in batch]).execute()
+        for v in versions:
+            v._dirty.clear()
+        return versions
+
+    @classmethod
+    def subtree_condition(cls, path: str):
+        # every path starting with `path`, as a range so the index on path is used: '/1/' <= path < '/10'
+        return (cls.path >= path) & (cls.path < path[:-1] + chr(ord('/') + 1))
 
     @property
     def self_and_child_versions(self):
-        return DataVersion.select().where(DataVersion.path.contains(str(self.id)))
+        return DataVersion.select().where(DataVersion.subtree_condition(self.path))
 
     @property
     def child_versions(self):
-        return DataVersion.select().where(DataVersion.id != self.id, DataVersion.path.contains(str(self.id)))
+        return DataVersion.select().where(DataVersion.id != self.id, DataVersion.subtree_condition(self.path))
 
     @property
     def children_tree_objects(self) -> List["DataVersion"]:
+        """Self and all the children in depth-first order with a `depth` attribute, loaded by one query."""
+        children_by_parent = {}
+        for v in self.child_versions.order_by(DataVersion.id):
+            children_by_parent.setdefault(v.parent_id, []).append(v)
+
         objects = []
 
         def _get_children(current: DataVersion, depth: int):
             setattr(current, 'depth', depth)
             objects.append(current)
-            if current.children:
-                _ = depth + 1
-                for v in current.children:
-                    _get_children(v, _)
+            for v in children_by_parent.get(current.id, []):
+                v.parent = current
+                _get_children(v, depth + 1)
 
         _get_children(self, 0)
         return objects
 
     @property
     def children_tree(self) -> str:
+        return self.get_children_tree()
+
+    def get_children_tree(self, sizes: Dict[int, Optional[int]] = None, stale: Set[int] = None) -> str:
+        """
+        The tree of self and its children, with the size of every version if `sizes` (by version id) is given,
+        marked by * for the versions in `stale`.
+        """
         lines = []
         indent = '   '
         for v in self.children_tree_objects:
             version_info = f'{indent * v.depth}[{v.volume}({v.name})]'
+            if sizes is not None and sizes.get(v.id) is not None:
+                version_info = '{} {}{}'.format(version_info, format_size(sizes[v.id]), '*' if v.id in (stale or ()) else '')
             lines.append(
                 '{0}{1}'.format(version_info, str(v.create_at).rjust(80 - len(version_info), '┈'))
             )
         return '\n'.join(lines)
 
 
+class VersionFile(BaseModel):
+    version = ForeignKeyField(DataVersion, backref='files')
+    path = CharField()
+    is_dir = BooleanField(default=False)
+    size = IntegerField(default=0)
+    mtime = FloatField(default=0)
+    # comma separated sha1 of every fixed-size block of the file
+    block_hashes = TextField(default='')
+    # only recorded for the versions in the chunk store, see myvc_app.chunks
+    mode = IntegerField(null=True)
+    uid = IntegerField(null=True)
+    gid = IntegerField(null=True)
+
+    @property
+    def hashes(self) -> List[str]:
+        return self.block_hashes.split(',') if self.block_hashes else []
+
+
+class Chunk(BaseModel):
+    """A block of data in the shared chunk store, named by its sha1, see myvc_app.chunks."""
+    hash = CharField(unique=True)
+    size = IntegerField()
+
+
 class DBInfo(BaseModel):
     name = CharField()
     password = CharField()
@@ -59,12 +133,63 @@ class DBInfo(BaseModel):
     conf_volume = CharField()
     port = IntegerField()
     container_id = CharField(null=True)
+    # started and not stopped by the user since, `myvc up` starts these dbs again
+    is_up = BooleanField(default=False)
 
     @property
     def root_version(self) -> DataVersion:
         return DataVersion.get(parent=None, db=self)
 
 
+class ReadyTime(BaseModel):
+    """How long mysqld took to accept connections after its container started."""
+    db = ForeignKeyField(DBInfo, backref='ready_times')
+    version = ForeignKeyField(DataVersion, backref='ready_times')
+    operation = CharField()
+    seconds = FloatField()
+
+
+class Tombstone(BaseModel):
+    """A docker volume whose version or db is deleted, it's removed by the reclaimer, see myvc_app.reclaim."""
+    volume = CharField(unique=True)
+    attempts = IntegerField(default=0)
+    last_error = TextField(null=True)
+
+
+class VolumeUsage(BaseModel):
+    """The size of a volume by its last scan, see myvc_app.usage."""
+    volume = CharField(unique=True)
+    size = IntegerField()
+    # a running db or standby could write the volume during the scan, it's scanned again next time
+    in_use = BooleanField(default=False)
+
+
+class DatadirTemplate(BaseModel):
+    """An initialized empty datadir, the new dbs and the cleared versions are copied from it, see myvc_app.templates."""
+    # the hash of the image id, the mysql conf and the root password
+    key = CharField(unique=True)
+    volume = CharField()
+    image_id = CharField()
+    last_used_at = FloatField()
+
+
+class OperationTime(BaseModel):
+    """How long an operation of myvc_app.methods took, see myvc_app.tracing."""
+    operation = CharField(index=True)
+    seconds = FloatField()
+    failed = BooleanField(default=False)
+
+
+class StandbyContainer(BaseModel):
+    """A running container of a db in standby mode, the container of the current version included."""
+    db = ForeignKeyField(DBInfo, backref='standbys')
+    version = ForeignKeyField(DataVersion, backref='standbys')
+    container_id = CharField()
+    # the published port of 3306, the proxy of the db forwards to it
+    port = IntegerField()
+    last_used_at = FloatField()
+
+
 class Config(BaseModel):
     key = CharField()
     value = CharField()
@@ -10,16 +10,20 @@ import argparse
 from tempfile import NamedTemporaryFile
 from typing import Union
 
-import questionary
-import pymysql
-from pymysql.cursors import DictCursor
 from tabulate import tabulate
 
-from myvc_app import init  # This import is to complete some initialization operations
+from myvc_app import daemon
+from myvc_app import init
+from myvc_app import proxy
+from myvc_app import tracing
 from myvc_app.models.base import DB
-from myvc_app.models.models import DBInfo, DataVersion, Config, MySQLConf
-from myvc_app.utils import is_port_in_use
-import myvc_app.methods as myvc_methods
+from myvc_app.models.models import DBInfo, DataVersion, Config, MySQLConf, ReadyTime
+from myvc_app.utils import is_port_in_use, lazy_import, format_size
+
+# questionary, pymysql and docker (by methods) take most of the startup time, only load them when used
+questionary = lazy_import('questionary')
+# the operations are sent to myvcd if it's running
+myvc_methods = daemon.Methods()
 
 
 def not_empty_text_validator(text: str) -> bool:
@@ -85,6 +89,8 @@ def select_version(db_id: int):
 
 
 def select_mysql_database(db_id):
+    import pymysql
+    from pymysql.cursors import DictCursor
     db_info, container = myvc_methods.check_is_running(db_id)
 
     connection = pymysql.connect(
@@ -105,10 +111,11 @@ def select_mysql_database(db_id):
 
 
 def list_dbs():
+    statuses = myvc_methods.get_db_statuses()
     print(
         tabulate(
-            [[db.id, db.name, db.port, db.create_at, db.update_at] for db in DBInfo.select()],
-            headers=['ID', 'Name', 'Port', 'Create At', 'Update At']
+            [[db.id, db.name, db.port, statuses.get(db.id, ''), db.create_at, db.update_at] for db in DBInfo.select()],
+            headers=['ID', 'Name', 'Port', 'Status', 'Create At', 'Update At']
         )
     )
 
@@ -116,20 +123,40 @@ def list_dbs():
 def db_detail(db_id):
     db_info = DBInfo.get(id=db_id)  # type: DBInfo
     current_version = db_info.current_version  # type: DataVersion
+    last_ready_time = db_info.ready_times.order_by(ReadyTime.id.desc()).first()  # type: ReadyTime
+    # the sizes of the last `du`, scanning the volumes takes docker and long on large datadirs
+    sizes = myvc_methods.get_version_sizes(db_id, cached=True)
+    stale = {i for i in myvc_methods.get_in_use_version_ids(db_id) if sizes.get(i) is not None}
     print('\n')
     print(
         tabulate(
             [[
                 db_info.id, db_info.name, db_info.port, '{}({})'.format(current_version.volume, current_version.name),
+                '{:.1f}s'.format(last_ready_time.seconds) if last_ready_time else '',
+                format_size(sum(size or 0 for size in sizes.values())) + ('*' if stale else ''),
                 db_info.create_at, db_info.update_at
             ]],
-            ['ID', 'Name', 'Port', 'Current Version', 'Create At', 'Update At']
+            ['ID', 'Name', 'Port', 'Current Version', 'Last Ready In', 'Size (last du)', 'Create At', 'Update At']
         )
     )
+    if stale:
+        print('* measured while in use, may have changed since, run `myvc du` to scan again')
+    proxy_stats = proxy.get_stats(db_id)
+    if proxy_stats:
+        print('\n')
+        print(
+            tabulate(
+                [[
+                    proxy_stats['target'], proxy_stats['active'], proxy_stats['draining'], proxy_stats['held'],
+                    proxy_stats['total'], format_size(proxy_stats['bytes_in']), format_size(proxy_stats['bytes_out'])
+                ]],
+                ['Proxy Target', 'Connections', 'Draining', 'Waiting', 'Total Connections', 'Bytes In', 'Bytes Out']
+            )
+        )
     print('\n')
     print(
         tabulate(
-            [[str(db_info.root_version.children_tree)]],
+            [[str(db_info.root_version.get_children_tree(sizes, stale))]],
             headers=['Versions']
         )
     )
@@ -196,6 +223,108 @@ def edit_mysql_conf():
     os.remove(temp_cnf_file.name)
 
 
+def input_jobs(title: str = 'Parallel sessions (0 for all cpus)', default: str = '0') -> int:
+    jobs = questionary.text(
+        title, default=default, validate=lambda text: text.isdigit() or 'Please enter a number'
+    ).ask()
+    if jobs is None:
+        exit(0)
+    return int(jobs)
+
+
+def print_ready_time(db_id: int, seconds: float):
+    print('{} is ready in {:.1f}s'.format(DBInfo.get(id=db_id).name, seconds))
+
+
+def print_bulk_results(results: list):
+    print(
+        tabulate(
+            [[
+                r['db_id'], r['name'], r['error'] or 'ok', '{:.1f}s'.format(r['seconds']),
+                '{:.1f}s'.format(r['ready_seconds']) if r['ready_seconds'] is not None else ''
+            ] for r in results],
+            headers=['ID', 'Name', 'Result', 'Took', 'Ready In']
+        )
+    )
+    if any(r['error'] for r in results):
+        exit(1)
+
+
+def print_orphans(rows: list, dry_run: bool):
+    print(
+        tabulate(
+            [[
+                r['type'], r['name'], r['kind'], datetime.datetime.fromtimestamp(r['created_at']),
+                format_size(r['size']) if r['size'] is not None else '', r['error'] or ''
+            ] for r in rows],
+            headers=['Type', 'Name', 'Kind', 'Create At', 'Size', 'Error']
+        )
+    )
+    size = sum(r['size'] or 0 for r in rows if not r['error'])
+    print('\n{} {} orphans, {}'.format(
+        'found' if dry_run else 'removed', sum(1 for r in rows if not r['error']), format_size(size)
+    ))
+
+
+def print_diff(results: list, from_name: str, to_name: str):
+    changed = [r for r in results if r['change']]
+    print(
+        tabulate(
+            [[
+                '{}.{}'.format(r['database'], r['table']), r['change'],
+                '{} -> {}'.format(*r['rows']) if r['rows'] else '',
+                sum(x['removed'] for x in r['ranges']), sum(x['added'] for x in r['ranges']),
+                sum(x['changed'] for x in r['ranges']),
+            ] for r in changed],
+            headers=['Table', 'Change', 'Rows', 'Removed Rows', 'Added Rows', 'Changed Rows']
+        )
+    )
+    for r in changed:
+        if r['ranges']:
+            print('\n{}.{}'.format(r['database'], r['table']))
+            print(
+                tabulate(
+                    [[
+                        ', '.join(str(k) for k in x['first']), ', '.join(str(k) for k in x['last']),
+                        x['removed'], x['added'], x['changed']
+                    ] for x in r['ranges']],
+                    headers=['From Key', 'To Key', 'Removed', 'Added', 'Changed']
+                )
+            )
+    print('\n{} of {} tables differ between {} and {}'.format(len(changed), len(results), from_name, to_name))
+
+
+def print_disk_usage(full: bool):
+    rows = myvc_methods.get_branch_usage(full)
+    print(
+        tabulate(
+            [[
+                r['db_id'], r['db_name'], '{}({})'.format(r['volume'], r['name']),
+                format_size(r['size']) if r['size'] is not None else '',
+                format_size(r['reclaimable']), r['versions']
+            ] for r in rows if r['removable']],
+            headers=['DB ID', 'DB Name', 'Branch', 'Size', 'Reclaimable', 'Versions']
+        )
+    )
+    print('\n{} versions, {} in total'.format(len(rows), format_size(sum(r['size'] or 0 for r in rows))))
+
+
+def print_stats():
+    print(
+        tabulate(
+            [[
+                s['operation'], s['count'], s['failed'],
+                '{:.2f}s'.format(s['p50']), '{:.2f}s'.format(s['p95']), '{:.2f}s'.format(s['max'])
+            ] for s in tracing.get_stats()],
+            headers=['Operation', 'Count', 'Failed', 'P50', 'P95', 'Max']
+        )
+    )
+    if tracing.is_enabled():
+        print('\nthe steps of the operations are traced to {}, open it in chrome://tracing or ui.perfetto.dev'.format(
+            tracing.TRACE_PATH
+        ))
+
+
 def select_commands(command_from_cmd_line=None):
     commands = OrderedDict({
         'ls': "show all existed db",
@@ -204,14 +333,29 @@ def select_commands(command_from_cmd_line=None):
         'start db': "start a db",
         'stop db': "stop a db",
         'rm db': "delete a db's all data",
+        'start all': "start all dbs in parallel",
+        'stop all': "stop all dbs in parallel, `up` starts the running ones again",
+        'up': "start the dbs which were running before `stop all` or a reboot",
         'new branch': "create a db's data branch",
+        'new branches': "create several branches from the same branch",
+        'new logical branch': "dump the running db into a branch of sql files, table by table in parallel",
         'use branch': "apply a branch",
         'copy branch': "copy a branch's data to current branch",
         'clear branch': "clear current branch's data",
         'rm branch': "delete a branch and it's children",
+        'diff branch': "compare the tables of two branches by checksums, in parallel sessions",
+        'compact branch': "store a branch as the changes from its parent",
+        'reclaim volumes': "remove the volumes of the deleted dbs and branches now, retrying the failed ones",
+        'restore tables': "restore all or some tables of a logical branch into the running db",
+        'export branch': "save a branch's data to a .tar.zst or .tar.gz archive",
+        'import branch': "create a branch from an exported archive",
         'run sql': "execute a sql file",
         'reset db conf': "replace mysql conf by .cny files in config directory",
+        'load images': "load mysql images from tarballs saved by `docker save`",
         'db shell': "get mysql shell",
+        'du': "show the disk usage of the branches, the largest reclaimable first, --full scans every volume again",
+        'stats': "show the latency of the operations",
+        'gc': "remove the containers and volumes leaked by failed operations, --dry-run only lists them",
         'edit config': "edit myvc configs",
         'edit mysql conf': "edit mysql conf",
     })
@@ -233,8 +377,11 @@ def select_commands(command_from_cmd_line=None):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('command', nargs='*')
+    parser.add_argument('--dry-run', action='store_true', help="only list what `gc` would remove")
+    parser.add_argument('--full', action='store_true', help="`du` scans every volume instead of the changed ones")
     args = parser.parse_args()
     command = select_commands(' '.join(args.command).strip())
+    init.setup()
     if command == 'ls':
         list_dbs()
     elif command == 'show db':
@@ -242,13 +389,25 @@ def main():
         db_detail(db_id)
     elif command == 'start db':
         db_id = select_db()
-        myvc_methods.start_db(db_id)
+        print_ready_time(db_id, myvc_methods.start_db(db_id))
     elif command == 'stop db':
         db_id = select_db()
         myvc_methods.stop_db(db_id)
     elif command == 'rm db':
         db_id = select_db()
         myvc_methods.rm_db(db_id)
+    elif command == 'start all':
+        print_bulk_results(myvc_methods.run_on_dbs(myvc_methods.start_db, [db.id for db in DBInfo.select()]))
+    elif command == 'stop all':
+        print_bulk_results(myvc_methods.run_on_dbs(
+            lambda db_id: myvc_methods.stop_db(db_id, keep_up=True), [db.id for db in DBInfo.select()]
+        ))
+    elif command == 'up':
+        db_ids = myvc_methods.get_up_db_ids()
+        if not db_ids:
+            print('no db to start')
+        else:
+            print_bulk_results(myvc_methods.run_on_dbs(myvc_methods.start_db, db_ids))
     elif command == 'new db':
         answers = questionary.form(
             name=questionary.text(
@@ -272,11 +431,22 @@ def main():
         ).ask()
         new_version = myvc_methods.backup_version(db_id, name, version)
         if auto_switch_to_new_branch:
-            myvc_methods.apply_version(db_id, new_version.id)
+            print_ready_time(db_id, myvc_methods.apply_version(db_id, new_version.id))
+    elif command == 'new branches':
+        db_id = select_db()
+        names = input_text("Branches' names (separated by commas)")
+        names = [name.strip() for name in names.split(',') if name.strip()]
+        version = select_version(db_id)
+        myvc_methods.backup_versions(db_id, names, version)
+    elif command == 'new logical branch':
+        db_id = select_db(require_db_is_running=True)
+        name = input_text("Branch's name")
+        jobs = input_jobs()
+        myvc_methods.backup_logical_version(db_id, name, jobs)
     elif command == 'use branch':
         db_id = select_db()
         version = select_version(db_id)
-        myvc_methods.apply_version(db_id, version)
+        print_ready_time(db_id, myvc_methods.apply_version(db_id, version))
     elif command == 'copy branch':
         db_id = select_db()
         version = select_version(db_id)
@@ -289,6 +459,50 @@ def main():
         db_id = select_db()
         version = select_version(db_id)
         myvc_methods.rm_version(db_id, version)
+    elif command == 'diff branch':
+        db_id = select_db()
+        print('Select the branch to compare from')
+        from_version = select_version(db_id)
+        print('Select the branch to compare to')
+        to_version = select_version(db_id)
+        jobs = input_jobs()
+        print_diff(
+            myvc_methods.diff_versions(db_id, from_version, to_version, jobs),
+            DataVersion.get(id=from_version).name, DataVersion.get(id=to_version).name
+        )
+    elif command == 'compact branch':
+        db_id = select_db()
+        version = select_version(db_id)
+        myvc_methods.compact_version(db_id, version)
+    elif command == 'reclaim volumes':
+        myvc_methods.reclaim_volumes()
+    elif command == 'restore tables':
+        db_id = select_db(require_db_is_running=True)
+        version = select_version(db_id)
+        tables = questionary.text('Tables as database.table separated by commas (Optional, all by default)').ask()
+        if tables is None:
+            exit(0)
+        tables = [t.strip() for t in tables.split(',') if t.strip()]
+        jobs = input_jobs()
+        myvc_methods.restore_logical_version(db_id, version, tables, jobs)
+    elif command == 'export branch':
+        db_id = select_db()
+        version = select_version(db_id)
+        archive_path = questionary.path("Archive path (.tar.zst or .tar.gz)").ask()
+        if not archive_path:
+            exit(0)
+        myvc_methods.export_version(db_id, version, archive_path)
+    elif command == 'import branch':
+        db_id = select_db()
+        archive_path = questionary.path("Archive path").ask()
+        if not archive_path:
+            exit(0)
+        name = questionary.text("Branch's name (Optional, the exported branch's name by default)").ask()
+        if name is None:
+            exit(0)
+        print('Select the parent branch of the imported branch')
+        version = select_version(db_id)
+        myvc_methods.import_version(db_id, archive_path, version, name)
     elif command == 'run sql':
         db_id = select_db(require_db_is_running=True)
         sql_path = questionary.path("SQL file path").ask()
@@ -297,16 +511,32 @@ def main():
         db_name = select_mysql_database(db_id)
         if db_name is None:
             exit(0)
-        myvc_methods.apply_sql(db_id, sql_path, db_name)
+        jobs = input_jobs('Parallel sessions (1 to run the file in one session, 0 for all cpus)', default='1')
+        if jobs == 1:
+            myvc_methods.apply_sql(db_id, sql_path, db_name)
+        else:
+            myvc_methods.apply_sql_parallel(db_id, sql_path, db_name, jobs)
     elif command == 'reset db conf':
         db_id = select_db()
         db_info = DBInfo.get(id=db_id)
         myvc_methods.stop_db(db_id)
         myvc_methods.init_mysql_conf_volume(myvc_methods.get_volume_by_name(db_info.conf_volume))
         myvc_methods.start_db(db_id)
+    elif command == 'load images':
+        path = questionary.path("Image tarball or directory of tarballs").ask()
+        if not path:
+            exit(0)
+        for tag in myvc_methods.load_images([path]):
+            print('loaded {}'.format(tag))
     elif command == 'db shell':
         db_id = select_db(require_db_is_running=True)
         myvc_methods.db_shell(db_id)
+    elif command == 'du':
+        print_disk_usage(args.full)
+    elif command == 'stats':
+        print_stats()
+    elif command == 'gc':
+        print_orphans(myvc_methods.collect_orphans(args.dry_run), args.dry_run)
     elif command == 'edit config':
         edit_config()
     elif command == 'edit mysql conf':
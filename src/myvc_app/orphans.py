@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 20:30
+"""
+Garbage collection of the containers and volumes leaked by failed or killed operations.
+
+Every container and volume created by myvc carries the `myvc` label, `gc` compares the labeled ones
+with the metadata db in one pass: a container is an orphan if no db or standby uses it,
+a volume if no version, db conf, datadir template or tombstone refers to it.
+The ones created less than GC_MIN_AGE_SECONDS ago are kept, they may belong to a running operation.
+The shared helper containers are not collected, they exit by themselves when idle.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from docker.errors import APIError, NotFound
+from docker.models.containers import Container
+from docker.models.volumes import Volume
+
+import myvc_app.methods as myvc_methods
+from myvc_app.models.models import DatadirTemplate, DataVersion, DBInfo, StandbyContainer, Tombstone
+from myvc_app.utils import parse_docker_time
+
+
+def get_min_age() -> float:
+    return float(myvc_methods.get_config_value('GC_MIN_AGE_SECONDS', '3600'))
+
+
+def find_orphans(min_age: float = None) -> Tuple[List[Container], List[Volume]]:
+    min_age = get_min_age() if min_age is None else min_age
+    created_before = time.time() - min_age
+    client = myvc_methods.get_client()
+    used_containers = {db_info.container_id for db_info in DBInfo.select(DBInfo.container_id)}
+    used_containers.update(s.container_id for s in StandbyContainer.select(StandbyContainer.container_id))
+    used_volumes = {v.volume for v in DataVersion.select(DataVersion.volume)}
+    used_volumes.update(db_info.conf_volume for db_info in DBInfo.select(DBInfo.conf_volume))
+    used_volumes.update(t.volume for t in Tombstone.select(Tombstone.volume))
+    used_volumes.update(t.volume for t in DatadirTemplate.select(DatadirTemplate.volume))
+    containers = [
+        c for c in client.containers.list(all=True, filters={'label': myvc_methods.LABEL})
+        if c.labels.get(myvc_methods.LABEL) != 'helper' and c.id not in used_containers
+        and parse_docker_time(c.attrs['Created']) < created_before
+    ]
+    volumes = [
+        v for v in client.volumes.list(filters={'label': myvc_methods.LABEL})
+        if v.name not in used_volumes and parse_docker_time(v.attrs['CreatedAt']) < created_before
+    ]
+    return containers, volumes
+
+
+def get_volume_sizes() -> Dict[str, int]:
+    """The disk usage of every volume by one `docker system df`, empty if the daemon can't tell."""
+    try:
+        df = myvc_methods.get_client().df()
+    except APIError:
+        return {}
+    return {v['Name']: v.get('UsageData', {}).get('Size', -1) for v in df.get('Volumes') or []}
+
+
+def collect(dry_run: bool = False, min_age: float = None, jobs: int = None) -> List[dict]:
+    """
+    Remove the orphans in parallel, or only find them when `dry_run`, return a row per orphan:
+        {'type': 'volume', 'name': '...', 'kind': 'volume', 'created_at': 1792404000.0, 'size': 1024, 'error': None}
+    `size` is None when unknown, `error` is set if it couldn't be removed.
+    """
+    jobs = jobs or int(myvc_methods.get_config_value('RECLAIM_JOBS', '8'))
+    containers, volumes = find_orphans(min_age)
+    sizes = get_volume_sizes() if volumes else {}
+    rows = [{
+        'type': 'container', 'name': c.name, 'kind': c.labels.get(myvc_methods.LABEL),
+        'created_at': parse_docker_time(c.attrs['Created']), 'size': None, 'error': None,
+    } for c in containers] + [{
+        'type': 'volume', 'name': v.name, 'kind': (v.attrs.get('Labels') or {}).get(myvc_methods.LABEL),
+        'created_at': parse_docker_time(v.attrs['CreatedAt']),
+        'size': sizes[v.name] if sizes.get(v.name, -1) >= 0 else None, 'error': None,
+    } for v in volumes]
+    if dry_run:
+        return rows
+
+    def _remove(item: Tuple[dict, object]):
+        row, resource = item
+        try:
+            resource.remove(force=True)
+        except NotFound:
+            pass
+        except APIError as e:
+            row['error'] = str(e)
+
+    # the containers go first, they may hold the orphan volumes
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(_remove, zip(rows, containers)))
+        list(executor.map(_remove, zip(rows[len(containers):], volumes)))
+    return rows
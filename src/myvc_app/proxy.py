@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 09:30
+"""
+TCP front of a db.
+
+A proxy process listens on the db's port and forwards every new connection to the target written by `set_target`,
+so the container serving the db can change without the port going away.
+
+`pause` makes the new connections wait in the proxy until the next target is set, for at most `hold_seconds`,
+the clients see a slow connect instead of a refused one while the container restarts.
+When the target changes or is paused, the connections to the former target are handed over:
+each one is closed as soon as it is idle (the server answered and nothing was sent since),
+and at the latest after `drain_seconds`. A connection pool then reconnects to the new target.
+
+The proxy writes its counters to <db id>.stats, see `get_stats`.
+"""
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Optional, Tuple
+
+from myvc_app import config
+from myvc_app.utils import is_port_in_use
+
+PROXY_DIR = config.APP_DATA_DIR.joinpath('proxy')
+BUFFER_SIZE = 64 * 1024
+PAUSED = 'paused'
+# how often the target file is checked and the stats file is written
+WATCH_INTERVAL = 0.1
+# a connection is idle when the server sent the last packet and nothing moved since
+IDLE_SECONDS = 0.05
+
+
+def get_target_path(db_id: int):
+    return PROXY_DIR.joinpath('{}.target'.format(db_id))
+
+
+def get_pid_path(db_id: int):
+    return PROXY_DIR.joinpath('{}.pid'.format(db_id))
+
+
+def get_stats_path(db_id: int):
+    return PROXY_DIR.joinpath('{}.stats'.format(db_id))
+
+
+def write_file(path, content: str):
+    os.makedirs(PROXY_DIR, exist_ok=True)
+    temp_path = path.with_suffix('.tmp')
+    with open(temp_path, 'w') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def set_target(db_id: int, host: str, port: int):
+    write_file(get_target_path(db_id), '{}:{}'.format(host, port))
+
+
+def pause(db_id: int):
+    write_file(get_target_path(db_id), PAUSED)
+
+
+def read_target(db_id: int) -> Optional[Tuple[str, int]]:
+    """None when there is no target or the proxy is paused."""
+    try:
+        with open(get_target_path(db_id)) as f:
+            host, port = f.read().rsplit(':', 1)
+    except (OSError, ValueError):
+        return None
+    return host, int(port)
+
+
+def get_stats(db_id: int) -> dict:
+    """
+    The counters of the running proxy of a db, empty if there is none:
+        target: host:port or paused
+        active: connections being forwarded, draining: those of them to a former target
+        held: connections waiting for a target
+        total: connections accepted, bytes_in / bytes_out: bytes from / to the clients
+    """
+    if not is_running(db_id):
+        return {}
+    try:
+        with open(get_stats_path(db_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_pid(db_id: int) -> Optional[int]:
+    try:
+        with open(get_pid_path(db_id)) as f:
+            pid = int(f.read())
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return None
+    return pid
+
+
+def is_running(db_id: int) -> bool:
+    return get_pid(db_id) is not None
+
+
+def start(db_id: int, port: int, hold_seconds: float = 180, drain_seconds: float = 10, wait_seconds: float = 5):
+    if is_running(db_id):
+        return
+    os.makedirs(PROXY_DIR, exist_ok=True)
+    with open(PROXY_DIR.joinpath('{}.log'.format(db_id)), 'ab') as log:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'myvc_app.proxy', str(db_id), str(port), str(hold_seconds), str(drain_seconds)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True,
+        )
+    with open(get_pid_path(db_id), 'w') as f:
+        f.write(str(process.pid))
+    start_at = time.time()
+    while time.time() - start_at < wait_seconds:
+        if process.poll() is not None:
+            raise Exception('proxy of db {} exited with code {}, see {}'.format(
+                db_id, process.returncode, PROXY_DIR.joinpath('{}.log'.format(db_id))
+            ))
+        if is_port_in_use(port):
+            return
+        time.sleep(0.05)
+    raise Exception("proxy of db {} doesn't listen on {} in {} seconds".format(db_id, port, wait_seconds))
+
+
+def drain(db_id: int, timeout: float) -> bool:
+    """Pause the proxy and wait until no connection is forwarded, return False if some are left after `timeout`."""
+    if not is_running(db_id):
+        return True
+    pause(db_id)
+    start_at = time.time()
+    while True:
+        stats = get_stats(db_id)
+        if not stats or (stats['target'] == PAUSED and stats['active'] == 0):
+            return True
+        if time.time() - start_at > timeout:
+            return False
+        time.sleep(WATCH_INTERVAL)
+
+
+def stop(db_id: int):
+    pid = get_pid(db_id)
+    if pid:
+        os.kill(pid, signal.SIGTERM)
+        for _ in range(100):
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                break
+            time.sleep(0.05)
+    for path in (get_pid_path(db_id), get_target_path(db_id), get_stats_path(db_id)):
+        if path.exists():
+            os.remove(path)
+
+
+class Connection:
+
+    def __init__(self, target: Tuple[str, int], client_writer: asyncio.StreamWriter,
+                 server_writer: asyncio.StreamWriter):
+        self.target = target
+        self.client_writer = client_writer
+        self.server_writer = server_writer
+        self.last_active_at = time.time()
+        self.server_sent_last = True
+
+    def is_idle(self) -> bool:
+        return self.server_sent_last and time.time() - self.last_active_at > IDLE_SECONDS
+
+    def close(self):
+        self.client_writer.close()
+        self.server_writer.close()
+
+
+class Proxy:
+
+    def __init__(self, db_id: int, hold_seconds: float, drain_seconds: float):
+        self.db_id = db_id
+        self.hold_seconds = hold_seconds
+        self.drain_seconds = drain_seconds
+        self.target = read_target(db_id)
+        self.target_changed_at = time.time()
+        self.target_changed = asyncio.Event()
+        self.connections = set()
+        self.held = 0
+        self.total = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def read_target(self):
+        target = read_target(self.db_id)
+        if target != self.target:
+            self.target = target
+            self.target_changed_at = time.time()
+            self.target_changed.set()
+            self.target_changed = asyncio.Event()
+
+    async def wait_target(self) -> Optional[Tuple[str, int]]:
+        start_at = time.time()
+        while not self.target:
+            timeout = self.hold_seconds - (time.time() - start_at)
+            if timeout <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self.target_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.target
+
+    async def pipe(self, connection: Connection, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                   from_server: bool):
+        try:
+            while True:
+                data = await reader.read(BUFFER_SIZE)
+                if not data:
+                    break
+                connection.last_active_at = time.time()
+                connection.server_sent_last = from_server
+                if from_server:
+                    self.bytes_out += len(data)
+                else:
+                    self.bytes_in += len(data)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        self.total += 1
+        self.held += 1
+        try:
+            target = await self.wait_target()
+        finally:
+            self.held -= 1
+        try:
+            if not target:
+                raise ConnectionError('no target')
+            server_reader, server_writer = await asyncio.open_connection(*target)
+        except (OSError, ConnectionError):
+            client_writer.close()
+            return
+        connection = Connection(target, client_writer, server_writer)
+        self.connections.add(connection)
+        try:
+            await asyncio.gather(
+                self.pipe(connection, client_reader, server_writer, False),
+                self.pipe(connection, server_reader, client_writer, True),
+            )
+        finally:
+            self.connections.discard(connection)
+
+    def hand_over(self):
+        """Close the connections to a former target once they are idle, or when draining takes too long."""
+        is_overdue = time.time() - self.target_changed_at > self.drain_seconds
+        for connection in list(self.connections):
+            if connection.target != self.target and (is_overdue or connection.is_idle()):
+                connection.close()
+                self.connections.discard(connection)
+
+    def get_stats(self) -> dict:
+        return {
+            'target': '{}:{}'.format(*self.target) if self.target else PAUSED,
+            'active': len(self.connections),
+            'draining': sum(1 for c in self.connections if c.target != self.target),
+            'held': self.held,
+            'total': self.total,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
+
+    async def watch(self):
+        last_stats = None
+        while True:
+            self.read_target()
+            self.hand_over()
+            stats = self.get_stats()
+            if stats != last_stats:
+                write_file(get_stats_path(self.db_id), json.dumps(stats))
+                last_stats = stats
+            await asyncio.sleep(WATCH_INTERVAL)
+
+
+async def _serve(db_id: int, port: int, hold_seconds: float, drain_seconds: float):
+    proxy = Proxy(db_id, hold_seconds, drain_seconds)
+    server = await asyncio.start_server(proxy.handle, port=port)
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    loop.add_signal_handler(signal.SIGTERM, stopped.set_result, None)
+    watcher = loop.create_task(proxy.watch())
+    async with server:
+        await stopped
+    watcher.cancel()
+
+
+def serve(db_id: int, port: int, hold_seconds: float = 180, drain_seconds: float = 10):
+    asyncio.run(_serve(db_id, port, hold_seconds, drain_seconds))
+
+
+if __name__ == '__main__':
+    serve(int(sys.argv[1]), int(sys.argv[2]), *map(float, sys.argv[3:5]))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 19:40
+"""
+Deferred removal of docker volumes.
+
+Deleting dbs and branches only drops their rows and records their volumes as tombstones in one transaction,
+the volumes are removed afterwards by a reclaimer process (`python -m myvc_app.reclaim`) started in the background.
+The reclaimer removes the volumes in parallel, retries the ones which fail (e.g. still used by a stopping container)
+and writes its progress to APP_DATA_DIR/reclaim.log. Only one reclaimer runs at a time, a new one waits for it.
+"""
+import fcntl
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple
+
+from docker.errors import APIError, NotFound
+
+import myvc_app.methods as myvc_methods
+from myvc_app import config
+from myvc_app import helpers
+from myvc_app.models.base import DB
+from myvc_app.models.models import Tombstone
+
+LOCK_PATH = config.APP_DATA_DIR.joinpath('reclaim.lock')
+LOG_PATH = config.APP_DATA_DIR.joinpath('reclaim.log')
+MAX_ATTEMPTS = 5
+
+
+def tombstone(volume_names: Iterable[str]):
+    """Record volumes to be removed by the reclaimer, call it in the transaction which drops their rows."""
+    rows = [{'volume': name, 'create_at': time.time()} for name in volume_names if name]
+    if rows:
+        Tombstone.insert_many(rows).on_conflict_ignore().execute()
+        # the helpers of this process would keep them mounted, the reclaimer can't remove a mounted volume
+        helpers.release(r['volume'] for r in rows)
+
+
+def get_pending_count() -> int:
+    return Tombstone.select().where(Tombstone.attempts < MAX_ATTEMPTS).count()
+
+
+def remove_volume(name: str):
+    try:
+        myvc_methods.remove_volume(myvc_methods.get_client().volumes.get(name), force=True)
+    except NotFound:
+        pass
+
+
+def reclaim(jobs: int = None) -> Tuple[int, int]:
+    """Remove the tombstoned volumes until none is left or all the left ones failed, return (removed, failed)."""
+    jobs = jobs or int(myvc_methods.get_config_value('RECLAIM_JOBS', '8'))
+    removed = 0
+    # the log of the background reclaimer gets a line per update
+    end = '' if sys.stdout.isatty() else '\n'
+    printed_at = 0
+
+    def _remove(t: Tombstone) -> bool:
+        try:
+            remove_volume(t.volume)
+            t.delete_instance()
+            return True
+        except APIError as e:
+            t.attempts += 1
+            t.last_error = str(e)
+            t.update_at = time.time()
+            t.save()
+            return False
+        finally:
+            # give the connection of this thread back to the pool
+            DB.close()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        delay = 1
+        while True:
+            pending = list(Tombstone.select().where(Tombstone.attempts < MAX_ATTEMPTS))
+            if not pending:
+                break
+            succeeded = 0
+            for ok in executor.map(_remove, pending):
+                succeeded += ok
+                removed += ok
+                if time.time() - printed_at >= 1:
+                    printed_at = time.time()
+                    print('\rreclaimed {} volumes, {} left'.format(removed, len(pending) - succeeded), end=end, flush=True)
+            if succeeded < len(pending):
+                # volumes in use are often freed by a container which is still stopping
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+    failed = Tombstone.select().where(Tombstone.attempts >= MAX_ATTEMPTS).count()
+    print('\rreclaimed {} volumes, {} failed'.format(removed, failed), flush=True)
+    return removed, failed
+
+
+def retry_failed():
+    """Give the volumes which failed too many times another round."""
+    Tombstone.update(attempts=0).where(Tombstone.attempts >= MAX_ATTEMPTS).execute()
+
+
+def run_locked(jobs: int = None) -> Tuple[int, int]:
+    """`reclaim` after the running reclaimer, if any, is finished."""
+    os.makedirs(LOCK_PATH.parent, exist_ok=True)
+    with open(LOCK_PATH, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return reclaim(jobs)
+
+
+def start_background():
+    """Start a reclaimer, it waits for the running one so the volumes tombstoned just now are always handled."""
+    os.makedirs(LOG_PATH.parent, exist_ok=True)
+    with open(LOG_PATH, 'ab') as log:
+        subprocess.Popen(
+            [sys.executable, '-m', 'myvc_app.reclaim'],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True,
+        )
+
+
+if __name__ == '__main__':
+    print(time.strftime('%Y-%m-%d %H:%M:%S'), 'reclaiming', flush=True)
+    run_locked()
@@ -16,8 +16,19 @@ def set_update_at(model_class, instance, created):
 
 @post_save(sender=DataVersion)
 def update_path(model_class, instance, created):
-    if instance.parent:
-        path = f'{instance.parent.path}{instance.id}/'
+    if not created and instance.path:
+        # the path is still right if the parent didn't change
+        ids = instance.path.strip('/').split('/')
+        if ids[-1] == str(instance.id) and ids[-2:-1] == ([str(instance.parent_id)] if instance.parent_id else []):
+            return
+    if instance.parent_id:
+        parent = instance.__rel__.get('parent')
+        parent_path = parent.path if parent and parent.path else model_class.select(
+            model_class.path
+        ).where(model_class.id == instance.parent_id).scalar()
+        path = f'{parent_path}{instance.id}/'
     else:
         path = f'/{instance.id}/'
     model_class.update(path=path).where(model_class.id == instance.id).execute()
+    instance.path = path
+    instance._dirty.discard('path')
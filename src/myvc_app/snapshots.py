@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/18 10:12
+import abc
+from typing import Dict, Type
+
+
+class SnapshotBackend(abc.ABC):
+    """
+    A snapshot backend builds the shell command that fills the volume mounted at `to_dir`
+    with the content of the volume mounted at `from_dir`.
+    The command is executed by `methods.copy_volume` inside a helper container.
+    """
+    name = None  # type: str
+
+    @abc.abstractmethod
+    def copy_command(self, from_dir: str, to_dir: str) -> str:
+        pass
+
+
+class CopyBackend(SnapshotBackend):
+    """Full copy, works everywhere but costs time and disk proportional to the datadir."""
+    name = 'copy'
+
+    def copy_command(self, from_dir: str, to_dir: str) -> str:
+        return 'rm -rf {1}/* && cp -a {0}/. {1}/'.format(from_dir, to_dir)
+
+
+class ReflinkBackend(SnapshotBackend):
+    """
+    Copy-on-write clone (FICLONE) of every file, supported by btrfs, xfs (reflink=1), bcachefs and zfs 2.2+.
+    Only metadata is written, the data blocks are shared until mysqld modifies them.
+    Both volumes must live on the same filesystem, otherwise cp fails.
+    """
+    name = 'reflink'
+
+    def copy_command(self, from_dir: str, to_dir: str) -> str:
+        return 'rm -rf {1}/* && cp -a --reflink=always {0}/. {1}/'.format(from_dir, to_dir)
+
+
+class AutoBackend(SnapshotBackend):
+    """Try the copy-on-write clone first and fall back to the full copy."""
+    name = 'auto'
+
+    def copy_command(self, from_dir: str, to_dir: str) -> str:
+        return '({}) 2>/dev/null || ({})'.format(
+            ReflinkBackend().copy_command(from_dir, to_dir),
+            CopyBackend().copy_command(from_dir, to_dir),
+        )
+
+
+BACKENDS = {
+    backend.name: backend for backend in (CopyBackend, ReflinkBackend, AutoBackend)
+}  # type: Dict[str, Type[SnapshotBackend]]
+
+
+def register_backend(backend: Type[SnapshotBackend]):
+    BACKENDS[backend.name] = backend
+    return backend
+
+
+def get_backend(name: str = None) -> SnapshotBackend:
+    name = name or AutoBackend.name
+    if name not in BACKENDS:
+        raise Exception('unknown snapshot backend: {}, available backends: {}'.format(
+            name, ', '.join(BACKENDS.keys())
+        ))
+    return BACKENDS[name]()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/18 16:30
+import gzip
+import re
+import shutil
+import subprocess
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+GZIP = 'gzip'
+ZSTD = 'zstd'
+MAGIC_BYTES = {GZIP: b'\x1f\x8b', ZSTD: b'\x28\xb5\x2f\xfd'}
+
+
+def get_compression(path: str) -> Optional[str]:
+    """GZIP, ZSTD or None by the magic bytes at the start of the file, whatever its suffix."""
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    for compression, magic in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+class ZstdReader:
+    """Decompress a .zst file by the zstandard package if installed, otherwise by the zstd command."""
+
+    def __init__(self, path: str):
+        self._raw = open(path, 'rb')
+        self._process = None
+        try:
+            import zstandard
+            self._reader = zstandard.ZstdDecompressor().stream_reader(self._raw)
+        except ImportError:
+            if not shutil.which('zstd'):
+                self._raw.close()
+                raise Exception('reading .zst files requires the zstandard package or the zstd command')
+            self._process = subprocess.Popen(['zstd', '-dcq'], stdin=self._raw, stdout=subprocess.PIPE)
+            self._reader = self._process.stdout
+
+    def read(self, size: int = -1) -> bytes:
+        return self._reader.read(size)
+
+    def tell_raw(self) -> int:
+        return self._raw.tell()
+
+    def close(self):
+        self._reader.close()
+        if self._process:
+            self._process.wait()
+            if self._process.returncode:
+                raise Exception('zstd exit with code {}'.format(self._process.returncode))
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SQLFile:
+    """Read a plain, gzip or zstd compressed sql file chunk by chunk, the compression is detected by get_compression."""
+
+    def __init__(self, path: str):
+        self.path = path
+        compression = get_compression(path)
+        if compression == GZIP:
+            self._raw = open(path, 'rb')
+            self._reader = gzip.GzipFile(fileobj=self._raw)  # type: BinaryIO
+        elif compression == ZSTD:
+            self._reader = ZstdReader(path)
+            self._raw = None
+        else:
+            self._raw = open(path, 'rb')
+            self._reader = self._raw
+
+    @property
+    def position(self) -> int:
+        """How many bytes of the file on disk were read."""
+        if self._raw is None:
+            return self._reader.tell_raw()
+        return self._raw.tell()
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        while True:
+            chunk = self._reader.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._reader.close()
+        if self._raw is not None:
+            self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StatementCounter:
+    """Count the statements in a stream of sql chunks, a statement ends with ';' at the end of a line."""
+
+    def __init__(self):
+        self.count = 0
+        self._last_byte = b''
+
+    def feed(self, chunk: bytes) -> int:
+        if not chunk:
+            return 0
+        count = chunk.count(b';\n')
+        if self._last_byte == b';' and chunk[:1] == b'\n':
+            count += 1
+        self._last_byte = chunk[-1:]
+        self.count += count
+        return count
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    rest = b''
+    for chunk in chunks:
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if rest:
+        yield rest
+
+
+def iter_statements(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Split a mysqldump style dump into statements, a statement ends with the delimiter at the end of a line.
+    Comment lines between statements are skipped, DELIMITER commands are yielded as statements.
+    """
+    delimiter = b';'
+    lines = []
+    for line in iter_lines(chunks):
+        if not lines:
+            stripped = line.strip()
+            if not stripped or stripped.startswith(b'--') or stripped.startswith(b'#'):
+                continue
+            if stripped[:10].upper() == b'DELIMITER ':
+                delimiter = stripped[10:].strip()
+                yield line
+                continue
+        lines.append(line)
+        if line.rstrip().endswith(delimiter):
+            yield b''.join(lines)
+            lines = []
+    if lines:
+        yield b''.join(lines)
+
+
+TABLE_STATEMENT = re.compile(
+    # any version comment but 50001, mysqldump puts the placeholder tables of the views in it
+    rb'^(?:/\*!(?!50001\s)\d{5,6}\s+)?'
+    rb'(?:DROP\s+TABLE\s+IF\s+EXISTS|CREATE\s+TABLE(?:\s+IF\s+NOT\s+EXISTS)?|LOCK\s+TABLES|ALTER\s+TABLE'
+    rb'|INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO)\s+((?:`[^`]+`\.)?`[^`]+`|[\w.$]+)',
+    re.I
+)
+SCHEMA_STATEMENT = re.compile(rb'^(?:/\*!\d+\s+)?(?:CREATE|DROP)\s+(?:DATABASE|SCHEMA)\b', re.I)
+USE_STATEMENT = re.compile(rb'^USE\s+(`[^`]+`|[\w$]+)', re.I)
+SET_STATEMENT = re.compile(rb'^(?:/\*!\d+\s+)?SET\s', re.I)
+UNLOCK_STATEMENT = re.compile(rb'^UNLOCK\s+TABLES', re.I)
+# a user variable and the assignment operator if it's assigned, e.g. @saved_cs_client in
+# SET @saved_cs_client = @@character_set_client or SET character_set_client = @saved_cs_client
+USER_VARIABLE = re.compile(rb'(?<![@\w])@(\w+)(\s*:?=)?')
+
+SESSION = 'session'
+SCHEMA = 'schema'
+TABLE = 'table'
+FINAL = 'final'
+
+
+def split_dump(chunks: Iterable[bytes]) -> Iterator[Tuple[str, Optional[Tuple[bytes, bytes]], bytes]]:
+    """
+    Classify the statements of a dump for loading the tables in parallel, yield (kind, table key, statement):
+        session: SET statements before the first table, every session should run them first
+        schema: CREATE/DROP DATABASE, should run before the tables which follow it
+        table: statements of one table, the key is (database, table), database is the last USE or b''
+        final: views, triggers, routines and anything else, should run in order after all the tables
+    SET statements between tables go with the statement which follows them, except the ones reading a user variable
+    set in another table or in final, e.g. SET sql_mode = @saved_sql_mode after a trigger, they go where it was set.
+    """
+    database = b''
+    current_table = None
+    pending_sets = []
+    seen_statement = False
+    # where the last assignment of every user variable went, the ones set by the session statements aren't kept
+    variable_groups = {}  # type: Dict[bytes, Tuple[str, Optional[Tuple[bytes, bytes]]]]
+
+    def _flush(kind: str, key: Optional[Tuple[bytes, bytes]]):
+        for s in pending_sets:
+            group = (kind, key)
+            variables = USER_VARIABLE.findall(s)
+            for name, assignment in variables:
+                if not assignment and variable_groups.get(name, group) != group:
+                    group = variable_groups[name]
+            for name, assignment in variables:
+                if assignment:
+                    variable_groups[name] = group
+            yield group[0], group[1], s
+        pending_sets.clear()
+
+    for statement in iter_statements(chunks):
+        text = statement.lstrip()
+        if SET_STATEMENT.match(text):
+            if seen_statement:
+                pending_sets.append(statement)
+            else:
+                yield SESSION, None, statement
+            continue
+        seen_statement = True
+
+        table_match = TABLE_STATEMENT.match(text)
+        if table_match or (UNLOCK_STATEMENT.match(text) and current_table):
+            if table_match:
+                name = table_match.group(1)
+                if b'`.`' in name:
+                    table_database, name = name.split(b'`.`', 1)
+                    current_table = (table_database + b'`', b'`' + name)
+                else:
+                    current_table = (database, name)
+            yield from _flush(TABLE, current_table)
+            yield TABLE, current_table, statement
+            continue
+
+        current_table = None
+        yield from _flush(FINAL, None)
+        use_match = USE_STATEMENT.match(text)
+        if use_match:
+            database = use_match.group(1)
+            yield FINAL, None, statement
+        elif SCHEMA_STATEMENT.match(text):
+            yield SCHEMA, None, statement
+        else:
+            yield FINAL, None, statement
+    yield from _flush(FINAL, None)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 10:05
+"""
+Hot standby containers.
+
+When STANDBY_COUNT > 0, every version of a db runs in its own container named myvc.<db id>.<version id>,
+published on a random port, and the proxy of the db (see myvc_app.proxy) listens on the db's port.
+Switching to a version which still has a running container only re-points the proxy,
+the previous container keeps running as a standby.
+The STANDBY_COUNT most recently used standbys of each db are kept, and if STANDBY_MEMORY_BUDGET_MB is set,
+the least recently used standbys of all dbs are stopped until their memory usage fits in it.
+"""
+import time
+from typing import Optional
+
+from docker.errors import APIError, NotFound
+from docker.models.containers import Container
+from requests.exceptions import RequestException
+
+import myvc_app.methods as myvc_methods
+from myvc_app import compaction
+from myvc_app import deltas
+from myvc_app import tracing
+from myvc_app.models.models import DataVersion, DBInfo, ReadyTime, StandbyContainer
+
+
+# how long mysqld gets to shut down cleanly before it's killed
+STOP_TIMEOUT = 60
+
+
+def get_standby_count() -> int:
+    return int(myvc_methods.get_config_value('STANDBY_COUNT', '0'))
+
+
+def is_enabled() -> bool:
+    return get_standby_count() > 0
+
+
+def get_container(standby: StandbyContainer) -> Optional[Container]:
+    container = myvc_methods.get_container_by_id(standby.container_id)
+    return container if container and container.status == 'running' else None
+
+
+def stop_container(container: Container):
+    """
+    Stop mysqld cleanly before removing its container, so the datadir is flushed when it's read or snapshotted.
+    The container is only killed if it doesn't stop in STOP_TIMEOUT seconds.
+    """
+    try:
+        container.stop(timeout=STOP_TIMEOUT)
+        container.wait(timeout=STOP_TIMEOUT)
+        container.remove()
+    except NotFound:
+        pass
+    except (APIError, RequestException):
+        try:
+            container.remove(force=True)
+        except NotFound:
+            pass
+    myvc_methods.invalidate_containers_state()
+
+
+def remove_container(name_or_id: str):
+    try:
+        container = myvc_methods.get_client().containers.get(name_or_id)  # type: Container
+    except NotFound:
+        myvc_methods.invalidate_containers_state()
+        return
+    stop_container(container)
+
+
+def add(db_info: DBInfo, version: DataVersion, container: Container, port: int) -> StandbyContainer:
+    return StandbyContainer.create(
+        db=db_info, version=version, container_id=container.id, port=port, last_used_at=time.time()
+    )
+
+
+@tracing.step
+def start_standby(db_info: DBInfo, version: DataVersion) -> StandbyContainer:
+    deltas.prepare_for_write(version)
+    container = myvc_methods.init_container(db_info, version, internal_port=True)
+    try:
+        port = myvc_methods.get_published_port(container)
+        myvc_methods.wait_until_ready(db_info, container, port=port)
+    except Exception:
+        container.remove(force=True)
+        raise
+    return add(db_info, version, container, port)
+
+
+@tracing.step
+def switch(db_info: DBInfo, version: DataVersion, operation: str) -> float:
+    """Make `version` the current version of the db, return the seconds it took until it's ready."""
+    start_at = time.time()
+    # the container of the db before standby mode was enabled holds the port
+    legacy_container = myvc_methods.get_container_by_name('myvc.{}'.format(db_info.id))
+    if legacy_container:
+        stop_container(legacy_container)
+
+    standby = StandbyContainer.get_or_none(db=db_info, version=version)  # type: StandbyContainer
+    if standby and not get_container(standby):
+        standby.delete_instance()
+        standby = None
+    if not standby:
+        standby = start_standby(db_info, version)
+    # the connections to the former version are handed over by the proxy
+    myvc_methods.start_proxy(db_info, standby.port)
+
+    standby.last_used_at = time.time()
+    standby.save()
+    db_info.current_version = version
+    db_info.container_id = standby.container_id
+    db_info.is_up = True
+    db_info.save()
+    seconds = time.time() - start_at
+    ReadyTime.create(db=db_info, version=version, operation=operation, seconds=seconds)
+    evict(db_info)
+    return seconds
+
+
+def get_memory_usage(standby: StandbyContainer) -> int:
+    container = get_container(standby)
+    if not container:
+        return 0
+    try:
+        return container.stats(stream=False).get('memory_stats', {}).get('usage', 0)
+    except APIError:
+        return 0
+
+
+@tracing.step
+def evict(db_info: DBInfo):
+    """Stop the standbys of `db_info` beyond STANDBY_COUNT, then the standbys of all dbs beyond the memory budget."""
+    standbys = list(
+        StandbyContainer.select().where(
+            StandbyContainer.db == db_info, StandbyContainer.version != db_info.current_version
+        ).order_by(StandbyContainer.last_used_at.desc())
+    )
+    for standby in standbys[get_standby_count():]:
+        stop(standby)
+
+    budget = int(myvc_methods.get_config_value('STANDBY_MEMORY_BUDGET_MB', '0')) * 1024 * 1024
+    if not budget:
+        return
+    used = 0
+    query = StandbyContainer.select(StandbyContainer, DBInfo).join(DBInfo).order_by(
+        StandbyContainer.last_used_at.desc()
+    )
+    for standby in query:
+        # the containers of the current versions are not standbys
+        if standby.version_id == standby.db.current_version_id:
+            continue
+        usage = get_memory_usage(standby)
+        if used + usage > budget:
+            stop(standby)
+        else:
+            used += usage
+
+
+def stop(standby: StandbyContainer):
+    remove_container(standby.container_id)
+    standby.delete_instance()
+    compaction.start_background(compaction.get_candidates(standby.version))
+
+
+def stop_standby(version: DataVersion) -> bool:
+    """Stop the container of `version` before its volume is read or written, return whether there was one."""
+    standby = StandbyContainer.get_or_none(version=version)  # type: StandbyContainer
+    if not standby:
+        return False
+    remove_container(standby.container_id)
+    standby.delete_instance()
+    return True
+
+
+def stop_all(db_id: int):
+    for standby in StandbyContainer.select().where(StandbyContainer.db == db_id):
+        remove_container(standby.container_id)
+        standby.delete_instance()
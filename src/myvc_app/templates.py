@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/20 16:30
+"""
+Datadir templates.
+
+The first start of mysqld on an empty datadir initializes it, which takes tens of seconds.
+A template is a datadir initialized once by a temporary mysqld and shut down cleanly,
+the datadir of a new db or a cleared version is copied from it by the snapshot backend instead.
+What the initialization depends on makes the key of a template: the image, the mysql conf of the db
+(the content of its conf volume) and the root password, so a template of another image or conf is never used.
+The templates of other images are removed when a new one is built, and only the DATADIR_TEMPLATES most recently
+used ones are kept, 0 disables the templates.
+"""
+import hashlib
+import threading
+import time
+from typing import Optional
+
+from docker.errors import APIError
+from docker.models.containers import Container
+from docker.models.images import Image
+from docker.models.volumes import Volume
+
+import myvc_app.methods as myvc_methods
+from myvc_app import tracing
+from myvc_app.models.models import DatadirTemplate, DBInfo
+from myvc_app.utils import get_id
+
+# the templates are built and copied one at a time, so one isn't removed while it's copied
+_lock = threading.Lock()
+
+
+def get_template_count() -> int:
+    return int(myvc_methods.get_config_value('DATADIR_TEMPLATES', '2'))
+
+
+def get_conf_hash(conf_volume: Volume) -> str:
+    with myvc_methods.volume_container(conf_volume) as (container, (path,)):
+        exit_code, output = container.exec_run(
+            ['bash', '-c', "find {} -type f -name '*.cnf' | sort | xargs -r cat | sha1sum".format(path)]
+        )
+    if exit_code != 0:
+        raise Exception('read the mysql conf of {} failed: {}'.format(conf_volume.name, output.decode(errors='replace')))
+    return output.split()[0].decode()
+
+
+def get_key(image: Image, conf_hash: str, password: str) -> str:
+    return hashlib.sha1('\0'.join([image.id, conf_hash, password]).encode('utf8')).hexdigest()
+
+
+@tracing.step
+def build(db_info: DBInfo, image: Image) -> Volume:
+    """Initialize a datadir by a temporary mysqld with the conf and the password of `db_info`."""
+    volume = myvc_methods.create_volume('template')
+    try:
+        container = myvc_methods.get_client().containers.run(
+            image, name='myvc.template.{}'.format(get_id()),
+            volumes={
+                db_info.conf_volume: {'bind': '/etc/mysql/conf.d', 'mode': 'ro'},
+                volume.name: {'bind': '/var/lib/mysql', 'mode': 'rw'},
+            },
+            ports={'3306/tcp': None},
+            environment={'MYSQL_ROOT_PASSWORD': db_info.password},
+            labels={myvc_methods.LABEL: 'temp'},
+            detach=True,
+        )  # type: Container
+        try:
+            myvc_methods.wait_until_ready(db_info, container, port=myvc_methods.get_published_port(container))
+            container.stop(timeout=60)
+            container.wait()
+        finally:
+            container.remove(force=True)
+        # the copies would share the server_uuid, mysqld writes a new one at start when it's missing
+        with myvc_methods.volume_container(volume) as (container, (path,)):
+            exit_code, output = container.exec_run(['rm', '-f', '{}/auto.cnf'.format(path)])
+        if exit_code:
+            raise Exception('remove the server_uuid of template {} failed: {}'.format(
+                volume.name, output.decode(errors='replace')
+            ))
+    except Exception:
+        myvc_methods.remove_volume(volume, force=True)
+        raise
+    return volume
+
+
+def drop(template: DatadirTemplate):
+    try:
+        myvc_methods.rm_volume_by_name(template.volume)
+    except APIError:
+        # left to `gc`
+        pass
+    template.delete_instance()
+
+
+def evict(image: Image, count: int):
+    """Drop the templates of other images and the least recently used ones beyond `count`."""
+    for template in DatadirTemplate.select().where(DatadirTemplate.image_id != image.id):
+        drop(template)
+    query = DatadirTemplate.select().order_by(DatadirTemplate.last_used_at.desc()).offset(count)
+    for template in list(query):
+        drop(template)
+
+
+def get_template(db_info: DBInfo, image: Image) -> Volume:
+    """The template volume for the image, conf and password of `db_info`, built if missing. Call it with _lock held."""
+    key = get_key(image, get_conf_hash(myvc_methods.get_volume_by_name(db_info.conf_volume)), db_info.password)
+    template = DatadirTemplate.get_or_none(key=key)  # type: Optional[DatadirTemplate]
+    volume = myvc_methods.get_volume_by_name(template.volume) if template else None
+    if template and not volume:
+        template.delete_instance()
+        template = None
+    if not template:
+        volume = build(db_info, image)
+        template = DatadirTemplate.create(key=key, volume=volume.name, image_id=image.id, last_used_at=time.time())
+    else:
+        template.last_used_at = time.time()
+        template.save()
+    evict(image, get_template_count())
+    return volume
+
+
+@tracing.step
+def fill(db_info: DBInfo, volume: Volume) -> bool:
+    """
+    Replace the content of `volume` by an initialized datadir for `db_info`, whose conf volume must be set.
+    Return False if the templates are disabled, mysqld initializes the empty datadir at its first start then.
+    """
+    if get_template_count() <= 0:
+        return False
+    image = myvc_methods.get_mysql_image()
+    with _lock:
+        myvc_methods.copy_volume(get_template(db_info, image), volume)
+    return True
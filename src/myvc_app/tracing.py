@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/19 22:00
+"""
+Timing of the operations.
+
+Every operation of `myvc_app.methods` is a span, its duration is kept as an OperationTime row for `myvc stats`,
+the last MAX_OPERATION_TIMES of them.
+With the TRACE config on (or MYVC_TRACE=on), the steps inside an operation, the docker api requests
+and the sqlite queries are nested spans too, and they are appended to APP_DATA_DIR/trace.json
+in the trace event format, which chrome://tracing and https://ui.perfetto.dev open.
+The trace is an array without the closing bracket, both viewers accept that, so it's only ever appended to.
+The spans of the worker threads of utils.OutputThreadPoolExecutor are nested in the span which created it.
+"""
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from urllib.parse import urlparse
+
+from myvc_app import config
+from myvc_app.models.models import Config, OperationTime
+
+TRACE_PATH = config.APP_DATA_DIR.joinpath('trace.json')
+# the trace is moved to trace.1.json when it grows over it
+MAX_TRACE_SIZE = 100 * 1024 * 1024
+# the OperationTime rows kept, the older ones are deleted every PRUNE_INTERVAL operations
+MAX_OPERATION_TIMES = 10000
+PRUNE_INTERVAL = 100
+OPERATION = 'operation'
+STEP = 'step'
+
+_local = threading.local()
+_write_lock = threading.Lock()
+_enabled_lock = threading.Lock()
+_enabled = None  # type: Optional[bool]
+
+
+def is_enabled() -> bool:
+    """Whether the steps are traced, read once per process."""
+    global _enabled
+    if _enabled is None:
+        # the query of the config must not be traced itself
+        if getattr(_local, 'reading_config', False):
+            return False
+        with _enabled_lock:
+            if _enabled is None:
+                _local.reading_config = True
+                try:
+                    cfg = Config.get_or_none(key='TRACE')  # type: Config
+                    _enabled = os.environ.get('MYVC_TRACE', cfg.value if cfg else 'off') == 'on'
+                finally:
+                    _local.reading_config = False
+    return _enabled
+
+
+class Span:
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start_at = time.time()
+        self.end_at = None  # type: Optional[float]
+        # the finished spans of the trace, only kept by the root span
+        self.events = []  # type: List[dict]
+
+    @property
+    def seconds(self) -> float:
+        return (self.end_at or time.time()) - self.start_at
+
+    def to_event(self) -> dict:
+        return {
+            'name': self.name, 'cat': self.category, 'ph': 'X',
+            'ts': int(self.start_at * 1000000), 'dur': int(self.seconds * 1000000),
+            'pid': os.getpid(), 'tid': threading.get_native_id(), 'args': self.args,
+        }
+
+
+def _get_stack() -> List[Span]:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def inherit() -> Callable[[], None]:
+    """An initializer for the worker threads of the current thread, their spans are nested in its current span."""
+    stack = list(getattr(_local, 'stack', None) or [])
+
+    def _initializer():
+        # a copy, the worker pushes and pops its own spans
+        _local.stack = list(stack)
+    return _initializer
+
+
+def is_tracing() -> bool:
+    """Whether the code running in this thread is inside a traced operation."""
+    return bool(getattr(_local, 'stack', None)) and is_enabled()
+
+
+@contextmanager
+def span(name: str, category: str = STEP, **args):
+    """
+    Time the block as a span. An operation outside of any other span is the root of a trace,
+    the other spans are only recorded inside an operation and when tracing is on.
+    """
+    stack = _get_stack()
+    is_root = not stack
+    if is_root and category != OPERATION or not is_root and not is_enabled():
+        yield None
+        return
+    current = Span(name, category, args)
+    stack.append(current)
+    failed = False
+    try:
+        yield current
+    except BaseException:
+        failed = True
+        current.args['error'] = True
+        raise
+    finally:
+        stack.pop()
+        current.end_at = time.time()
+        if is_enabled():
+            (stack[0] if stack else current).events.append(current.to_event())
+        if is_root:
+            row = OperationTime.create(operation=name, seconds=current.seconds, failed=failed)
+            if row.id % PRUNE_INTERVAL == 0:
+                OperationTime.delete().where(OperationTime.id <= row.id - MAX_OPERATION_TIMES).execute()
+            if is_enabled():
+                write_events(current.events)
+
+
+def annotate(**args):
+    """Add values, e.g. the bytes copied, to the current span."""
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1].args.update(args)
+
+
+def write_events(events: List[dict]):
+    content = ''.join(json.dumps(e) + ',\n' for e in events)
+    with _write_lock:
+        os.makedirs(TRACE_PATH.parent, exist_ok=True)
+        if TRACE_PATH.exists() and TRACE_PATH.stat().st_size > MAX_TRACE_SIZE:
+            os.replace(TRACE_PATH, TRACE_PATH.with_suffix('.1.json'))
+        # one write in append mode, the processes writing at the same time don't mix their lines
+        with open(TRACE_PATH, 'a') as f:
+            f.write(('[\n' if f.tell() == 0 else '') + content)
+
+
+def _traced(category: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(func.__name__, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# @operation for the operations run by the commands, @step for the parts of them worth seeing in a trace
+operation = _traced(OPERATION)
+step = _traced(STEP)
+
+
+def trace_docker(client):
+    """Trace the requests of a docker client as spans named by the method and path."""
+    api = client.api
+    request = api.request
+
+    def _request(method, url, *args, **kwargs):
+        if not is_tracing():
+            return request(method, url, *args, **kwargs)
+        path = urlparse(url).path
+        # drop the api version, e.g. /v1.41
+        if path.startswith('/v') and path.count('/') > 1:
+            path = path[path.index('/', 1):]
+        data = kwargs.get('data')
+        with span('{} {}'.format(method, path), 'docker') as current:
+            if isinstance(data, (bytes, str)):
+                current.args['bytes_in'] = len(data)
+            response = request(method, url, *args, **kwargs)
+            current.args['status'] = response.status_code
+            length = response.headers.get('Content-Length')
+            if length:
+                current.args['bytes_out'] = int(length)
+            return response
+
+    api.request = _request
+
+
+def trace_sqlite(db):
+    """Trace the queries of a peewee database."""
+    execute_sql = db.execute_sql
+
+    def _execute_sql(sql, params=None, *args, **kwargs):
+        if not is_tracing():
+            return execute_sql(sql, params, *args, **kwargs)
+        with span('sqlite', 'sqlite', sql=sql[:200]):
+            return execute_sql(sql, params, *args, **kwargs)
+
+    db.execute_sql = _execute_sql
+
+
+def get_percentile(sorted_values: List[float], percent: float) -> float:
+    # nearest rank
+    return sorted_values[max(0, math.ceil(len(sorted_values) * percent / 100) - 1)]
+
+
+def get_stats() -> List[dict]:
+    """
+    The latency of every operation from the history, slowest p95 first:
+        {'operation': 'apply_version', 'count': 12, 'failed': 1, 'p50': 3.2, 'p95': 8.1, 'max': 9.0}
+    """
+    query = OperationTime.select(OperationTime.operation, OperationTime.seconds, OperationTime.failed)
+    times = {}
+    failed = {}
+    for row in query.iterator():
+        times.setdefault(row.operation, []).append(row.seconds)
+        failed[row.operation] = failed.get(row.operation, 0) + row.failed
+    stats = []
+    for name, seconds in times.items():
+        seconds.sort()
+        stats.append({
+            'operation': name, 'count': len(seconds), 'failed': failed[name],
+            'p50': get_percentile(seconds, 50), 'p95': get_percentile(seconds, 95), 'max': seconds[-1],
+        })
+    return sorted(stats, key=lambda s: s['p95'], reverse=True)
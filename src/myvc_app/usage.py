@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+# Created by CaoDa on 2026/10/20 10:40
+"""
+Disk usage of the versions.
+
+The size of a version is the size of its volume (`du` in the helper container), the volumes are scanned in parallel.
+The sizes are kept in the VolumeUsage table and reused by the next scans: only the volume of the current version
+of a db or of a standby is written by mysqld, the other ones only change by copy_volume and clean_volume,
+which forget their sizes, and by mysqld once a container mounts them, which forgets their sizes too.
+A volume scanned while in use is scanned again every time. `show db` only reads the kept sizes and scans nothing,
+the ones of the volumes in use are shown as possibly stale.
+
+The reclaimable size of a branch is what `rm branch` frees: the size of the branch and all its children.
+Chunked versions keep their data in the shared chunk store and have no size here, and with a copy-on-write
+snapshot backend the volumes share blocks, so the sizes are what each volume would take on its own.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from peewee import chunked
+
+import myvc_app.methods as myvc_methods
+from myvc_app.models.base import DB
+from myvc_app.models.models import DataVersion, DBInfo, StandbyContainer, VolumeUsage
+
+
+def get_in_use_volumes() -> Set[str]:
+    query = DataVersion.select(DataVersion.volume).where(
+        DataVersion.id.in_(DBInfo.select(DBInfo.current_version))
+        | DataVersion.id.in_(StandbyContainer.select(StandbyContainer.version))
+    )
+    return {v.volume for v in query}
+
+
+def scan_volume(name: str) -> Optional[int]:
+    volume = myvc_methods.get_volume_by_name(name)
+    if not volume:
+        return None
+    with myvc_methods.volume_container(volume) as (container, (path,)):
+        return myvc_methods.get_volume_size(container, path)
+
+
+def scan(
+    volumes: Iterable[str], full: bool = False, jobs: int = None, cached: bool = False
+) -> Dict[str, Optional[int]]:
+    """
+    The sizes of `volumes` by name, None if unknown. Only the ones which may have changed are scanned unless `full`,
+    none of them with `cached`, which returns the kept sizes only, also the ones of the volumes in use,
+    which may be stale, see `get_in_use_volumes`.
+    """
+    jobs = jobs or int(myvc_methods.get_config_value('DU_JOBS', '8'))
+    volumes = set(volumes)
+    in_use = get_in_use_volumes()
+    sizes = {}
+    if not full:
+        for u in VolumeUsage.select().iterator():
+            if u.volume in volumes and (cached or not u.in_use and u.volume not in in_use):
+                sizes[u.volume] = u.size
+    if cached:
+        return sizes
+    to_scan = sorted(volumes - set(sizes))
+
+    def _scan(name: str) -> Optional[int]:
+        try:
+            return scan_volume(name)
+        finally:
+            DB.close()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        scanned = dict(zip(to_scan, executor.map(_scan, to_scan)))
+    rows = [
+        {'volume': name, 'size': size, 'in_use': name in in_use, 'create_at': datetime.now()}
+        for name, size in scanned.items() if size is not None
+    ]
+    with DB.atomic():
+        for batch in chunked(rows, 100):
+            VolumeUsage.insert_many(batch).on_conflict_replace().execute()
+    sizes.update(scanned)
+    return sizes
+
+
+def forget(volumes: Iterable[str]):
+    """The volumes are written or removed, their sizes are scanned again next time."""
+    for batch in chunked(volumes, 100):
+        VolumeUsage.delete().where(VolumeUsage.volume.in_(batch)).execute()
+
+
+def get_version_sizes(
+    versions: Iterable[DataVersion], full: bool = False, cached: bool = False
+) -> Dict[int, Optional[int]]:
+    versions = list(versions)
+    sizes = scan({v.volume for v in versions}, full, cached=cached)
+    return {v.id: sizes.get(v.volume) for v in versions}
+
+
+def get_subtree_sizes(versions: List[DataVersion], sizes: Dict[int, Optional[int]]) -> Dict[int, int]:
+    """The size of every version and all its children, `versions` must hold whole trees."""
+    totals = {v.id: sizes.get(v.id) or 0 for v in versions}
+    # the deepest first, so a version is added to its parent after all its children
+    for v in sorted(versions, key=lambda v: v.path.count('/'), reverse=True):
+        if v.parent_id in totals:
+            totals[v.parent_id] += totals[v.id]
+    return totals
+
+
+def get_branch_usage(full: bool = False) -> List[dict]:
+    """
+    A row per version of every db, the largest reclaimable first:
+        {'db_id': 1, 'db_name': 'test', 'version_id': 3, 'volume': '...', 'name': 'dev',
+         'size': 1024, 'reclaimable': 4096, 'versions': 3, 'removable': True}
+    `size` is None when unknown, `versions` counts the branch and its children.
+    The root, the current version and its parents can't be removed, their reclaimable size is 0.
+    """
+    db_infos = {db_info.id: db_info for db_info in DBInfo.select()}
+    versions = list(DataVersion.select())
+    sizes = get_version_sizes(versions, full)
+    totals = get_subtree_sizes(versions, sizes)
+    counts = get_subtree_sizes(versions, {v.id: 1 for v in versions})
+    current_paths = [
+        v.path for v in DataVersion.select(DataVersion.path).where(
+            DataVersion.id.in_(DBInfo.select(DBInfo.current_version))
+        )
+    ]
+    rows = []
+    for v in versions:
+        removable = bool(v.parent_id) and not any(path.startswith(v.path) for path in current_paths)
+        db_info = db_infos.get(v.db_id)
+        rows.append({
+            'db_id': v.db_id, 'db_name': db_info.name if db_info else '', 'version_id': v.id,
+            'volume': v.volume, 'name': v.name, 'size': sizes[v.id],
+            'reclaimable': totals[v.id] if removable else 0, 'versions': counts[v.id], 'removable': removable,
+        })
+    rows.sort(key=lambda r: r['reclaimable'], reverse=True)
+    return rows
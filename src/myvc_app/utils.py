@@ -1,9 +1,28 @@
 #!/usr/bin/env python
 # -*- encoding: UTF-8 -*-
 # Created by CaoDa on 2021/7/11 13:04
+import concurrent.futures
 import datetime
+import importlib.util
+import io
+import re
 import socket
+import sys
 import time
+from typing import Iterable
+
+
+def lazy_import(name: str):
+    """Import a module on its first attribute access, heavy modules only slow down the commands using them."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
 
 
 def get_id():
@@ -20,5 +39,122 @@ def is_port_in_use(port, wait_seconds=0):
         return s.connect_ex(('127.0.0.1', port)) == 0
 
 
+def is_mysql_ready(port: int, host: str = '127.0.0.1', timeout: float = 1) -> bool:
+    """
+    Whether a mysql server answers on `port` with its handshake packet.
+    A port published by docker accepts connections before mysqld listens, so connecting is not enough.
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as s:
+            data = b''
+            while len(data) < 5:
+                received = s.recv(5 - len(data))
+                if not received:
+                    return False
+                data += received
+    except OSError:
+        return False
+    # protocol version 10 handshake, or an error packet which is also sent by a running server
+    return data[4] in (10, 0xff)
+
+
 def get_current_datetime_str():
     return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_docker_time(text: str) -> float:
+    """The timestamp of a time from the docker api, e.g. 2026-10-19T10:00:00.123456789Z or 2026-10-19T18:00:00+08:00."""
+    match = re.match(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?(Z|[+-]\d\d:?\d\d)?$', text)
+    if not match:
+        raise ValueError('unknown time format: {}'.format(text))
+    zone = match.group(2) or 'Z'
+    zone = '+0000' if zone == 'Z' else zone.replace(':', '')
+    return datetime.datetime.strptime(match.group(1) + zone, '%Y-%m-%dT%H:%M:%S%z').timestamp()
+
+
+class IterStream(io.RawIOBase):
+    """Readable file object over an iterable of bytes chunks, e.g. the stream of `Container.get_archive`."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def format_size(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return '{:.1f}{}'.format(size, unit)
+        size /= 1024
+    return '{:.1f}TB'.format(size)
+
+
+class OutputThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    A ThreadPoolExecutor whose workers print where the thread creating it prints, and trace in its current span.
+    In myvcd sys.stdout sends what a thread prints to the client of its operation, see myvc_app.daemon.
+    """
+
+    def __init__(self, max_workers: int = None):
+        from myvc_app import tracing
+        initializers = [tracing.inherit()]
+        inherit_output = getattr(sys.stdout, 'inherit', None)
+        if inherit_output:
+            initializers.append(inherit_output())
+
+        def _initializer():
+            for initializer in initializers:
+                initializer()
+        super().__init__(max_workers=max_workers, initializer=_initializer)
+
+
+class Progress:
+    """Print the processed size, throughput and optional counted items on one line."""
+
+    def __init__(self, title: str, total: int = None, unit: str = None, interval: float = 0.5):
+        self.title = title
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.size = 0
+        self.count = 0
+        self.position = None
+        self.start_at = time.time()
+        self._printed_at = 0
+
+    def update(self, size: int, count: int = 0, position: int = None):
+        self.size += size
+        self.count += count
+        if position is not None:
+            self.position = position
+        if time.time() - self._printed_at >= self.interval:
+            self.print()
+
+    def print(self, end=''):
+        self._printed_at = time.time()
+        seconds = max(self._printed_at - self.start_at, 0.001)
+        parts = ['{}: {}'.format(self.title, format_size(self.size)), '{}/s'.format(format_size(self.size / seconds))]
+        if self.unit:
+            parts.append('{:.0f} {}/s'.format(self.count / seconds, self.unit))
+        if self.total:
+            position = self.size if self.position is None else self.position
+            parts.append('{:.1f}%'.format(position * 100 / self.total))
+        print('\r' + '  '.join(parts), end=end, flush=True)
+
+    def finish(self):
+        self.print(end='\n')
+        from myvc_app import tracing
+        tracing.annotate(bytes=self.size, count=self.count)